@@ -0,0 +1,407 @@
+from Parser import VMCommand, PUSH, LABEL, GOTO, IFGOTO, NOT, EQUALS, \
+    GREATER_THEN, LOWER_THEN, CONSTANT, BRANCHES, TERMINATORS
+
+# the commands that always leave -1 or 0 on the stack.
+COMPARISONS = (EQUALS, GREATER_THEN, LOWER_THEN)
+# the most commands of a loop test copied to the bottom of the loop, and of
+# the end of a loop copied over a goto to it.
+MAX_ROTATED_TEST = 8
+MAX_DUPLICATED_TAIL = 12
+# added to the label of a loop to name the label of its body.
+BODY_SUFFIX = "$BODY"
+
+
+class BasicBlock:
+    """
+    a run of vm commands that always runs from start to end. labels are the
+    names the block can be jumped to by, and only the last command can be a
+    goto, if-goto or return.
+    """
+    __slots__ = ("labels", "commands", "successors", "predecessors")
+
+    def __init__(self):
+        self.labels = list()
+        self.commands = list()
+        self.successors = list()
+        self.predecessors = list()
+
+    def terminator(self):
+        """
+        :return: (VMCommand) the goto/if-goto/return ending the block, or None
+        if the block falls through to the next one.
+        """
+        if self.commands and self.commands[-1].kind in TERMINATORS:
+            return self.commands[-1]
+        return None
+
+    def falls_through(self):
+        """
+        :return: (bool) True if the block can continue to the block after it.
+        """
+        terminator = self.terminator()
+        return terminator is None or terminator.kind == IFGOTO
+
+    def only_jump(self):
+        """
+        :return: (str) the target of the block if all it does is a goto, else
+        None.
+        """
+        if len(self.commands) == 1 and self.commands[0].kind == GOTO:
+            return self.commands[0].arg1
+        return None
+
+
+class ControlFlowGraph:
+    """
+    the basic blocks of the commands of one function, kept in the order they
+    are written out. closed is False when a branch targets a label that is
+    not in the commands, in which case the graph is not safe to change.
+    """
+    __slots__ = ("blocks", "label_blocks", "closed")
+
+    def __init__(self, commands):
+        self.blocks = list()
+        block = BasicBlock()
+        for command in commands:
+            if command.kind == LABEL:
+                # a label starts a new block, unless the block so far is only
+                # other labels.
+                if block.commands:
+                    self.blocks.append(block)
+                    block = BasicBlock()
+                block.labels.append(command.arg1)
+            else:
+                block.commands.append(command)
+                if command.kind in TERMINATORS:
+                    self.blocks.append(block)
+                    block = BasicBlock()
+        if block.labels or block.commands:
+            self.blocks.append(block)
+        self.link()
+
+    def link(self):
+        """
+        works out the successors and predecessors of every block again, to be
+        called after the blocks are changed.
+        """
+        self.closed = True
+        self.label_blocks = dict()
+        for block in self.blocks:
+            block.successors = list()
+            block.predecessors = list()
+            for label in block.labels:
+                self.label_blocks[label] = block
+        for index, block in enumerate(self.blocks):
+            terminator = block.terminator()
+            if terminator is not None and terminator.kind in BRANCHES:
+                target = self.label_blocks.get(terminator.arg1)
+                if target is None:
+                    self.closed = False
+                else:
+                    block.successors.append(target)
+            if block.falls_through() and index + 1 < len(self.blocks):
+                following = self.blocks[index + 1]
+                if following not in block.successors:
+                    block.successors.append(following)
+        for block in self.blocks:
+            for successor in block.successors:
+                successor.predecessors.append(block)
+
+    def entry(self):
+        """
+        :return: (BasicBlock) the block the commands start at, None if there
+        are no commands.
+        """
+        return self.blocks[0] if self.blocks else None
+
+    def reachable(self):
+        """
+        :return: (set) the blocks that can be reached from the entry block.
+        """
+        seen = set()
+        stack = [self.entry()] if self.blocks else []
+        while stack:
+            block = stack.pop()
+            if block in seen:
+                continue
+            seen.add(block)
+            stack.extend(block.successors)
+        return seen
+
+    def referenced_labels(self):
+        """
+        :return: (set) the labels some goto or if-goto jumps to.
+        """
+        labels = set()
+        for block in self.blocks:
+            terminator = block.terminator()
+            if terminator is not None and terminator.kind in BRANCHES:
+                labels.add(terminator.arg1)
+        return labels
+
+    def commands(self):
+        """
+        :return: (list) the commands of all the blocks in order, with their
+        labels.
+        """
+        commands = list()
+        for block in self.blocks:
+            for label in block.labels:
+                commands.append(VMCommand(LABEL, label))
+            commands.extend(block.commands)
+        return commands
+
+
+def is_boolean(commands, index):
+    """
+    checks if the command at index always leaves -1 or 0 on the stack, in
+    which case the value can be flipped by a not.
+    :param commands: (list) the commands of a block.
+    :param index: (int) the index of the command that made the value.
+    :return: (bool) True if the value is known to be a boolean.
+    """
+    while index >= 0 and commands[index].kind == NOT:
+        index -= 1
+    return index >= 0 and commands[index].kind in COMPARISONS
+
+
+def final_target(cfg, label):
+    """
+    follows a chain of blocks that only jump somewhere else.
+    :param cfg: (ControlFlowGraph) the graph of the function.
+    :param label: (str) the label first jumped to.
+    :return: (str) the label at the end of the chain.
+    """
+    seen = {label}
+    block = cfg.label_blocks.get(label)
+    while block is not None and block.only_jump() is not None:
+        label = block.only_jump()
+        if label in seen:
+            # a loop of gotos, there is no end to jump to.
+            break
+        seen.add(label)
+        block = cfg.label_blocks.get(label)
+    return label
+
+
+def thread_jumps(cfg):
+    """
+    makes every goto/if-goto that targets a block holding only a goto jump
+    straight to where that goto leads.
+    :param cfg: (ControlFlowGraph) the graph of the function.
+    :return: (bool) True if a jump was changed.
+    """
+    changed = False
+    for block in cfg.blocks:
+        terminator = block.terminator()
+        if terminator is None or terminator.kind not in BRANCHES:
+            continue
+        target = final_target(cfg, terminator.arg1)
+        if target != terminator.arg1:
+            block.commands[-1] = VMCommand(terminator.kind, target)
+            changed = True
+    return changed
+
+
+def invert_branches(cfg):
+    """
+    turns "if-goto A; goto B; label A" to "not; if-goto B; label A" when the
+    condition is a boolean, so the false path does not jump twice. a not
+    right before the if-goto is removed instead of adding another.
+    :param cfg: (ControlFlowGraph) the graph of the function.
+    :return: (bool) True if a branch was inverted.
+    """
+    changed = False
+    referenced = cfg.referenced_labels()
+    index = 0
+    while index + 2 < len(cfg.blocks):
+        block, jump_block, target_block = cfg.blocks[index:index + 3]
+        terminator = block.terminator()
+        if (terminator is not None and terminator.kind == IFGOTO
+                and terminator.arg1 in target_block.labels
+                and jump_block.only_jump() is not None
+                and not referenced.intersection(jump_block.labels)
+                and is_boolean(block.commands, len(block.commands) - 2)):
+            if block.commands[-2].kind == NOT:
+                del block.commands[-2]
+            else:
+                block.commands.insert(-1, VMCommand(NOT))
+            block.commands[-1] = VMCommand(IFGOTO, jump_block.only_jump())
+            del cfg.blocks[index + 1]
+            changed = True
+        index += 1
+    return changed
+
+
+def remove_fallthrough_jumps(cfg):
+    """
+    removes a goto that jumps to the block right after it.
+    :param cfg: (ControlFlowGraph) the graph of the function.
+    :return: (bool) True if a goto was removed.
+    """
+    changed = False
+    for block, following in zip(cfg.blocks, cfg.blocks[1:]):
+        terminator = block.terminator()
+        if (terminator is not None and terminator.kind == GOTO
+                and terminator.arg1 in following.labels):
+            block.commands.pop()
+            changed = True
+    return changed
+
+
+def remove_unreachable_blocks(cfg):
+    """
+    removes the blocks that can not be reached from the start of the
+    function, like code right after a goto with no label.
+    :param cfg: (ControlFlowGraph) the graph of the function.
+    :return: (bool) True if a block was removed.
+    """
+    reachable = cfg.reachable()
+    blocks = [block for block in cfg.blocks if block in reachable]
+    changed = len(blocks) != len(cfg.blocks)
+    cfg.blocks = blocks
+    return changed
+
+
+def remove_unused_labels(cfg):
+    """
+    removes labels nothing jumps to, so the blocks around them can be joined.
+    :param cfg: (ControlFlowGraph) the graph of the function.
+    :return: (bool) True if a label was removed.
+    """
+    changed = False
+    referenced = cfg.referenced_labels()
+    for block in cfg.blocks:
+        labels = [label for label in block.labels if label in referenced]
+        if len(labels) != len(block.labels):
+            block.labels = labels
+            changed = True
+    return changed
+
+
+def optimize_control_flow(commands):
+    """
+    runs all the control flow passes on the commands of a function until none
+    of them changes anything.
+    :param commands: (list) the commands of one function.
+    :return: (list) the optimized commands.
+    """
+    cfg = ControlFlowGraph(commands)
+    if not cfg.closed:
+        return commands
+    changed = True
+    while changed:
+        changed = thread_jumps(cfg)
+        cfg.link()
+        changed = invert_branches(cfg) or changed
+        cfg.link()
+        changed = remove_fallthrough_jumps(cfg) or changed
+        cfg.link()
+        changed = remove_unreachable_blocks(cfg) or changed
+        changed = remove_unused_labels(cfg) or changed
+        # building the graph again joins the blocks that lost their labels or
+        # their jumps.
+        cfg = ControlFlowGraph(cfg.commands())
+    return cfg.commands()
+
+
+def continue_test(commands):
+    """
+    :param commands: (list) the commands of a loop header, ending with the
+    if-goto that leaves the loop.
+    :return: (list) commands computing the same condition that leave a value
+    that is not 0 exactly when the loop goes on.
+    """
+    test = commands[:-1]
+    if (test and test[-1].kind == NOT
+            and is_boolean(test, len(test) - 2)):
+        return test[:-1]
+    if is_boolean(test, len(test) - 1):
+        return test + [VMCommand(NOT)]
+    return test + [VMCommand(PUSH, CONSTANT, 0), VMCommand(EQUALS)]
+
+
+def rotate_loop_tests(cfg):
+    """
+    turns "label L; test; if-goto END; body; goto L; label END" into
+    "label L; test; if-goto END; label L$BODY; body; test'; if-goto L$BODY;
+    label END", so each time around the loop takes one jump instead of two.
+    the test stays at the top for the first time in.
+    :param cfg: (ControlFlowGraph) the graph of the function.
+    :return: (int) how many loops were rotated.
+    """
+    positions = {block: index for index, block in enumerate(cfg.blocks)}
+    rotated = 0
+    for index, header in enumerate(cfg.blocks):
+        terminator = header.terminator()
+        if (terminator is None or terminator.kind != IFGOTO
+                or not header.labels
+                or len(header.commands) - 1 > MAX_ROTATED_TEST
+                or terminator.arg1 not in cfg.label_blocks):
+            continue
+        end = positions[cfg.label_blocks[terminator.arg1]]
+        # the body is every block between the header and the end, and the
+        # last of them jumps back to the header.
+        if end <= index + 1:
+            continue
+        latch = cfg.blocks[end - 1]
+        back = latch.terminator()
+        body_label = header.labels[0] + BODY_SUFFIX
+        if (back is None or back.kind != GOTO
+                or back.arg1 not in header.labels
+                or body_label in cfg.label_blocks):
+            continue
+        cfg.blocks[index + 1].labels.append(body_label)
+        cfg.label_blocks[body_label] = cfg.blocks[index + 1]
+        latch.commands[-1:] = (continue_test(header.commands)
+                               + [VMCommand(IFGOTO, body_label)])
+        rotated += 1
+    return rotated
+
+
+def duplicate_loop_tails(cfg):
+    """
+    replaces a goto to the last block of a rotated loop by a copy of that
+    block followed by a goto to the block after the loop, so the path
+    through the loop that ended in the goto runs straight on to the test.
+    :param cfg: (ControlFlowGraph) the graph of the function.
+    :return: (int) how many gotos were replaced.
+    """
+    positions = {block: index for index, block in enumerate(cfg.blocks)}
+    duplicated = 0
+    for block in cfg.blocks:
+        terminator = block.terminator()
+        if terminator is None or terminator.kind != GOTO:
+            continue
+        tail = cfg.label_blocks.get(terminator.arg1)
+        if tail is None or tail is block:
+            continue
+        index = positions[tail]
+        back = tail.terminator()
+        if (back is None or back.kind != IFGOTO
+                or not back.arg1.endswith(BODY_SUFFIX)
+                or len(tail.commands) > MAX_DUPLICATED_TAIL
+                or index + 1 >= len(cfg.blocks)
+                or not cfg.blocks[index + 1].labels):
+            continue
+        block.commands[-1:] = tail.commands + [
+            VMCommand(GOTO, cfg.blocks[index + 1].labels[0])]
+        duplicated += 1
+    return duplicated
+
+
+def rotate_loops(commands):
+    """
+    rotates the loops of a function so their test is at the bottom, and
+    lays their bodies out to run straight to it.
+    :param commands: (list) the commands of one function.
+    :return: (tuple) the new commands and how many loops were rotated.
+    """
+    cfg = ControlFlowGraph(commands)
+    if not cfg.closed:
+        return commands, 0
+    rotated = rotate_loop_tests(cfg)
+    if rotated:
+        cfg.link()
+        duplicate_loop_tails(cfg)
+    return cfg.commands(), rotated
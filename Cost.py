@@ -0,0 +1,383 @@
+import json
+
+from ControlFlow import ControlFlowGraph
+from Instructions import A_INSTRUCTION, C_INSTRUCTION, L_INSTRUCTION, \
+    JUMP_CODES
+from Parser import LABEL, FUNCTION, TERMINATORS
+
+# how many times a loop is taken to run, as nothing tells how many it does.
+LOOP_TRIPS = 10
+ALWAYS = JUMP_CODES["JMP"]
+# the most times the loop of a routine runs, once for each bit of a word.
+WORD_BITS = 16
+# the digits the typical costs are rounded to in the reports.
+DIGITS = 2
+
+
+class Cost:
+    """
+    the cycles some code takes: on its cheapest path, on its most expensive
+    one and on average when each branch is taken half of the times.
+    """
+    __slots__ = ("best", "worst", "typical")
+
+    def __init__(self, best=0, worst=0, typical=0.0):
+        self.best = best
+        self.worst = worst
+        self.typical = typical
+
+    def add(self, other):
+        """
+        :param other: (Cost) the cost of code that runs after this code.
+        """
+        self.best += other.best
+        self.worst += other.worst
+        self.typical += other.typical
+
+    def report(self):
+        """
+        :return: (dict) the cost as json values.
+        """
+        return {"best": self.best, "worst": self.worst,
+                "typical": round(self.typical, DIGITS)}
+
+
+def piece_cost(lines, start, end, trips=(1, LOOP_TRIPS), routines=None):
+    """
+    the cycles from the first instruction of a piece of Assembly until it
+    ends or jumps out of it. a jump to a label of the piece is followed:
+    forward as a branch and backward as a loop, which runs from trips[0] to
+    trips[1] times. a jump to one of the routines adds the cost of the
+    routine and goes on after the jump, where the routine returns to. any
+    other jump leaves the piece (calls are not followed into the function
+    called).
+    :param lines: (InstructionList) the instructions.
+    :param start: (int) where the piece starts.
+    :param end: (int) where it ends, not included.
+    :param trips: (tuple) the fewest and the most times a loop runs.
+    :param routines: (dict) the cost of each routine by the symbol id of
+    the label it starts at, or None.
+    :return: (Cost) the cost of the piece.
+    """
+    if routines is None:
+        routines = dict()
+    return region_cost(lines, start, end, trips, routines, True)
+
+
+def region_cost(lines, start, end, trips, routines, loops):
+    """
+    the cost of a piece as piece_cost works it out.
+    :param lines: (InstructionList) the instructions.
+    :param start: (int) where the piece starts.
+    :param end: (int) where it ends, not included.
+    :param trips: (tuple) the fewest and the most times a loop runs.
+    :param routines: (dict) the cost of each routine.
+    :param loops: (bool) False to leave the piece on a jump back instead of
+    running a loop, for the cost of one pass of a loop.
+    :return: (Cost) the cost of the piece.
+    """
+    labels = dict()
+    for position in range(start, end):
+        if lines.kind(position) == L_INSTRUCTION:
+            labels[lines.symbol(position)] = position
+    # the cost from each position to the end, worked out from the end back.
+    # a jump back is a loop whose later passes are added to the cost after
+    # it, as the cost of its first pass is not known yet.
+    costs = [None] * (end - start + 1)
+    costs[end - start] = Cost()
+    for position in range(end - 1, start - 1, -1):
+        following = costs[position + 1 - start]
+        kind = lines.kind(position)
+        if kind == L_INSTRUCTION:
+            costs[position - start] = following
+            continue
+        jump = 0
+        if kind == C_INSTRUCTION:
+            jump = lines.fields(position)[2]
+        if not jump:
+            costs[position - start] = Cost(following.best + 1,
+                                           following.worst + 1,
+                                           following.typical + 1)
+            continue
+        taken = Cost()
+        target = None
+        if position > start and lines.kind(position - 1) == A_INSTRUCTION:
+            target = lines.symbol(position - 1)
+        if target in routines:
+            taken.add(routines[target])
+            taken.add(following)
+        elif labels.get(target, position) > position:
+            taken = costs[labels[target] - start]
+        elif target in labels and loops:
+            # how many times the jump back is taken is set by trips, so
+            # its cost already holds the way out of the loop.
+            taken = loop_cost(lines, labels[target], position, trips,
+                              routines, following)
+            jump = ALWAYS
+        if jump == ALWAYS:
+            outcomes = (taken,)
+        else:
+            outcomes = (taken, following)
+        costs[position - start] = Cost(
+            1 + min(outcome.best for outcome in outcomes),
+            1 + max(outcome.worst for outcome in outcomes),
+            1 + sum(outcome.typical for outcome in outcomes) / len(outcomes))
+    return costs[0]
+
+
+def loop_cost(lines, header, position, trips, routines, following):
+    """
+    :param lines: (InstructionList) the instructions.
+    :param header: (int) where the loop starts.
+    :param position: (int) the jump back to it.
+    :param trips: (tuple) the fewest and the most times the loop runs.
+    :param routines: (dict) the cost of each routine.
+    :param following: (Cost) the cost after the jump back.
+    :return: (Cost) the cost of taking the jump back: every pass of the loop
+    after the first and then the code after it.
+    """
+    one_pass = region_cost(lines, header, position + 1, trips, routines,
+                           False)
+    fewest, most = trips
+    return Cost(one_pass.best * (fewest - 1) + following.best,
+                one_pass.worst * (most - 1) + following.worst,
+                one_pass.typical * ((fewest + most) / 2 - 1)
+                + following.typical)
+
+
+def routine_costs(lines, starts, end):
+    """
+    :param lines: (InstructionList) the instructions.
+    :param starts: (list) where each routine starts, in order.
+    :param end: (int) where the last routine ends.
+    :return: (dict) the cost of each routine until it jumps back, by the
+    symbol id of the label it starts at. the loops of the routines go over
+    the bits of a word.
+    """
+    costs = dict()
+    for start, stop in zip(starts, starts[1:] + [end]):
+        costs[lines.symbol(start)] = piece_cost(lines, start, stop,
+                                                (1, WORD_BITS))
+    return costs
+
+
+def block_indices(commands):
+    """
+    :param commands: (list) the commands of one function.
+    :return: (list) the index of the basic block of each command, the same
+    blocks ControlFlowGraph makes of them.
+    """
+    indices = list()
+    block = 0
+    has_commands = False
+    for command in commands:
+        if command.kind == LABEL and has_commands:
+            block += 1
+            has_commands = False
+        indices.append(block)
+        if command.kind != LABEL:
+            has_commands = True
+            if command.kind in TERMINATORS:
+                block += 1
+                has_commands = False
+    return indices
+
+
+def find_loops(cfg):
+    """
+    :param cfg: (ControlFlowGraph) the graph of a function.
+    :return: (dict) the index of the last block of each loop, by the index
+    of its first block. a loop is a jump back to an earlier block (or the
+    same one) and every block written between the two.
+    """
+    loops = dict()
+    positions = {block: index for index, block in enumerate(cfg.blocks)}
+    for index, block in enumerate(cfg.blocks):
+        for successor in block.successors:
+            header = positions[successor]
+            if header <= index:
+                loops[header] = max(loops.get(header, index), index)
+    return loops
+
+
+def loop_depths(cfg, loops):
+    """
+    :param cfg: (ControlFlowGraph) the graph of a function.
+    :param loops: (dict) its loops, as find_loops gives them.
+    :return: (list) how many loops hold each block.
+    """
+    return [sum(1 for header, last in loops.items()
+                if header <= index <= last)
+            for index in range(len(cfg.blocks))]
+
+
+def innermost_loop(loops, index):
+    """
+    :param loops: (dict) the loops of a function.
+    :param index: (int) the index of a block.
+    :return: (tuple) the first and last block of the innermost loop holding
+    the block, or None if it is not in a loop.
+    """
+    holding = [(header, last) for header, last in loops.items()
+               if header <= index <= last]
+    if not holding:
+        return None
+    return max(holding)
+
+
+def block_frequencies(cfg, loops):
+    """
+    how many times each block runs for each time the function is called. a
+    loop header runs LOOP_TRIPS times for each time it is reached from
+    before the loop, the jumps leaving a loop are taken once of every
+    LOOP_TRIPS times, and every other branch is taken half of the times.
+    :param cfg: (ControlFlowGraph) the graph of a function.
+    :param loops: (dict) its loops.
+    :return: (list) the frequency of each block.
+    """
+    positions = {block: index for index, block in enumerate(cfg.blocks)}
+    inflow = [0.0] * len(cfg.blocks)
+    frequencies = [0.0] * len(cfg.blocks)
+    if cfg.blocks:
+        inflow[0] = 1.0
+    for index, block in enumerate(cfg.blocks):
+        frequency = inflow[index]
+        if index in loops:
+            frequency *= LOOP_TRIPS
+        frequencies[index] = frequency
+        forward = [positions[successor] for successor in block.successors
+                   if positions[successor] > index]
+        loop = innermost_loop(loops, index)
+        if loop is None:
+            for successor in forward:
+                inflow[successor] += frequency / len(forward)
+            continue
+        exits = [successor for successor in forward if successor > loop[1]]
+        staying = [successor for successor in forward
+                   if successor <= loop[1]]
+        leaving = frequency / LOOP_TRIPS if exits else 0.0
+        for successor in exits:
+            inflow[successor] += leaving / len(exits)
+        for successor in staying:
+            inflow[successor] += (frequency - leaving) / len(staying)
+    return frequencies
+
+
+def path_costs(cfg, loops, costs, choose):
+    """
+    the cost of the cheapest or the most expensive way through a function.
+    a jump back to a loop header goes on after the end of the loop instead,
+    so each loop is passed through once.
+    :param cfg: (ControlFlowGraph) the graph of a function.
+    :param loops: (dict) its loops.
+    :param costs: (list) the cost of each block on the path.
+    :param choose: (function) min or max.
+    :return: (float) the cost from the first block to the end.
+    """
+    positions = {block: index for index, block in enumerate(cfg.blocks)}
+    totals = [0] * (len(cfg.blocks) + 1)
+    for index in range(len(cfg.blocks) - 1, -1, -1):
+        following = list()
+        for successor in cfg.blocks[index].successors:
+            position = positions[successor]
+            if position <= index:
+                position = loops[position] + 1
+            following.append(totals[position])
+        totals[index] = costs[index] + (choose(following) if following
+                                        else 0)
+    return totals[0] if cfg.blocks else 0
+
+
+def estimate_function(commands, spans, lines, routines=None):
+    """
+    works out the cost of each command, block and of the whole function.
+    the only loop a piece of Assembly has is the one pushing the locals of
+    a function, which runs once for each local.
+    :param commands: (list) the commands of the function, as converted.
+    :param spans: (list) for each piece of Assembly the converter made, the
+    first and last command it is for and where it starts and ends in lines.
+    :param lines: (InstructionList) the converted program.
+    :param routines: (dict) the cost of each routine the function may jump
+    to, by the symbol id of its label, or None.
+    :return: (dict) the json report of the function: the cost of the
+    function and of each of its blocks, and in each block the cost of each
+    piece with the commands it is for.
+    """
+    cfg = ControlFlowGraph(commands)
+    loops = find_loops(cfg)
+    depths = loop_depths(cfg, loops)
+    frequencies = block_frequencies(cfg, loops)
+    indices = block_indices(commands)
+    block_costs = [Cost() for _ in cfg.blocks]
+    block_pieces = [list() for _ in cfg.blocks]
+    for first, last, start, end in spans:
+        trips = (1, LOOP_TRIPS)
+        if commands[first].kind == FUNCTION:
+            trips = (commands[first].arg2, commands[first].arg2)
+        cost = piece_cost(lines, start, end, trips, routines)
+        block = min(indices[first], len(cfg.blocks) - 1)
+        block_costs[block].add(cost)
+        piece = {"commands": [command.text()
+                              for command in commands[first:last + 1]]}
+        piece.update(cost.report())
+        block_pieces[block].append(piece)
+    weights = [LOOP_TRIPS ** depth for depth in depths]
+    total = Cost(
+        path_costs(cfg, loops, [cost.best for cost in block_costs], min),
+        path_costs(cfg, loops, [cost.worst * weight for cost, weight
+                                in zip(block_costs, weights)], max),
+        sum(cost.typical * frequency
+            for cost, frequency in zip(block_costs, frequencies)))
+    blocks = list()
+    for index, block in enumerate(cfg.blocks):
+        report = {"labels": block.labels, "loop depth": depths[index],
+                  "frequency": round(frequencies[index], DIGITS),
+                  "pieces": block_pieces[index]}
+        report.update(block_costs[index].report())
+        blocks.append(report)
+    report = total.report()
+    report["blocks"] = blocks
+    return report
+
+
+def format_cost(report):
+    """
+    :param report: (dict) a report with a best, worst and typical cost.
+    :return: (str) the three costs in columns.
+    """
+    return "%6d %6d %9.2f" % (report["best"], report["worst"],
+                              report["typical"])
+
+
+def write_listing(file, costs):
+    """
+    writes the vm commands of every function with the costs next to them.
+    :param file: the open file we write to.
+    :param costs: (dict) the report of each function.
+    """
+    file.write("%6s %6s %9s  (a loop runs %d times)\n"
+               % ("best", "worst", "typical", LOOP_TRIPS))
+    for name, function in costs.items():
+        file.write(format_cost(function) + "  function " + name + "\n")
+        for index, block in enumerate(function["blocks"]):
+            file.write(format_cost(block) + "    block " + str(index)
+                       + " (loop depth " + str(block["loop depth"])
+                       + ", runs " + str(block["frequency"]) + ")\n")
+            for piece in block["pieces"]:
+                file.write(format_cost(piece) + "      "
+                           + piece["commands"][0] + "\n")
+                for command in piece["commands"][1:]:
+                    file.write(" " * 22 + "  +   " + command + "\n")
+
+
+def write_costs(file_name, costs):
+    """
+    writes the cost report as json next to an annotated listing.
+    :param file_name: (str) the path of the reports without the extension.
+    :param costs: (dict) the report of each function.
+    """
+    with open(file_name + ".json", "w") as file:
+        json.dump({"loop trips": LOOP_TRIPS, "functions": costs}, file,
+                  indent=1)
+    with open(file_name + ".txt", "w") as file:
+        write_listing(file, costs)
@@ -0,0 +1,51 @@
+from Parser import POP, POINTER
+from Promotion import ANY_FUNCTION, call_graph, reachable
+from StackDepth import POINTER_REGISTERS
+
+# the registers a call can save, in the order its frame holds them.
+FRAME_REGISTERS = ("LCL", "ARG", "THIS", "THAT")
+# the registers every frame keeps, as the call itself moves them.
+MOVED_BY_CALL = ("LCL", "ARG")
+
+
+def pointer_writes(function):
+    """
+    :param function: (VMFunction) a function.
+    :return: (set) the registers of POINTER_REGISTERS its own pop pointer
+    commands change.
+    """
+    return set(POINTER_REGISTERS[command.arg2]
+               for command in function.commands
+               if command.kind == POP and command.arg1 == POINTER)
+
+
+def frame_layouts(functions, leaves):
+    """
+    works out for each function the registers a call to it has to save:
+    LCL and ARG always, and THIS/THAT only if the function or anything it
+    calls (through any chain of calls) may change them.
+    :param functions: (list) the VMFunction of every function in the
+    program.
+    :param leaves: (set) names of calls that never call back into the
+    program and leave THIS and THAT alone (like the intrinsics).
+    :return: (dict) the registers each function's frame holds, in the order
+    of FRAME_REGISTERS. calls to functions that are not here save all of
+    them.
+    """
+    graph = call_graph(functions, leaves)
+    writes = {ANY_FUNCTION: set(POINTER_REGISTERS)}
+    for function in functions:
+        if function.name is not None:
+            writes.setdefault(function.name, set()).update(
+                pointer_writes(function))
+    layouts = dict()
+    for name in graph:
+        if name is ANY_FUNCTION:
+            continue
+        changed = set(writes[name])
+        for callee in reachable(graph, name):
+            changed.update(writes[callee])
+        layouts[name] = tuple(register for register in FRAME_REGISTERS
+                              if register in MOVED_BY_CALL
+                              or register in changed)
+    return layouts
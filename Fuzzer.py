@@ -0,0 +1,714 @@
+import argparse
+import random
+import re
+import sys
+
+import Main
+from Intrinsics import MULTIPLY, DIVIDE, PEEK, POKE
+from Simulator import Machine, HALTED
+
+HEAP_BASE = 2048
+HEAP_WORDS = 160
+# the bases THIS/THAT are set to, all indices used on them stay in the heap.
+POINTER_BASES = tuple(HEAP_BASE + 16 * block for block in range(8))
+SEGMENT_SIZE = 8
+TEMP_WORDS = 8
+STATIC_WORDS = 6
+LOOP_COUNTERS = 2
+SYS_FILE = "Sys"
+MAX_CYCLES = 400000
+# the mode name that translates with a profile of the program.
+PROFILE_MODE = "pgo"
+STATIC_NAME = re.compile(r"^[^.$]+\.\d+$")
+BINARY_COMMANDS = ("add", "sub", "and", "or", "eq", "gt", "lt")
+UNARY_COMMANDS = ("neg", "not")
+# the segments an expression can read and a statement can write.
+LOAD_SEGMENTS = ("local", "argument", "this", "that", "static", "temp",
+                 "pointer")
+STORE_SEGMENTS = ("local", "argument", "this", "that", "static", "temp")
+# the OS functions programs can call, with their number of arguments.
+OS_FUNCTIONS = ((MULTIPLY, 2), (DIVIDE, 2), (PEEK, 1), (POKE, 2))
+# vm versions of the OS functions the intrinsics replace, with the results
+# the intrinsics give (dividing by 0 gives 0).
+OS_FILES = {
+    "Math": """function Math.multiply 2
+push constant 0
+pop local 0
+push constant 1
+pop local 1
+label Math_multiply_LOOP
+push local 1
+push constant 0
+eq
+if-goto Math_multiply_END
+push argument 1
+push local 1
+and
+push constant 0
+eq
+if-goto Math_multiply_SKIP
+push local 0
+push argument 0
+add
+pop local 0
+label Math_multiply_SKIP
+push argument 0
+push argument 0
+add
+pop argument 0
+push local 1
+push local 1
+add
+pop local 1
+goto Math_multiply_LOOP
+label Math_multiply_END
+push local 0
+return
+function Math.divide 4
+push argument 1
+push constant 0
+eq
+if-goto Math_divide_ZERO
+push constant 0
+pop local 0
+push argument 0
+push constant 0
+lt
+not
+if-goto Math_divide_X_POSITIVE
+push local 0
+not
+pop local 0
+push argument 0
+neg
+pop argument 0
+label Math_divide_X_POSITIVE
+push argument 1
+push constant 0
+lt
+not
+if-goto Math_divide_Y_POSITIVE
+push local 0
+not
+pop local 0
+push argument 1
+neg
+pop argument 1
+label Math_divide_Y_POSITIVE
+push argument 1
+push constant 0
+lt
+if-goto Math_divide_SMALLEST
+push constant 0
+pop local 1
+push constant 0
+pop local 2
+push constant 16
+pop local 3
+label Math_divide_LOOP
+push local 2
+push local 2
+add
+pop local 2
+push argument 0
+push constant 0
+lt
+not
+if-goto Math_divide_NO_CARRY
+push local 2
+push constant 1
+add
+pop local 2
+label Math_divide_NO_CARRY
+push argument 0
+push argument 0
+add
+pop argument 0
+push local 1
+push local 1
+add
+pop local 1
+push local 2
+push constant 0
+lt
+if-goto Math_divide_SUBTRACT
+push local 2
+push argument 1
+lt
+if-goto Math_divide_NEXT
+label Math_divide_SUBTRACT
+push local 2
+push argument 1
+sub
+pop local 2
+push local 1
+push constant 1
+add
+pop local 1
+label Math_divide_NEXT
+push local 3
+push constant 1
+sub
+pop local 3
+push local 3
+push constant 0
+gt
+if-goto Math_divide_LOOP
+goto Math_divide_SIGN
+label Math_divide_SMALLEST
+push constant 0
+pop local 1
+push argument 0
+push constant 0
+lt
+not
+if-goto Math_divide_SIGN
+push constant 1
+pop local 1
+label Math_divide_SIGN
+push local 0
+not
+if-goto Math_divide_DONE
+push local 1
+neg
+return
+label Math_divide_DONE
+push local 1
+return
+label Math_divide_ZERO
+push constant 0
+return
+""",
+    "Memory": """function Memory.peek 0
+push argument 0
+pop pointer 1
+push that 0
+return
+function Memory.poke 0
+push argument 0
+pop pointer 1
+push argument 1
+pop that 0
+push constant 0
+return
+"""}
+
+
+class Function:
+    """
+    a generated vm function: its name, number of arguments and locals, the
+    statements of its body and the expression it returns. the last
+    LOOP_COUNTERS locals are only used to count loops.
+    """
+    __slots__ = ("name", "n_args", "n_locals", "body", "result")
+
+    def __init__(self, name, n_args, n_locals, body, result):
+        self.name = name
+        self.n_args = n_args
+        self.n_locals = n_locals
+        self.body = body
+        self.result = result
+
+    def copy(self, body=None, result=None):
+        """
+        :return: (Function) the same function with another body or result.
+        """
+        return Function(self.name, self.n_args, self.n_locals,
+                        self.body if body is None else body,
+                        self.result if result is None else result)
+
+
+class Generator:
+    """
+    makes random, well formed vm programs. statements and expressions are
+    kept as tuples so a failing program can be shrunk before it is written
+    out as vm code:
+    ("const", value), ("load", segment, index), ("unary", command, e),
+    ("binary", command, e1, e2), ("call", name, [args]) and
+    ("address", value) (a heap address, which is never shrunk) are
+    expressions,
+    ("store", segment, index, e), ("pointer", index, base),
+    ("if", condition, then, else), ("while", counter, times, body) and
+    ("drop", e) are statements.
+    """
+
+    def __init__(self, rng, n_files=3, n_functions=5, max_depth=3):
+        self.rng = rng
+        self.n_files = n_files
+        self.n_functions = n_functions
+        self.max_depth = max_depth
+        self.functions = list()
+
+    def program(self):
+        """
+        :return: (tuple) the list of Functions, the first one being
+        Sys.init, and the number of values Sys.init leaves on the stack.
+        """
+        rng = self.rng
+        # functions may only call the ones after them, so every run ends.
+        names = list()
+        for index in range(self.n_functions):
+            file_name = "F" + str(rng.randrange(self.n_files))
+            names.append((file_name + ".f" + str(index), rng.randrange(4)))
+        functions = list()
+        for index in reversed(range(self.n_functions)):
+            name, n_args = names[index]
+            functions.insert(0, self.function(
+                name, n_args, names[index + 1:] + list(OS_FUNCTIONS)))
+        names.extend(OS_FUNCTIONS)
+        init = self.function(SYS_FILE + ".init", 0, names)
+        # Sys.init never returns, it ends in a halt loop instead.
+        init.result = None
+        left = rng.randrange(3)
+        for _ in range(left):
+            init.body.append(("push", self.expression(names, init, 2)))
+        return [init] + functions, left
+
+    def function(self, name, n_args, callees):
+        n_locals = self.rng.randrange(1, 4) + LOOP_COUNTERS
+        function = Function(name, n_args, n_locals, list(), None)
+        function.body = self.statements(callees, function, 0,
+                                        self.rng.randrange(2, 8))
+        function.result = self.expression(callees, function, 2)
+        return function
+
+    def statements(self, callees, function, depth, count):
+        return [self.statement(callees, function, depth)
+                for _ in range(count)]
+
+    def statement(self, callees, function, depth):
+        rng = self.rng
+        choice = rng.random()
+        if depth < 2 and choice < 0.12:
+            counter = function.n_locals - 1 - depth
+            return ("while", counter, rng.randrange(4),
+                    self.statements(callees, function, depth + 1,
+                                    rng.randrange(1, 4)))
+        if depth < 2 and choice < 0.25:
+            return ("if", self.expression(callees, function, 2),
+                    self.statements(callees, function, depth + 1,
+                                    rng.randrange(0, 3)),
+                    self.statements(callees, function, depth + 1,
+                                    rng.randrange(0, 3)))
+        if choice < 0.32:
+            return ("pointer", rng.randrange(2), rng.choice(POINTER_BASES))
+        if choice < 0.38 and callees:
+            return ("drop", self.call(callees, function, 1))
+        segment = rng.choice(STORE_SEGMENTS)
+        if segment == "argument" and function.n_args == 0:
+            segment = "local"
+        return ("store", segment, self.index(function, segment),
+                self.expression(callees, function, self.max_depth))
+
+    def index(self, function, segment):
+        if segment == "local":
+            # the loop counters are never written by the body.
+            return self.rng.randrange(function.n_locals - LOOP_COUNTERS)
+        if segment == "argument":
+            return self.rng.randrange(function.n_args)
+        if segment == "static":
+            return self.rng.randrange(STATIC_WORDS)
+        if segment == "temp":
+            return self.rng.randrange(TEMP_WORDS)
+        if segment == "pointer":
+            return self.rng.randrange(2)
+        return self.rng.randrange(SEGMENT_SIZE)
+
+    def call(self, callees, function, depth):
+        rng = self.rng
+        name, n_args = rng.choice(callees)
+        arguments = [self.expression(callees, function, depth)
+                     for _ in range(n_args)]
+        if name in (PEEK, POKE):
+            arguments[0] = ("address", HEAP_BASE + rng.randrange(HEAP_WORDS))
+        elif name in (MULTIPLY, DIVIDE) and rng.random() < 0.4:
+            # a power of two, which intrinsics turn to shifts.
+            power = ("const", 2 ** rng.randrange(15))
+            if name == MULTIPLY and rng.random() < 0.5:
+                arguments[0] = power
+            else:
+                arguments[1] = power
+        return ("call", name, arguments)
+
+    def expression(self, callees, function, depth):
+        rng = self.rng
+        choice = rng.random()
+        if depth > 0 and choice < 0.35:
+            return ("binary", rng.choice(BINARY_COMMANDS),
+                    self.expression(callees, function, depth - 1),
+                    self.expression(callees, function, depth - 1))
+        if depth > 0 and choice < 0.45:
+            return ("unary", rng.choice(UNARY_COMMANDS),
+                    self.expression(callees, function, depth - 1))
+        if depth > 0 and choice < 0.5 and callees:
+            return self.call(callees, function, depth - 1)
+        if choice < 0.75:
+            segment = rng.choice(LOAD_SEGMENTS)
+            if segment == "argument" and function.n_args == 0:
+                segment = "static"
+            return ("load", segment, self.index(function, segment))
+        return ("const", rng.choice((0, 1, 2, 7, 255, 4096, 32767,
+                                     rng.randrange(32768))))
+
+
+def render_expression(expression, lines):
+    kind = expression[0]
+    if kind in ("const", "address"):
+        lines.append("push constant " + str(expression[1]))
+    elif kind == "load":
+        lines.append("push " + expression[1] + " " + str(expression[2]))
+    elif kind == "unary":
+        render_expression(expression[2], lines)
+        lines.append(expression[1])
+    elif kind == "binary":
+        render_expression(expression[2], lines)
+        render_expression(expression[3], lines)
+        lines.append(expression[1])
+    else:
+        for argument in expression[2]:
+            render_expression(argument, lines)
+        lines.append("call " + expression[1] + " " + str(len(expression[2])))
+
+
+def render_statements(statements, function, lines, labels):
+    for statement in statements:
+        kind = statement[0]
+        if kind == "store":
+            render_expression(statement[3], lines)
+            lines.append("pop " + statement[1] + " " + str(statement[2]))
+        elif kind == "pointer":
+            lines.append("push constant " + str(statement[2]))
+            lines.append("pop pointer " + str(statement[1]))
+        elif kind == "drop":
+            render_expression(statement[1], lines)
+            lines.append("pop temp 0")
+        elif kind == "push":
+            render_expression(statement[1], lines)
+        elif kind == "if":
+            # labels are unique in the whole program, as the translator does
+            # not keep labels of different functions apart.
+            label = function.name.replace(".", "_") + "_" + str(len(labels))
+            labels.append(label)
+            render_expression(statement[1], lines)
+            lines.append("if-goto IF_TRUE_" + label)
+            render_statements(statement[3], function, lines, labels)
+            lines.append("goto IF_END_" + label)
+            lines.append("label IF_TRUE_" + label)
+            render_statements(statement[2], function, lines, labels)
+            lines.append("label IF_END_" + label)
+        elif kind == "while":
+            label = function.name.replace(".", "_") + "_" + str(len(labels))
+            labels.append(label)
+            counter = "local " + str(statement[1])
+            lines.append("push constant " + str(statement[2]))
+            lines.append("pop " + counter)
+            lines.append("label WHILE_EXP_" + label)
+            lines.append("push " + counter)
+            lines.append("push constant 0")
+            lines.append("gt")
+            lines.append("not")
+            lines.append("if-goto WHILE_END_" + label)
+            render_statements(statement[3], function, lines, labels)
+            lines.append("push " + counter)
+            lines.append("push constant 1")
+            lines.append("sub")
+            lines.append("pop " + counter)
+            lines.append("goto WHILE_EXP_" + label)
+            lines.append("label WHILE_END_" + label)
+
+
+def render(functions):
+    """
+    writes generated functions out as vm files.
+    :param functions: (list) the Functions, Sys.init first.
+    :return: (list) a (file_name, lines) pair for each file, as translate
+    takes them.
+    """
+    files = dict()
+    for function in functions:
+        file_name = function.name.split(".")[0]
+        lines = files.setdefault(file_name, list())
+        labels = list()
+        lines.append("function " + function.name + " " +
+                     str(function.n_locals))
+        if function.result is None:
+            # Sys.init points this and that at the heap, the other functions
+            # use the pointers of their caller until they move them.
+            lines.append("push constant " + str(POINTER_BASES[0]))
+            lines.append("pop pointer 0")
+            lines.append("push constant " + str(POINTER_BASES[1]))
+            lines.append("pop pointer 1")
+        render_statements(function.body, function, lines, labels)
+        if function.result is None:
+            lines.append("label HALT")
+            lines.append("goto HALT")
+        else:
+            render_expression(function.result, lines)
+            lines.append("return")
+    called = called_names(functions)
+    for file_name, text in OS_FILES.items():
+        if any(name.startswith(file_name + ".") for name in called):
+            files[file_name] = text.splitlines()
+    return [(file_name + ".", lines) for file_name, lines in files.items()]
+
+
+def snapshot(machine, left):
+    """
+    the state a translation of the program has to agree on: the values Sys
+    init left on the stack, the statics, temp, THIS/THAT and the heap.
+    :param machine: (Machine) the machine after the run.
+    :param left: (int) how many values Sys.init leaves on the stack.
+    :return: (dict) the state.
+    """
+    ram = machine.ram
+    stack_pointer = ram[0]
+    state = {"stack": tuple(ram[stack_pointer - left:stack_pointer]),
+             "temp": tuple(ram[5:5 + TEMP_WORDS]),
+             "pointer": tuple(ram[3:5]),
+             "heap": tuple(ram[HEAP_BASE:HEAP_BASE + HEAP_WORDS])}
+    for name in sorted(machine.variables):
+        if STATIC_NAME.match(name):
+            state[name] = machine.symbol(name)
+    return state
+
+
+def run_mode(files, left, mode, max_cycles=MAX_CYCLES):
+    """
+    translates and runs a program under one set of optimizations. with
+    PROFILE_MODE in the mode, the program is first run untouched to record
+    a profile to translate it with.
+    :return: (tuple) the reason the run stopped, its state, its cycles and
+    the number of rom words of the program.
+    """
+    profile = None
+    if PROFILE_MODE in mode:
+        profiler = Machine(Main.translate(files), profile=True)
+        profiler.run(max_cycles)
+        profile = profiler.profile()
+        mode = tuple(name for name in mode if name != PROFILE_MODE)
+    program = Main.translate(files, mode, profile=profile)
+    machine = Machine(program)
+    reason = machine.run(max_cycles)
+    return reason, snapshot(machine, left), machine.cycles, len(machine.rom)
+
+
+def differences(expected, actual):
+    """
+    :return: (list) the parts of the state that do not match.
+    """
+    keys = sorted(set(expected) | set(actual))
+    return [key for key in keys if expected.get(key) != actual.get(key)]
+
+
+def diverges(functions, left, mode):
+    """
+    :return: (bool) True if the program halts without optimizations and
+    gives a different state (or does not halt) under mode.
+    """
+    files = render(functions)
+    reason, expected, _, _ = run_mode(files, left, ())
+    if reason != HALTED:
+        return False
+    reason, actual, _, _ = run_mode(files, left, mode)
+    return reason != HALTED or differences(expected, actual) != []
+
+
+def smaller_expressions(expression):
+    kind = expression[0]
+    if kind == "address":
+        return
+    if kind == "const":
+        if expression[1] != 0:
+            yield ("const", 0)
+        return
+    yield ("const", 0)
+    if kind == "unary":
+        yield expression[2]
+        for smaller in smaller_expressions(expression[2]):
+            yield (kind, expression[1], smaller)
+    elif kind == "binary":
+        yield expression[2]
+        yield expression[3]
+        for smaller in smaller_expressions(expression[2]):
+            yield (kind, expression[1], smaller, expression[3])
+        for smaller in smaller_expressions(expression[3]):
+            yield (kind, expression[1], expression[2], smaller)
+    elif kind == "call":
+        for index, argument in enumerate(expression[2]):
+            for smaller in smaller_expressions(argument):
+                arguments = list(expression[2])
+                arguments[index] = smaller
+                yield (kind, expression[1], arguments)
+
+
+def smaller_statements(statements):
+    for index in range(len(statements)):
+        yield statements[:index] + statements[index + 1:]
+    for index, statement in enumerate(statements):
+        for smaller in smaller_statement(statement):
+            yield statements[:index] + smaller + statements[index + 1:]
+
+
+def smaller_statement(statement):
+    kind = statement[0]
+    if kind == "if":
+        yield statement[2]
+        yield statement[3]
+        for smaller in smaller_expressions(statement[1]):
+            yield [(kind, smaller, statement[2], statement[3])]
+        for smaller in smaller_statements(statement[2]):
+            yield [(kind, statement[1], smaller, statement[3])]
+        for smaller in smaller_statements(statement[3]):
+            yield [(kind, statement[1], statement[2], smaller)]
+    elif kind == "while":
+        if statement[2] > 1:
+            yield [(kind, statement[1], 1, statement[3])]
+        for smaller in smaller_statements(statement[3]):
+            yield [(kind, statement[1], statement[2], smaller)]
+    elif kind in ("store", "drop", "push"):
+        for smaller in smaller_expressions(statement[-1]):
+            yield [statement[:-1] + (smaller,)]
+
+
+def called_names(functions):
+    names = set()
+
+    def visit(node):
+        if isinstance(node, tuple):
+            if node and node[0] == "call":
+                names.add(node[1])
+            for part in node:
+                visit(part)
+        elif isinstance(node, list):
+            for part in node:
+                visit(part)
+    for function in functions:
+        visit(function.body)
+        visit(function.result)
+    return names
+
+
+def smaller_programs(functions):
+    called = called_names(functions)
+    for index in range(1, len(functions)):
+        if functions[index].name not in called:
+            yield functions[:index] + functions[index + 1:]
+    for index, function in enumerate(functions):
+        for body in smaller_statements(function.body):
+            yield (functions[:index] + [function.copy(body=body)]
+                   + functions[index + 1:])
+        if function.result is not None:
+            for result in smaller_expressions(function.result):
+                yield (functions[:index] + [function.copy(result=result)]
+                       + functions[index + 1:])
+
+
+def shrink(functions, left, mode):
+    """
+    makes a diverging program as small as possible while it still diverges,
+    by removing functions and statements and simplifying expressions.
+    :return: (list) the smallest diverging Functions found.
+    """
+    changed = True
+    while changed:
+        changed = False
+        for smaller in smaller_programs(functions):
+            if diverges(smaller, left, mode):
+                functions = smaller
+                changed = True
+                break
+    return functions
+
+
+def fuzz(seed, count, modes, output=sys.stdout):
+    """
+    generates count programs, runs each under every mode and compares every
+    mode to the translation without optimizations.
+    :param seed: (int) the seed of the first program, program i uses
+    seed + i so any program can be made again.
+    :param count: (int) the number of programs.
+    :param modes: (list) the optimizations of each mode, as tuples.
+    :param output: the file the report is written to.
+    :return: (int) the number of diverging programs.
+    """
+    totals = {mode: [0, 0] for mode in modes}
+    base_totals = [0, 0]
+    failures = 0
+    tested = 0
+    for program_seed in range(seed, seed + count):
+        functions, left = Generator(random.Random(program_seed)).program()
+        files = render(functions)
+        reason, expected, cycles, size = run_mode(files, left, ())
+        if reason != HALTED:
+            continue
+        tested += 1
+        base_totals[0] += cycles
+        base_totals[1] += size
+        for mode in modes:
+            reason, actual, mode_cycles, mode_size = run_mode(files, left,
+                                                              mode)
+            totals[mode][0] += mode_cycles
+            totals[mode][1] += mode_size
+            wrong = differences(expected, actual)
+            if reason == HALTED and not wrong:
+                continue
+            failures += 1
+            output.write("seed " + str(program_seed) + " diverges under " +
+                         mode_name(mode) + " (" + reason + ", " +
+                         ", ".join(wrong) + ")\n")
+            smallest = shrink(functions, left, mode)
+            for file_name, lines in render(smallest):
+                output.write("// " + file_name + "vm\n")
+                for line in lines:
+                    output.write(line + "\n")
+    output.write("programs run: " + str(tested) + "\n")
+    output.write("baseline: " + str(base_totals[0]) + " cycles, " +
+                 str(base_totals[1]) + " words\n")
+    for mode in modes:
+        cycles, size = totals[mode]
+        output.write(mode_name(mode) + ": " +
+                     delta(cycles, base_totals[0]) + " cycles, " +
+                     delta(size, base_totals[1]) + " words\n")
+    return failures
+
+
+def delta(value, base):
+    change = value - base
+    percent = 100.0 * change / base if base else 0.0
+    return "%+d (%+.1f%%)" % (change, percent)
+
+
+def mode_name(mode):
+    return "+".join(mode) if mode else "none"
+
+
+def all_modes():
+    """
+    :return: (list) every optimization on its own, then all of them.
+    """
+    modes = [(optimization,) for optimization in Main.OPTIMIZATIONS]
+    modes.append((PROFILE_MODE,))
+    modes.append(tuple(Main.OPTIMIZATIONS) + (PROFILE_MODE,))
+    return modes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="translates random vm programs under every "
+                    "optimization and checks they all end the same.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("-O", dest="modes", action="append", default=None,
+                        help="a mode to test, optimizations joined by +, "
+                             "can be given more than once (default: each "
+                             "optimization alone and all of them)")
+    arguments = parser.parse_args(sys.argv[1:])
+    modes = all_modes()
+    if arguments.modes:
+        modes = [tuple(mode.split("+")) for mode in arguments.modes]
+    failures = fuzz(arguments.seed, arguments.count, modes)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
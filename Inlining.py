@@ -0,0 +1,168 @@
+from ControlFlow import ControlFlowGraph
+from Parser import VMCommand, PUSH, POP, LABEL, GOTO, CALL, RETURN, \
+    CONSTANT, LOCAL, ARGUMENT, STATIC, POINTER, FIXED, BRANCHES
+from StackDepth import block_depths, stack_effect
+
+# the most commands a function can have and still be copied into the hot
+# functions that call it instead of being called.
+MAX_INLINED_COMMANDS = 16
+# the part of the labels of an inlined body that comes after the labels of
+# the function, with the caller and the position of the call after it, so
+# every copy of the body has labels of its own.
+INLINE_SUFFIX = "$inline$"
+
+
+def can_inline(function):
+    """
+    :param function: (VMFunction) a function.
+    :return: (bool) True if a call to it can be replaced by its commands: it
+    is short, calls nothing, only jumps to its own labels and every return
+    it can reach leaves exactly the return value on its working stack.
+    """
+    if (function.name is None
+            or len(function.commands) > MAX_INLINED_COMMANDS):
+        return False
+    if any(command.kind == CALL for command in function.commands):
+        return False
+    cfg = ControlFlowGraph(function.commands)
+    depths = block_depths(cfg)
+    if not cfg.closed or depths is None:
+        return False
+    for block, depth in depths.items():
+        # a block that runs off the end of the function would run on into
+        # the commands after the call.
+        if block.falls_through() and block is cfg.blocks[-1]:
+            return False
+        for command in block.commands:
+            pops, pushes = stack_effect(command)
+            if depth < pops or (command.kind == RETURN and depth != 1):
+                return False
+            depth += pushes - pops
+    return True
+
+
+def inline_callees(functions):
+    """
+    :param functions: (list) the VMFunction of every function in the
+    program.
+    :return: (dict) the functions calls to which can be inlined, by name.
+    """
+    return {function.name: function for function in functions
+            if can_inline(function)}
+
+
+def inline_words(callee, n_args):
+    """
+    :param callee: (VMFunction) a function that can be inlined.
+    :param n_args: (int) the number of arguments of the call.
+    :return: (int) how many fixed words its body needs at that call: its
+    arguments, its locals and the pointers it moves, which are kept to be
+    put back after it.
+    """
+    pointers = set(command.arg2 for command in callee.commands
+                   if command.kind == POP and command.arg1 == POINTER)
+    return n_args + callee.n_vars + len(pointers)
+
+
+def can_inline_call(command, caller, callee, room):
+    """
+    :param command: (VMCommand) a call.
+    :param caller: (VMFunction) the function making it.
+    :param callee: (VMFunction) the function called, one that can be
+    inlined.
+    :param room: (int) how many fixed words an inlined body may take.
+    :return: (bool) True if the body of the callee fits in the room, only
+    reads arguments the call gives and only uses statics the caller can
+    reach by the same name.
+    """
+    if inline_words(callee, command.arg2) > room:
+        return False
+    for body_command in callee.commands:
+        if body_command.kind not in (PUSH, POP):
+            continue
+        if (body_command.arg1 == ARGUMENT
+                and body_command.arg2 >= command.arg2):
+            return False
+        if (body_command.arg1 == STATIC
+                and callee.file_name != caller.file_name):
+            return False
+    return True
+
+
+def inlined_body(callee, n_args, base, suffix):
+    """
+    :param callee: (VMFunction) the function called.
+    :param n_args: (int) the number of arguments of the call.
+    :param base: (int) the first fixed word the body may use.
+    :param suffix: (str) added to every label of the body.
+    :return: (list) the commands that do what the call does: they pop the
+    arguments into fixed words, clear the locals, run the body with every
+    return jumping to the end, and put back the pointers it moved.
+    """
+    pointers = sorted(set(command.arg2 for command in callee.commands
+                          if command.kind == POP
+                          and command.arg1 == POINTER))
+    slots = {ARGUMENT: base, LOCAL: base + n_args}
+    saves = base + n_args + callee.n_vars
+    end = suffix + "$end"
+    returns_early = False
+    commands = list()
+    for index in reversed(range(n_args)):
+        commands.append(VMCommand(POP, FIXED, base + index))
+    for index in range(callee.n_vars):
+        commands.append(VMCommand(PUSH, CONSTANT, 0))
+        commands.append(VMCommand(POP, FIXED, slots[LOCAL] + index))
+    for position, index in enumerate(pointers):
+        commands.append(VMCommand(PUSH, POINTER, index))
+        commands.append(VMCommand(POP, FIXED, saves + position))
+    for position, command in enumerate(callee.commands):
+        if command.kind in (PUSH, POP) and command.arg1 in slots:
+            command = VMCommand(command.kind, FIXED,
+                                slots[command.arg1] + command.arg2)
+        elif command.kind == LABEL or command.kind in BRANCHES:
+            command = VMCommand(command.kind, command.arg1 + suffix)
+        elif command.kind == RETURN:
+            # the return value is already on the top of the stack, where
+            # the call leaves it.
+            if position == len(callee.commands) - 1:
+                continue
+            command = VMCommand(GOTO, end)
+            returns_early = True
+        commands.append(command)
+    if returns_early:
+        commands.append(VMCommand(LABEL, end))
+    for position, index in enumerate(pointers):
+        commands.append(VMCommand(PUSH, FIXED, saves + position))
+        commands.append(VMCommand(POP, POINTER, index))
+    return commands
+
+
+def inline_calls(commands, caller, callees, base, room):
+    """
+    replaces the calls of a hot function to short functions that call
+    nothing with the commands of those functions. an inlined body makes no
+    calls, so no two of them are ever running at once and all of them can
+    keep their frames in the same fixed words.
+    :param commands: (list) the commands of the caller.
+    :param caller: (VMFunction) the caller.
+    :param callees: (dict) the functions that can be inlined, by name.
+    :param base: (int) the first fixed word the bodies may use.
+    :param room: (int) how many fixed words from it they may use.
+    :return: (tuple) the new commands, how many calls were inlined and the
+    most fixed words a body took.
+    """
+    new_commands = list()
+    inlined = 0
+    words = 0
+    for index, command in enumerate(commands):
+        callee = callees.get(command.arg1) if command.kind == CALL else None
+        if callee is None or not can_inline_call(command, caller, callee,
+                                                 room):
+            new_commands.append(command)
+            continue
+        suffix = INLINE_SUFFIX + caller.name + "$" + str(index)
+        new_commands.extend(inlined_body(callee, command.arg2, base,
+                                         suffix))
+        inlined += 1
+        words = max(words, inline_words(callee, command.arg2))
+    return new_commands, inlined, words
@@ -0,0 +1,308 @@
+import sys
+from array import array
+
+A_INSTRUCTION = 0
+C_INSTRUCTION = 1
+L_INSTRUCTION = 2
+# a code is the kind in its low bits over the symbol id or, for a C
+# instruction, the dest, comp and jump codes.
+KIND_BITS = 2
+KIND_MASK = 3
+DEST_SHIFT = 8
+COMP_SHIFT = 3
+COMP_MASK = 31
+JUMP_MASK = 7
+# the index of each mnemonic in these tuples is the code stored for it, the
+# dest and jump codes are also the matching bits of the hack machine code.
+DESTS = ("", "M", "D", "MD", "A", "AM", "AD", "AMD")
+JUMPS = ("", "JGT", "JEQ", "JGE", "JLT", "JNE", "JLE", "JMP")
+COMPS = ("0", "1", "-1", "D", "A", "!D", "!A", "-D", "-A", "D+1", "A+1",
+         "D-1", "A-1", "D+A", "D-A", "A-D", "D&A", "D|A", "M", "!M", "-M",
+         "M+1", "M-1", "D+M", "D-M", "M-D", "D&M", "D|M")
+DEST_CODES = {dest: code for code, dest in enumerate(DESTS)}
+JUMP_CODES = {jump: code for code, jump in enumerate(JUMPS)}
+COMP_CODES = {comp: code for code, comp in enumerate(COMPS)}
+
+
+def c_code(dest, comp, jump):
+    """
+    :param dest: (int) the dest code of a C instruction.
+    :param comp: (int) its comp code.
+    :param jump: (int) its jump code.
+    :return: (int) the code an InstructionList keeps for it.
+    """
+    return ((dest << DEST_SHIFT | comp << COMP_SHIFT | jump) << KIND_BITS
+            | C_INSTRUCTION)
+
+
+def c_fields(code):
+    """
+    :param code: (int) the code of a C instruction.
+    :return: (tuple) its dest, comp and jump codes.
+    """
+    code >>= KIND_BITS
+    return (code >> DEST_SHIFT, (code >> COMP_SHIFT) & COMP_MASK,
+            code & JUMP_MASK)
+
+
+def code_text(code):
+    """
+    :param code: (int) the code of an instruction.
+    :return: (str) the instruction as hack Assembly text.
+    """
+    kind = code & KIND_MASK
+    if kind == A_INSTRUCTION:
+        return "@" + symbol_table.names[code >> KIND_BITS]
+    if kind == L_INSTRUCTION:
+        return "(" + symbol_table.names[code >> KIND_BITS] + ")"
+    dest, comp, jump = c_fields(code)
+    line = COMPS[comp]
+    if dest:
+        line = DESTS[dest] + "=" + line
+    if jump:
+        line = line + ";" + JUMPS[jump]
+    return line
+
+
+# the code of every C instruction the converters add, by its mnemonics.
+ASSIGN_CODES = {dest: {comp: c_code(dest_code, comp_code, 0)
+                       for comp_code, comp in enumerate(COMPS)}
+                for dest_code, dest in enumerate(DESTS)}
+JUMP_INSTRUCTION_CODES = {comp: {jump: c_code(0, comp_code, jump_code)
+                                 for jump_code, jump in enumerate(JUMPS)}
+                          for comp_code, comp in enumerate(COMPS)}
+
+
+class SymbolTable:
+    """
+    interns every symbol used by an A instruction or a label, so each
+    instruction only has to keep a small id and the text of a symbol is
+    stored once no matter how many instructions use it.
+    """
+    __slots__ = ("names", "ids")
+
+    def __init__(self):
+        self.names = list()
+        self.ids = dict()
+
+    def intern(self, name):
+        """
+        :param name: (str/int) the symbol, a number is kept as its text but
+        is also found by its value, so it does not need to be made text
+        every time it is used.
+        :return: (int) the id of the symbol, adding it if it is new.
+        """
+        symbol_id = self.ids.get(name)
+        if symbol_id is None:
+            text = str(name)
+            symbol_id = self.ids.get(text)
+            if symbol_id is None:
+                symbol_id = len(self.names)
+                self.names.append(text)
+                self.ids[text] = symbol_id
+            self.ids[name] = symbol_id
+        return symbol_id
+
+    def name(self, symbol_id):
+        """
+        :param symbol_id: (int) an id given by intern.
+        :return: (str) the symbol with that id.
+        """
+        return self.names[symbol_id]
+
+    def clear(self):
+        """
+        forgets every symbol, the ids given so far can not be used after it.
+        """
+        self.names = list()
+        self.ids = dict()
+
+    def nbytes(self):
+        """
+        :return: (int) the memory used by the table and its symbols in bytes.
+        """
+        size = (sys.getsizeof(self) + sys.getsizeof(self.names)
+                + sys.getsizeof(self.ids))
+        for name in self.names:
+            size += sys.getsizeof(name)
+        return size
+
+
+# all instruction lists share one table so joining them never needs to
+# rewrite symbol ids.
+symbol_table = SymbolTable()
+
+
+class CodeTexts(dict):
+    """
+    the line of hack Assembly text of each instruction code, made the first
+    time the code is looked up.
+    """
+    __slots__ = ()
+
+    def __missing__(self, code):
+        text = code_text(code) + "\r\n"
+        self[code] = text
+        return text
+
+
+class InstructionList:
+    """
+    a list of hack Assembly instructions kept as one array of small codes
+    instead of strings. the two low bits of a code are the kind of the
+    instruction and the rest are the id of its symbol, or for a C
+    instruction its dest, comp and jump codes. text is only made when the
+    instructions are written out.
+    """
+    __slots__ = ("codes",)
+
+    def __init__(self):
+        self.codes = array("i")
+
+    def __len__(self):
+        return len(self.codes)
+
+    def at(self, symbol):
+        """
+        adds an A instruction ("@symbol").
+        :param symbol: (str/int) the symbol or number to load into A.
+        """
+        # most symbols are known already, so the table is only asked to add
+        # one when it is not.
+        symbol_id = symbol_table.ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = symbol_table.intern(symbol)
+        self.codes.append(symbol_id << KIND_BITS)
+
+    def assign(self, dest, comp):
+        """
+        adds a C instruction with no jump ("dest=comp").
+        :param dest: (str) the registers to write, like "AM".
+        :param comp: (str) the computation, like "D+M".
+        """
+        self.codes.append(ASSIGN_CODES[dest][comp])
+
+    def jump(self, comp, jump):
+        """
+        adds a C instruction with a jump and no dest ("comp;jump").
+        :param comp: (str) the computation tested, like "D".
+        :param jump: (str) the jump condition, like "JNE".
+        """
+        self.codes.append(JUMP_INSTRUCTION_CODES[comp][jump])
+
+    def label(self, symbol):
+        """
+        adds a label pseudo instruction ("(symbol)").
+        :param symbol: (str) the label name.
+        """
+        self.codes.append(symbol_table.intern(symbol) << KIND_BITS
+                          | L_INSTRUCTION)
+
+    def kind(self, index):
+        """
+        :param index: (int) the position of an instruction.
+        :return: (int) A_INSTRUCTION, C_INSTRUCTION or L_INSTRUCTION.
+        """
+        return self.codes[index] & KIND_MASK
+
+    def symbol(self, index):
+        """
+        :param index: (int) the position of an A instruction or a label.
+        :return: (int) the id of its symbol.
+        """
+        return self.codes[index] >> KIND_BITS
+
+    def fields(self, index):
+        """
+        :param index: (int) the position of a C instruction.
+        :return: (tuple) its dest, comp and jump codes.
+        """
+        return c_fields(self.codes[index])
+
+    def text(self, index):
+        """
+        :param index: (int) the position of an instruction.
+        :return: (str) the instruction as hack Assembly text.
+        """
+        return code_text(self.codes[index])
+
+    def __iter__(self):
+        for code in self.codes:
+            yield code_text(code)
+
+    def write(self, file):
+        """
+        writes the instructions as hack Assembly text, one per line, in a
+        single write. the text of each different code is only made once
+        however many instructions have it.
+        :param file: the open file we write to.
+        """
+        file.write("".join(map(CodeTexts().__getitem__, self.codes)))
+
+    def nbytes(self):
+        """
+        :return: (int) the memory used by the instructions in bytes, not
+        counting the shared symbol table.
+        """
+        return sys.getsizeof(self) + sys.getsizeof(self.codes)
+
+
+class TextList(list):
+    """
+    the same instructions kept the way the translator kept them before
+    InstructionList, as a list with the text of each one. the converters
+    can add to either, so the two can be compared on the same program.
+    """
+    __slots__ = ()
+
+    def at(self, symbol):
+        """
+        adds an A instruction ("@symbol").
+        :param symbol: (str/int) the symbol or number to load into A.
+        """
+        self.append("@" + str(symbol))
+
+    def assign(self, dest, comp):
+        """
+        adds a C instruction with no jump ("dest=comp").
+        :param dest: (str) the registers to write, like "AM".
+        :param comp: (str) the computation, like "D+M".
+        """
+        self.append(dest + "=" + comp if dest else comp)
+
+    def jump(self, comp, jump):
+        """
+        adds a C instruction with a jump and no dest ("comp;jump").
+        :param comp: (str) the computation tested, like "D".
+        :param jump: (str) the jump condition, like "JNE".
+        """
+        self.append(comp + ";" + jump)
+
+    def label(self, symbol):
+        """
+        adds a label pseudo instruction ("(symbol)").
+        :param symbol: (str) the label name.
+        """
+        self.append("(" + symbol + ")")
+
+    def write(self, file):
+        """
+        writes the instructions as hack Assembly text, one per line.
+        :param file: the open file we write to.
+        """
+        for line in self:
+            file.write(line)
+            file.write("\r\n")
+
+    def nbytes(self):
+        """
+        :return: (int) the memory used by the list and the strings in it in
+        bytes, each string counted once however many times it is in it.
+        """
+        size = sys.getsizeof(self)
+        counted = set()
+        for line in self:
+            if id(line) not in counted:
+                counted.add(id(line))
+                size += sys.getsizeof(line)
+        return size
@@ -0,0 +1,413 @@
+MULTIPLY = "Math.multiply"
+DIVIDE = "Math.divide"
+PEEK = "Memory.peek"
+POKE = "Memory.poke"
+# the routine divisions by a constant power of two are sent to.
+SHIFT_RIGHT = "Math.divide$shift"
+# the register the return address of a routine is passed in.
+RETURN_REGISTER = "R15"
+# the label at the start of the routines, a halt loop so nothing falls into
+# them.
+ROUTINES_GUARD = "INTRINSIC$guard"
+
+
+def power_of_two(value):
+    """
+    :param value: (int) a constant.
+    :return: (int) k if value is 2^k (k < 15), else None.
+    """
+    if value > 0 and value & (value - 1) == 0:
+        return value.bit_length() - 1
+    return None
+
+
+def convert_peek(lines):
+    """
+    Memory.peek(address) as a direct load: the address on top of the stack
+    is replaced by the word it points to.
+    :param lines: (InstructionList) the commands to add to.
+    """
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("M", "D")
+
+
+def convert_poke(lines):
+    """
+    Memory.poke(address, value) as a direct store: pops the value, writes it
+    to the address and leaves 0 (the return value of a void function) where
+    the address was.
+    :param lines: (InstructionList) the commands to add to.
+    """
+    lines.at("SP")
+    lines.assign("AM", "M-1")
+    lines.assign("D", "M")
+    lines.assign("A", "A-1")
+    lines.assign("A", "M")
+    lines.assign("M", "D")
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("M", "0")
+
+
+def convert_routine_call(lines, routine, return_label):
+    """
+    calls one of the shared routines, which take their operands from the
+    stack and jump back to the address in RETURN_REGISTER.
+    :param lines: (InstructionList) the commands to add to.
+    :param routine: (str) the name of the routine.
+    :param return_label: (str) a label no other call uses.
+    """
+    lines.at(return_label)
+    lines.assign("D", "A")
+    lines.at(RETURN_REGISTER)
+    lines.assign("M", "D")
+    lines.at(routine + "$intrinsic")
+    lines.jump("0", "JMP")
+    lines.label(return_label)
+
+
+def convert_multiply_power(lines, power):
+    """
+    multiplies the top of the stack by 2^power by adding it to itself (hack
+    has no D+D, so the value is doubled in place with D+M).
+    :param lines: (InstructionList) the commands to add to.
+    :param power: (int) the power of two.
+    """
+    if power == 0:
+        return
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    for _ in range(power):
+        lines.assign("D", "M")
+        lines.assign("M", "D+M")
+
+
+def convert_divide_power(lines, power, return_label):
+    """
+    divides the top of the stack by 2^power, rounding toward zero like
+    Math.divide.
+    :param lines: (InstructionList) the commands to add to.
+    :param power: (int) the power of two.
+    :param return_label: (str) a label no other call uses.
+    """
+    if power == 0:
+        return
+    lines.at(2 ** power)
+    lines.assign("D", "A")
+    lines.at("R14")
+    lines.assign("M", "D")
+    convert_routine_call(lines, SHIFT_RIGHT, return_label)
+
+
+def convert_pop_operands(lines):
+    """
+    adds the start of a two operand routine: y is popped to R14 and x, which
+    stays on the stack for the result, is copied to R13.
+    :param lines: (InstructionList) the commands to add to.
+    """
+    lines.at("SP")
+    lines.assign("AM", "M-1")
+    lines.assign("D", "M")
+    lines.at("R14")
+    lines.assign("M", "D")
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("D", "M")
+    lines.at("R13")
+    lines.assign("M", "D")
+
+
+def convert_routine_return(lines, result):
+    """
+    adds the end of a routine: the result replaces the top of the stack and
+    the routine jumps back to its caller.
+    :param lines: (InstructionList) the commands to add to.
+    :param result: (str) the variable the result is in.
+    """
+    lines.at(result)
+    lines.assign("D", "M")
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("M", "D")
+    lines.at(RETURN_REGISTER)
+    lines.assign("A", "M")
+    lines.jump("0", "JMP")
+
+
+def convert_multiply_routine(lines):
+    """
+    Math.multiply by shift and add: for every set bit of y, x shifted to
+    that bit is added to the result. the loop stops once no bits of y are
+    left, and a negative y is swapped with x first so it is the positive one
+    whenever one of them is.
+    :param lines: (InstructionList) the commands to add to.
+    """
+    bit = MULTIPLY + "$bit"
+    result = MULTIPLY + "$result"
+    lines.label(MULTIPLY + "$intrinsic")
+    convert_pop_operands(lines)
+    lines.at("R14")
+    lines.assign("D", "M")
+    lines.at(MULTIPLY + "$start")
+    lines.jump("D", "JGE")
+    # swap x and y.
+    lines.at("R13")
+    lines.assign("D", "M")
+    lines.at(bit)
+    lines.assign("M", "D")
+    lines.at("R14")
+    lines.assign("D", "M")
+    lines.at("R13")
+    lines.assign("M", "D")
+    lines.at(bit)
+    lines.assign("D", "M")
+    lines.at("R14")
+    lines.assign("M", "D")
+    lines.label(MULTIPLY + "$start")
+    lines.at(result)
+    lines.assign("M", "0")
+    lines.at(bit)
+    lines.assign("M", "1")
+    lines.label(MULTIPLY + "$loop")
+    # -bit masks the bits of y from bit up, when none are set we are done.
+    lines.at(bit)
+    lines.assign("D", "-M")
+    lines.at("R14")
+    lines.assign("D", "D&M")
+    lines.at(MULTIPLY + "$end")
+    lines.jump("D", "JEQ")
+    lines.at(bit)
+    lines.assign("D", "M")
+    lines.at("R14")
+    lines.assign("D", "D&M")
+    lines.at(MULTIPLY + "$skip")
+    lines.jump("D", "JEQ")
+    lines.at("R13")
+    lines.assign("D", "M")
+    lines.at(result)
+    lines.assign("M", "D+M")
+    lines.label(MULTIPLY + "$skip")
+    lines.at("R13")
+    lines.assign("D", "M")
+    lines.assign("M", "D+M")
+    lines.at(bit)
+    lines.assign("D", "M")
+    lines.assign("M", "D+M")
+    lines.at(MULTIPLY + "$loop")
+    lines.jump("0", "JMP")
+    lines.label(MULTIPLY + "$end")
+    convert_routine_return(lines, result)
+
+
+def convert_divide_sign(lines, quotient, negative):
+    """
+    adds the end of a division: the quotient in D is negated if the signs
+    of the operands were different, then returned.
+    :param lines: (InstructionList) the commands to add to.
+    :param quotient: (str) the variable to keep the quotient in.
+    :param negative: (str) the variable that is -1 if the signs differ.
+    """
+    lines.at(quotient)
+    lines.assign("M", "D")
+    lines.at(negative)
+    lines.assign("D", "M")
+    lines.at(quotient + "$positive")
+    lines.jump("D", "JEQ")
+    lines.at(quotient)
+    lines.assign("M", "-M")
+    lines.label(quotient + "$positive")
+    convert_routine_return(lines, quotient)
+
+
+def convert_absolute(lines, register, negative, name):
+    """
+    adds commands that make the value in D and register positive, flipping
+    the negative flag if it was not. -32768 stays as it is, which is its
+    right size when read as unsigned.
+    """
+    lines.at(name + "$positive")
+    lines.jump("D", "JGE")
+    lines.at(negative)
+    lines.assign("M", "!M")
+    lines.at(register)
+    lines.assign("M", "-M")
+    lines.assign("D", "M")
+    lines.label(name + "$positive")
+
+
+def convert_divide_routine(lines):
+    """
+    Math.divide by long division over the 16 bits of |x|: each step moves
+    the next bit of x into the remainder and takes y out of it when it fits.
+    the remainder is read as unsigned, as doubling it can pass 32767. the
+    quotient is negated if the signs differ, so it rounds toward zero like
+    the OS, and dividing by 0 gives 0.
+    :param lines: (InstructionList) the commands to add to.
+    """
+    negative = DIVIDE + "$negative"
+    quotient = DIVIDE + "$quotient"
+    remainder = DIVIDE + "$remainder"
+    count = DIVIDE + "$count"
+    lines.label(DIVIDE + "$intrinsic")
+    convert_pop_operands(lines)
+    lines.at(negative)
+    lines.assign("M", "0")
+    convert_absolute(lines, "R13", negative, DIVIDE + "$x")
+    lines.at("R14")
+    lines.assign("D", "M")
+    lines.at(DIVIDE + "$zero")
+    lines.jump("D", "JEQ")
+    convert_absolute(lines, "R14", negative, DIVIDE + "$y")
+    # |y| is 32768 only when y is -32768, only |x| = 32768 divides by it.
+    lines.at(DIVIDE + "$smallest")
+    lines.jump("D", "JLT")
+    lines.at(quotient)
+    lines.assign("M", "0")
+    lines.at(remainder)
+    lines.assign("M", "0")
+    lines.at(16)
+    lines.assign("D", "A")
+    lines.at(count)
+    lines.assign("M", "D")
+    lines.label(DIVIDE + "$loop")
+    lines.at(remainder)
+    lines.assign("D", "M")
+    lines.assign("M", "D+M")
+    lines.at("R13")
+    lines.assign("D", "M")
+    lines.at(DIVIDE + "$no_carry")
+    lines.jump("D", "JGE")
+    lines.at(remainder)
+    lines.assign("M", "M+1")
+    lines.label(DIVIDE + "$no_carry")
+    lines.at("R13")
+    lines.assign("D", "M")
+    lines.assign("M", "D+M")
+    lines.at(quotient)
+    lines.assign("D", "M")
+    lines.assign("M", "D+M")
+    # a remainder of 32768 or more (negative when signed) is bigger than y.
+    lines.at(remainder)
+    lines.assign("D", "M")
+    lines.at(DIVIDE + "$subtract")
+    lines.jump("D", "JLT")
+    lines.at("R14")
+    lines.assign("D", "D-M")
+    lines.at(DIVIDE + "$next")
+    lines.jump("D", "JLT")
+    lines.label(DIVIDE + "$subtract")
+    lines.at("R14")
+    lines.assign("D", "M")
+    lines.at(remainder)
+    lines.assign("M", "M-D")
+    lines.at(quotient)
+    lines.assign("M", "M+1")
+    lines.label(DIVIDE + "$next")
+    lines.at(count)
+    lines.assign("MD", "M-1")
+    lines.at(DIVIDE + "$loop")
+    lines.jump("D", "JGT")
+    lines.at(quotient)
+    lines.assign("D", "M")
+    lines.at(DIVIDE + "$sign")
+    lines.jump("0", "JMP")
+    lines.label(DIVIDE + "$smallest")
+    lines.at("R13")
+    lines.assign("D", "M")
+    lines.at(DIVIDE + "$zero")
+    lines.jump("D", "JGE")
+    lines.assign("D", "1")
+    lines.at(DIVIDE + "$sign")
+    lines.jump("0", "JMP")
+    lines.label(DIVIDE + "$zero")
+    lines.assign("D", "0")
+    lines.label(DIVIDE + "$sign")
+    convert_divide_sign(lines, quotient, negative)
+
+
+def convert_shift_right_routine(lines):
+    """
+    divides the top of the stack by the power of two in R14: every bit of
+    |x| from that power up is copied down to the bit it lands on, and the
+    result is negated for a negative x, rounding toward zero.
+    :param lines: (InstructionList) the commands to add to.
+    """
+    negative = SHIFT_RIGHT + "$negative"
+    quotient = SHIFT_RIGHT + "$quotient"
+    target = SHIFT_RIGHT + "$target"
+    lines.label(SHIFT_RIGHT + "$intrinsic")
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("D", "M")
+    lines.at("R13")
+    lines.assign("M", "D")
+    lines.at(negative)
+    lines.assign("M", "0")
+    convert_absolute(lines, "R13", negative, SHIFT_RIGHT + "$x")
+    lines.at(quotient)
+    lines.assign("M", "0")
+    lines.at(target)
+    lines.assign("M", "1")
+    lines.label(SHIFT_RIGHT + "$loop")
+    # the bit read from x passed bit 15 and became 0.
+    lines.at("R14")
+    lines.assign("D", "M")
+    lines.at(SHIFT_RIGHT + "$end")
+    lines.jump("D", "JEQ")
+    lines.at("R13")
+    lines.assign("D", "D&M")
+    lines.at(SHIFT_RIGHT + "$skip")
+    lines.jump("D", "JEQ")
+    lines.at(target)
+    lines.assign("D", "M")
+    lines.at(quotient)
+    lines.assign("M", "D|M")
+    lines.label(SHIFT_RIGHT + "$skip")
+    lines.at("R14")
+    lines.assign("D", "M")
+    lines.assign("M", "D+M")
+    lines.at(target)
+    lines.assign("D", "M")
+    lines.assign("M", "D+M")
+    lines.at(SHIFT_RIGHT + "$loop")
+    lines.jump("0", "JMP")
+    lines.label(SHIFT_RIGHT + "$end")
+    lines.at(quotient)
+    lines.assign("D", "M")
+    convert_divide_sign(lines, quotient, negative)
+
+
+def convert_routines(lines, names, routines=None):
+    """
+    adds the routines the program calls, after a halt loop so running past
+    the end of the program never enters them.
+    :param lines: (InstructionList) the commands to add to.
+    :param names: (iterable) the routines the program calls.
+    :param routines: (dict) the function making each routine, when not only
+    the intrinsic ROUTINES are used.
+    :return: (list) where each routine starts in lines, in order.
+    """
+    if routines is None:
+        routines = ROUTINES
+    starts = list()
+    if not names:
+        return starts
+    lines.label(ROUTINES_GUARD)
+    lines.at(ROUTINES_GUARD)
+    lines.jump("0", "JMP")
+    for name in sorted(names):
+        starts.append(len(lines))
+        routines[name](lines)
+    return starts
+
+
+# the number of arguments of each intrinsic.
+INTRINSICS = {MULTIPLY: 2, DIVIDE: 2, PEEK: 1, POKE: 2}
+ROUTINES = {MULTIPLY: convert_multiply_routine,
+            DIVIDE: convert_divide_routine,
+            SHIFT_RIGHT: convert_shift_right_routine}
@@ -1,36 +1,109 @@
+import argparse
+import io
 import os
 import sys
+import time
+import tracemalloc
 from pathlib import Path
 
+from ControlFlow import optimize_control_flow, rotate_loops
+from Cost import estimate_function, routine_costs, write_costs
+from Frames import FRAME_REGISTERS, frame_layouts
+from Inlining import inline_callees, inline_calls
+from Instructions import InstructionList, TextList, symbol_table
+from Intrinsics import INTRINSICS, ROUTINES, RETURN_REGISTER, MULTIPLY, \
+    DIVIDE, PEEK, POKE, SHIFT_RIGHT, power_of_two, convert_peek, \
+    convert_poke, convert_routine_call, convert_multiply_power, \
+    convert_divide_power, convert_routines
+from Parser import PUSH, POP, ADD, SUBTRUCT, NEGATE, EQUALS, GREATER_THEN, \
+    LOWER_THEN, AND, OR, NOT, LABEL, GOTO, IFGOTO, FUNCTION, CALL, RETURN, \
+    COPY, CONSTANT, LOCAL, THIS, THAT, ARGUMENT, STATIC, TEMP, POINTER, \
+    FIXED, UNCHECKED, parse_lines, split_functions
+from Profile import HOT_FRACTION, read_profile, hot_functions, \
+    order_functions
+from Promotion import FIXED_PREFIX, promote_frames, promote_commands, \
+    variable_budget, \
+    convert_promoted_function
+from Ranges import mark_unchecked_compares
+from StackDepth import max_stack_depth, convert_offset_command, \
+    convert_offset_ifgoto, convert_stack_adjust
+from SegmentCache import SegmentCache
+from ValueNumbering import number_values
+
 label_counter = 0
 return_counter = 0
 function_name = "main"
-VM_FILE = 1
-PUSH = "push"
-POP = "pop"
-ADD = "add"
-SUBTRUCT = "sub"
-NEGATE = "neg"
-EQUALS = "eq"
-GREATER_THEN = "gt"
-LOWER_THEN = "lt"
-AND = "and"
-OR = "or"
-NOT = "not"
-LABEL = "label"
-GOTO = "goto"
-IFGOTO = "if-goto"
-FUNCTION = "function"
-CALL = "call"
-RETURN = "return"
-CONSTANT = "constant"
-LOCAL = "local"
-THIS = "this"
-THAT = "that"
-ARGUMENT = "argument"
-STATIC = "static"
-TEMP = "temp"
-POINTER = "pointer"
+OPTIMIZE_CONTROL_FLOW = "cfg"
+FUSE_COMPARE_BRANCH = "fuse-compare"
+USE_INTRINSICS = "intrinsics"
+COALESCE_STACK = "sp-coalesce"
+CACHE_BASES = "cache-bases"
+NUMBER_VALUES = "cse"
+PROMOTE_LOCALS = "promote"
+# promotes the arguments of the same functions along with their locals.
+PROMOTE_ARGUMENTS = "promote-args"
+ELIDE_FRAMES = "elide-frames"
+CHECK_RANGES = "ranges"
+ROTATE_LOOPS = "rotate-loops"
+OPTIMIZATIONS = (OPTIMIZE_CONTROL_FLOW, FUSE_COMPARE_BRANCH, USE_INTRINSICS,
+                 COALESCE_STACK, CACHE_BASES, NUMBER_VALUES, PROMOTE_LOCALS,
+                 PROMOTE_ARGUMENTS, ELIDE_FRAMES, CHECK_RANGES, ROTATE_LOOPS)
+# the jump that is taken exactly when the given jump is not.
+OPPOSITE_JUMPS = {"JGT": "JLE", "JLE": "JGT", "JLT": "JGE", "JGE": "JLT",
+                  "JEQ": "JNE", "JNE": "JEQ"}
+ALL_OPTIMIZATIONS = "all"
+# the optimizations turned on for the translation running now.
+optimizations = set()
+# the intrinsics turned off even when intrinsics are used, and the shared
+# routines the program calls so far.
+disabled_intrinsics = set()
+used_routines = set()
+# the most values each translated function keeps on its working stack.
+stack_depths = dict()
+# the values value numbering replaced by copies in each function, and the
+# vm commands that removed.
+value_folds = dict()
+# how many loops of each function were rotated.
+rotated_loops = dict()
+# how many gt/lt commands of each function value ranges showed can not
+# overflow.
+unchecked_compares = dict()
+# the fixed frame of each function whose locals were promoted, and how many
+# words of ram all of them take.
+promoted_frames = dict()
+promoted_words = 0
+# the registers a call to each function saves, and the ones the return of
+# the function being translated restores.
+layouts = dict()
+return_registers = FRAME_REGISTERS
+# the shared routines cold code calls instead of inlining the same code.
+SHARED_CALL = "VM$call"
+SHARED_RETURN = "VM$return"
+SHARED_COMPARE = "VM$"
+# a cold function with more locals than this pushes them in a loop.
+MAX_UNROLLED_LOCALS = 2
+# with a profile, the functions that did too little work to be worth fast
+# code, whether the function being translated is one of them, and the
+# function making each shared routine the program calls.
+cold_functions = set()
+compact = False
+# with a profile, the short functions that call nothing whose calls from hot
+# functions are replaced by their commands, how many fixed words after the
+# promoted frames their bodies may take and take, and how many calls of
+# each function were inlined.
+inline_targets = dict()
+inline_room = 0
+inlined_words = 0
+inlined_calls = dict()
+shared_routines = dict()
+# the names the stats print for the ways of keeping the instructions.
+LIST_NAMES = {InstructionList: "compact", TextList: "string list"}
+# when estimating, the commands and pieces of Assembly of each function
+# until the routines they jump to are made, and then the cost report of
+# each function.
+estimating = False
+estimates = list()
+function_costs = dict()
 
 
 def first_pass(lines):
@@ -74,884 +147,1495 @@ def read_file_in_args(file_name):
     return lines
 
 
-def convert_lines(lines, file_name):
+def translate(files, enabled=(), disabled=(), profile=None,
+              hot_fraction=HOT_FRACTION, estimate=False,
+              list_class=InstructionList):
+    """
+    translates a whole vm program to hack Assembly.
+    :param files: (list) a (file_name, lines) pair for each vm file, where
+    file_name is the prefix of its static variables and lines are the lines
+    read from it.
+    :param enabled: (iterable) the names of the optimizations to run.
+    :param disabled: (iterable) the names of functions that should be called
+    normally even when intrinsics are used.
+    :param profile: (dict) counts of a run of the program, to make only the
+    hot functions fast and the rest small and inline the short functions
+    the hot ones call, or None.
+    :param hot_fraction: (float) the share of the profiled work a function
+    needs to be hot.
+    :param estimate: (bool) True to work out the cycles each function takes
+    without running it, into function_costs.
+    :param list_class: (type) what the instructions are kept in, TextList
+    makes the list of strings the translator used before InstructionList.
+    :return: (InstructionList) the translated program, starting with the
+    bootstrap code.
+    """
+    global label_counter
+    global return_counter
+    global optimizations
+    global disabled_intrinsics
+    global used_routines
+    global stack_depths
+    global value_folds
+    global unchecked_compares
+    global rotated_loops
+    global promoted_frames
+    global promoted_words
+    global layouts
+    global cold_functions
+    global inline_targets
+    global inline_room
+    global inlined_words
+    global inlined_calls
+    global shared_routines
+    global estimating
+    global estimates
+    global function_costs
+    label_counter = 0
+    return_counter = 0
+    optimizations = set(enabled)
+    disabled_intrinsics = set(disabled)
+    used_routines = set()
+    stack_depths = dict()
+    value_folds = dict()
+    unchecked_compares = dict()
+    rotated_loops = dict()
+    promoted_frames = dict()
+    promoted_words = 0
+    layouts = dict()
+    cold_functions = set()
+    inline_targets = dict()
+    inline_room = 0
+    inlined_words = 0
+    inlined_calls = dict()
+    shared_routines = dict()
+    estimating = estimate
+    estimates = list()
+    function_costs = dict()
+    functions = list()
+    for file_name, lines in files:
+        commands = parse_lines(first_pass(lines))
+        functions.extend(split_functions(commands, file_name))
+    if profile is not None:
+        hot = hot_functions(profile, hot_fraction)
+        cold_functions = set(function.name for function in functions
+                             if function.name is not None
+                             and function.name not in hot)
+        functions = order_functions(functions, profile)
+    # the intrinsics never call back into the program or move THIS/THAT.
+    leaves = set()
+    if USE_INTRINSICS in optimizations:
+        leaves = set(INTRINSICS) - disabled_intrinsics
+    if (PROMOTE_LOCALS in optimizations
+            or PROMOTE_ARGUMENTS in optimizations):
+        promoted_frames, promoted_words = promote_frames(
+            functions, leaves, PROMOTE_ARGUMENTS in optimizations)
+    if ELIDE_FRAMES in optimizations:
+        layouts = frame_layouts(functions, leaves)
+    if profile is not None:
+        inline_targets = {name: callee for name, callee
+                          in inline_callees(functions).items()
+                          if name not in leaves}
+        inline_room = variable_budget(functions) - promoted_words
+    # every converter adds its instructions to the end of this one list.
+    program = list_class()
+    make_boot(program)
+    convert_call(program, "Sys.init", 0, 0,
+                 layouts.get("Sys.init", FRAME_REGISTERS))
+    for function in functions:
+        convert_vm_function(program, function)
+    starts = convert_routines(program, used_routines,
+                              dict(ROUTINES, **shared_routines))
+    if estimating:
+        routines = routine_costs(program, starts, len(program))
+        for name, commands, spans in estimates:
+            function_costs[name] = estimate_function(commands, spans,
+                                                     program, routines)
+    return program
+
+
+def convert_vm_function(lines, function):
     """
-    receives a list of lines in vm code and converts each one to hack
+    runs the enabled optimizations on a vm function and converts it.
+    :param lines: (InstructionList) the commands to add to.
+    :param function: (VMFunction) the function.
+    """
+    global return_registers
+    global compact
+    global inlined_words
+    return_registers = layouts.get(function.name, FRAME_REGISTERS)
+    compact = function.name in cold_functions
+    commands = function.all_commands()
+    if inline_targets and function.name is not None and not compact:
+        commands, inlined_calls[function.name], words = inline_calls(
+            commands, function, inline_targets, promoted_words, inline_room)
+        inlined_words = max(inlined_words, words)
+    if OPTIMIZE_CONTROL_FLOW in optimizations:
+        commands = optimize_control_flow(commands)
+    name = function.name or function.file_name[:-1]
+    if ROTATE_LOOPS in optimizations:
+        commands, rotated_loops[name] = rotate_loops(commands)
+    if function.name in promoted_frames:
+        commands = promote_commands(commands, promoted_frames[function.name])
+    if NUMBER_VALUES in optimizations:
+        commands, folds, saved = number_values(commands)
+        value_folds[name] = (folds, saved)
+    if CHECK_RANGES in optimizations:
+        commands, unchecked_compares[name] = mark_unchecked_compares(
+            commands)
+    stack_depths[name] = max_stack_depth(commands)
+    if not estimating:
+        convert_commands(lines, commands, function.file_name)
+        return
+    spans = list()
+    convert_commands(lines, commands, function.file_name, spans)
+    estimates.append((name, commands, spans))
+
+
+def convert_commands(lines, commands, file_name, spans=None):
+    """
+    receives a list of parsed vm commands and converts each one to hack
     Assembly language.
-    :param lines: (list) the lines in vm code.
+    :param lines: (InstructionList) the commands to add to.
+    :param commands: (list) the vm commands.
     :param file_name: (str) the vm file name (for static).
-    :return: (list) the same lines in hack Assembly.
+    :param spans: (list) if given, gets the first and last command of each
+    piece of Assembly made and where the piece starts and ends in lines.
     """
-    assembly_lines = list()
-    for line in lines:
-        # for each line in vm code the convert line will produce a few lines,
-        # represented in a list so we must go over them all.
-        converted_list = convert_line(line, file_name)
-        for converted_line in converted_list:
-            assembly_lines.append(converted_line)
-    return assembly_lines
+    # when coalescing SP updates, how far the real SP is above the one in
+    # ram. it goes back to 0 before anything that needs SP in ram.
+    offset = 0
+    cache = None
+    if CACHE_BASES in optimizations and not compact:
+        cache = SegmentCache(commands)
+    index = 0
+    while index < len(commands):
+        if spans is not None:
+            close_span(spans, index, len(lines))
+            spans.append((index, None, len(lines), None))
+        command = commands[index]
+        if cache is not None:
+            cache.visit(index, command)
+        if USE_INTRINSICS in optimizations:
+            end = convert_intrinsic(lines, commands, index, file_name,
+                                    offset)
+            if end is not None:
+                offset = 0
+                if cache is not None:
+                    # the routines use the scratch registers.
+                    cache.clear()
+                index = end + 1
+                continue
+        # in cold code a shared gt/lt routine is smaller than fusing it.
+        if FUSE_COMPARE_BRANCH in optimizations and (
+                not compact or command.kind == EQUALS
+                or command.arg1 == UNCHECKED):
+            fused = match_compare_branch(commands, index)
+            if fused is not None:
+                end, negate = fused
+                convert_stack_adjust(lines, offset)
+                convert_compare_goto(
+                    lines, command.kind, negate, commands[end].arg1,
+                    function_name, command.arg1 == UNCHECKED)
+                offset = 0
+                index = end + 1
+                continue
+        if COALESCE_STACK in optimizations:
+            coalesced = convert_offset_command(lines, command, offset,
+                                               file_name, cache)
+            if coalesced is not None:
+                offset = coalesced
+                index += 1
+                continue
+            if command.kind == IFGOTO:
+                convert_offset_ifgoto(
+                    lines, offset, function_name + "$" + command.arg1)
+                offset = 0
+                index += 1
+                continue
+            convert_stack_adjust(lines, offset)
+            offset = 0
+        if cache is not None and cache.convert_command(lines, command):
+            index += 1
+            continue
+        # for each vm command the convert command will produce a few
+        # instructions, it appends their codes to the shared
+        # InstructionList without making any text.
+        convert_command(lines, command, file_name)
+        index += 1
+    convert_stack_adjust(lines, offset)
+    if spans is not None:
+        close_span(spans, index, len(lines))
+
+
+def close_span(spans, index, position):
+    """
+    ends the last piece of Assembly in spans, if it is still open.
+    :param spans: (list) the pieces made so far.
+    :param index: (int) the first command not in the piece.
+    :param position: (int) where the piece ends in the Assembly.
+    """
+    if spans and spans[-1][1] is None:
+        first, _, start, _ = spans[-1]
+        spans[-1] = (first, index - 1, start, position)
 
 
-def convert_line(line, file_name):
+def is_intrinsic_call(command, name=None):
+    """
+    :param command: (VMCommand) a vm command.
+    :param name: (str) the intrinsic to look for, or None for any of them.
+    :return: (bool) True if the command is a call that will be replaced by
+    an intrinsic.
     """
-    converts a single line of vm code to however many lines it is in the
-    hack assembly language.
-    :param line: (str) the vm line.
+    return (command.kind == CALL and command.arg1 in INTRINSICS
+            and command.arg1 not in disabled_intrinsics
+            and INTRINSICS[command.arg1] == command.arg2
+            and (name is None or command.arg1 == name))
+
+
+def convert_intrinsic(lines, commands, index, file_name, offset):
+    """
+    checks if the commands starting at index are a call to an intrinsic, or
+    a multiply/divide by a constant power of two followed by its call, and
+    converts them after writing back the moves of SP that were left out.
+    :param lines: (InstructionList) the commands to add to.
+    :param commands: (list) the vm commands.
+    :param index: (int) where the call or the constant should be.
+    :param file_name: (str) the vm file name (for static).
+    :param offset: (int) how far the real SP is above the one in ram.
+    :return: (int) the index of the last command used, or None if the
+    commands do not match (and nothing was added).
+    """
+    global label_counter
+    command = commands[index]
+    following = commands[index + 1:index + 3]
+    power = None
+    if command.kind == PUSH and command.arg1 == CONSTANT:
+        power = power_of_two(command.arg2)
+    if power is not None and following:
+        # y is the constant: "push constant 2^k; call".
+        if is_intrinsic_call(following[0], MULTIPLY):
+            convert_stack_adjust(lines, offset)
+            convert_multiply_power(lines, power)
+            return index + 1
+        if is_intrinsic_call(following[0], DIVIDE):
+            if power > 0:
+                used_routines.add(SHIFT_RIGHT)
+            label_counter += 1
+            convert_stack_adjust(lines, offset)
+            convert_divide_power(lines, power,
+                                 "RETURN_INTRINSIC" + str(label_counter))
+            return index + 1
+        # x is the constant: "push constant 2^k; push y; call".
+        if (len(following) == 2 and following[0].kind == PUSH
+                and is_intrinsic_call(following[1], MULTIPLY)):
+            convert_stack_adjust(lines, offset)
+            convert_command(lines, following[0], file_name)
+            convert_multiply_power(lines, power)
+            return index + 2
+    if not is_intrinsic_call(command):
+        return None
+    convert_stack_adjust(lines, offset)
+    if command.arg1 == PEEK:
+        convert_peek(lines)
+    elif command.arg1 == POKE:
+        convert_poke(lines)
+    else:
+        used_routines.add(command.arg1)
+        label_counter += 1
+        convert_routine_call(lines, command.arg1,
+                             "RETURN_INTRINSIC" + str(label_counter))
+    return index
+
+
+def match_compare_branch(commands, index):
+    """
+    checks if the commands starting at index are an eq/gt/lt followed by any
+    number of nots and then an if-goto, which can be translated together.
+    :param commands: (list) the vm commands.
+    :param index: (int) where the comparison should be.
+    :return: (tuple) the index of the if-goto and whether the nots flip the
+    condition, or None if the commands do not match.
+    """
+    if commands[index].kind not in (EQUALS, GREATER_THEN, LOWER_THEN):
+        return None
+    negate = False
+    end = index + 1
+    # the comparison leaves -1 or 0, so each not simply flips it.
+    while end < len(commands) and commands[end].kind == NOT:
+        negate = not negate
+        end += 1
+    if end < len(commands) and commands[end].kind == IFGOTO:
+        return end, negate
+    return None
+
+
+def convert_command(lines, command, file_name):
+    """
+    converts a single vm command to however many lines it is in the hack
+    assembly language, adding them to the end of lines.
+    :param lines: (InstructionList) the commands to add to.
+    :param command: (VMCommand) the vm command.
     :param file_name: (str) the vm file name (for static).
-    :return: (list) a list of assembly commands that represent the one line
-    of vm code.
     """
-    assembly_lines = list()
     global return_counter
-    global function_name
-    # first check if it is a push/pop/arithmetic/logic command.
-    if line.startswith(PUSH):
-        # we will look at the line without the "push" start, named line 2 for
-        # the "second part" of the line, then we will break its second part
-        # as well for the number, named line3 for the "third part" of the
-        # command.
-        line2 = line[len(PUSH):]
-        if line2.startswith(CONSTANT):
-            line3 = line2[len(CONSTANT):]
-            assembly_lines = convert_constant(line3)
-        elif line2.startswith(LOCAL):
-            line3 = line2[len(LOCAL):]
-            assembly_lines = convert_push_local(line3)
-        elif line2.startswith(THIS):
-            line3 = line2[len(THIS):]
-            assembly_lines = convert_push_this(line3)
-        elif line2.startswith(THAT):
-            line3 = line2[len(THAT):]
-            assembly_lines = convert_push_that(line3)
-        elif line2.startswith(ARGUMENT):
-            line3 = line2[len(ARGUMENT):]
-            assembly_lines = convert_push_argument(line3)
-        elif line2.startswith(STATIC):
-            line3 = line2[len(STATIC):]
-            assembly_lines = convert_push_static(line3, file_name)
-        elif line2.startswith(TEMP):
-            line3 = line2[len(TEMP):]
-            assembly_lines = convert_push_temp(line3)
-        elif line2.startswith(POINTER):
-            line3 = line2[len(POINTER):]
-            assembly_lines = convert_push_pointer(line3)
-    elif line.startswith(POP):
-        # we will look at the line without the "pop" start, same as with push.
-        line2 = line[len(POP):]
-        if line2.startswith(LOCAL):
-            line3 = line2[len(LOCAL):]
-            assembly_lines = convert_pop_local(line3)
-        elif line2.startswith(THIS):
-            line3 = line2[len(THIS):]
-            assembly_lines = convert_pop_this(line3)
-        elif line2.startswith(THAT):
-            line3 = line2[len(THAT):]
-            assembly_lines = convert_pop_that(line3)
-        elif line2.startswith(ARGUMENT):
-            line3 = line2[len(ARGUMENT):]
-            assembly_lines = convert_pop_argument(line3)
-        elif line2.startswith(STATIC):
-            line3 = line2[len(STATIC):]
-            assembly_lines = convert_pop_static(line3, file_name)
-        elif line2.startswith(TEMP):
-            line3 = line2[len(TEMP):]
-            assembly_lines = convert_pop_temp(line3)
-        elif line2.startswith(POINTER):
-            line3 = line2[len(POINTER):]
-            assembly_lines = convert_pop_pointer(line3)
-    elif line.startswith(LABEL):
-        line2 = line[len(LABEL):]
-        assembly_lines = convert_label(line2, function_name)
-    elif line.startswith(GOTO):
-        line2 = line[len(GOTO):]
-        assembly_lines = convert_goto(line2, function_name)
-    elif line.startswith(IFGOTO):
-        line2 = line[len(IFGOTO):]
-        assembly_lines = convert_ifgoto(line2, function_name)
-    elif line.startswith(FUNCTION):
-        func_line = line.split(" ")
-        # 1 is the function name and 2 is the number of variables.
-        assembly_lines = convert_function(func_line[1], func_line[2])
-    elif line.startswith(CALL):
+    kind = command.kind
+    # the converters of push/pop take the index as a string.
+    segment = command.arg1
+    index = str(command.arg2)
+    if kind == PUSH:
+        if segment == CONSTANT:
+            convert_constant(lines, index)
+        elif segment == LOCAL:
+            convert_push_local(lines, index)
+        elif segment == THIS:
+            convert_push_this(lines, index)
+        elif segment == THAT:
+            convert_push_that(lines, index)
+        elif segment == ARGUMENT:
+            convert_push_argument(lines, index)
+        elif segment == STATIC:
+            convert_push_static(lines, index, file_name)
+        elif segment == TEMP:
+            convert_push_temp(lines, index)
+        elif segment == POINTER:
+            convert_push_pointer(lines, index)
+        elif segment == FIXED:
+            convert_push_static(lines, index, FIXED_PREFIX)
+    elif kind == POP:
+        if segment == LOCAL:
+            convert_pop_local(lines, index)
+        elif segment == THIS:
+            convert_pop_this(lines, index)
+        elif segment == THAT:
+            convert_pop_that(lines, index)
+        elif segment == ARGUMENT:
+            convert_pop_argument(lines, index)
+        elif segment == STATIC:
+            convert_pop_static(lines, index, file_name)
+        elif segment == TEMP:
+            convert_pop_temp(lines, index)
+        elif segment == POINTER:
+            convert_pop_pointer(lines, index)
+        elif segment == FIXED:
+            convert_pop_static(lines, index, FIXED_PREFIX)
+    elif kind == LABEL:
+        convert_label(lines, command.arg1, function_name)
+    elif kind == GOTO:
+        convert_goto(lines, command.arg1, function_name)
+    elif kind == IFGOTO:
+        convert_ifgoto(lines, command.arg1, function_name)
+    elif kind == FUNCTION and command.arg1 in promoted_frames:
+        convert_promoted_function(lines, command.arg1,
+                                  promoted_frames[command.arg1])
+    elif (kind == FUNCTION and compact
+          and command.arg2 > MAX_UNROLLED_LOCALS):
+        convert_compact_function(lines, command.arg1, command.arg2)
+    elif kind == FUNCTION:
+        convert_function(lines, command.arg1, command.arg2)
+    elif kind == CALL and compact:
+        return_counter += 1
+        convert_shared_call(
+            lines, command.arg1, command.arg2, return_counter,
+            layouts.get(command.arg1, FRAME_REGISTERS))
+    elif kind == CALL:
         return_counter += 1
-        call_line = line.split(" ")
-        # 1 is the function name and 2 is the number of arguments.
-        assembly_lines = convert_call(call_line[1], call_line[2],
-                                      return_counter)
-    elif line.startswith(RETURN):
-        assembly_lines = convert_return()
+        convert_call(
+            lines, command.arg1, command.arg2, return_counter,
+            layouts.get(command.arg1, FRAME_REGISTERS))
+    elif kind == RETURN and compact:
+        convert_shared_return(lines, return_registers)
+    elif kind == RETURN:
+        convert_return(lines, return_registers)
+    elif kind in (GREATER_THEN, LOWER_THEN) and command.arg1 == UNCHECKED:
+        convert_unchecked_compare(lines, kind)
+    elif kind in (EQUALS, GREATER_THEN, LOWER_THEN) and compact:
+        convert_shared_compare(lines, kind)
+    elif kind == COPY:
+        convert_copy(lines, command.arg2)
     else:
         # for better code understanding i chose to use a function for each
         # translation as each adds many separate lines.
-        if line.startswith(ADD):
-            assembly_lines = convert_add()
-        elif line.startswith(SUBTRUCT):
-            assembly_lines = convert_sub()
-        elif line.startswith(NEGATE):
-            assembly_lines = convert_neg()
-        elif line.startswith(EQUALS):
-            assembly_lines = convert_eq()
-        elif line.startswith(GREATER_THEN):
-            assembly_lines = convert_gt()
-        elif line.startswith(LOWER_THEN):
-            assembly_lines = convert_lt()
-        elif line.startswith(AND):
-            assembly_lines = convert_and()
-        elif line.startswith(OR):
-            assembly_lines = convert_or()
-        elif line.startswith(NOT):
-            assembly_lines = convert_not()
-    return assembly_lines
-
-
-def convert_return():
-    lines = list()
-    # save return address
-    lines.append("@5")
-    lines.append("D=A")
-    lines.append("@LCL")
-    lines.append("A=M-D")
-    lines.append("D=M")
-    lines.append("@return_address")
-    lines.append("M=D")
+        if kind == ADD:
+            convert_add(lines)
+        elif kind == SUBTRUCT:
+            convert_sub(lines)
+        elif kind == NEGATE:
+            convert_neg(lines)
+        elif kind == EQUALS:
+            convert_eq(lines)
+        elif kind == GREATER_THEN:
+            convert_gt(lines)
+        elif kind == LOWER_THEN:
+            convert_lt(lines)
+        elif kind == AND:
+            convert_and(lines)
+        elif kind == OR:
+            convert_or(lines)
+        elif kind == NOT:
+            convert_not(lines)
+
+
+def convert_return(lines, saved=FRAME_REGISTERS):
+    # save return address, it is right under the saved registers
+    lines.at(len(saved) + 1)
+    lines.assign("D", "A")
+    lines.at("LCL")
+    lines.assign("A", "M-D")
+    lines.assign("D", "M")
+    lines.at("return_address")
+    lines.assign("M", "D")
     # *ARG = pop()
-    lines.append("@SP")
-    lines.append("A=M-1")
-    lines.append("D=M")
-    lines.append("@ARG")
-    lines.append("A=M")
-    lines.append("M=D")
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("D", "M")
+    lines.at("ARG")
+    lines.assign("A", "M")
+    lines.assign("M", "D")
     # SP = ARG + 1
-    lines.append("@ARG")
-    lines.append("D=M")
-    lines.append("@SP")
-    lines.append("M=D+1")
-    # reposition that
-    lines.append("@1")
-    lines.append("D=A")
-    lines.append("@LCL")
-    lines.append("A=M-D")
-    lines.append("D=M")
-    lines.append("@THAT")
-    lines.append("M=D")
-    # reposition this
-    lines.append("@2")
-    lines.append("D=A")
-    lines.append("@LCL")
-    lines.append("A=M-D")
-    lines.append("D=M")
-    lines.append("@THIS")
-    lines.append("M=D")
-    # reposition arg
-    lines.append("@3")
-    lines.append("D=A")
-    lines.append("@LCL")
-    lines.append("A=M-D")
-    lines.append("D=M")
-    lines.append("@ARG")
-    lines.append("M=D")
-    # reposition lcl
-    lines.append("@4")
-    lines.append("D=A")
-    lines.append("@LCL")
-    lines.append("A=M-D")
-    lines.append("D=M")
-    lines.append("@LCL")
-    lines.append("M=D")
+    lines.at("ARG")
+    lines.assign("D", "M")
+    lines.at("SP")
+    lines.assign("M", "D+1")
+    # reposition the saved registers from the last one down, LCL is last as
+    # the frame is found through it
+    for offset, register in enumerate(reversed(saved), 1):
+        lines.at(offset)
+        lines.assign("D", "A")
+        lines.at("LCL")
+        lines.assign("A", "M-D")
+        lines.assign("D", "M")
+        lines.at(register)
+        lines.assign("M", "D")
     # goto ret
-    lines.append("@return_address")
-    lines.append("A=M")
-    lines.append("0;JMP")
-    return lines
+    lines.at("return_address")
+    lines.assign("A", "M")
+    lines.jump("0", "JMP")
 
 
-def convert_call(func_name, n_args, ret_counter):
-    lines = list()
+def convert_call(lines, func_name, n_args, ret_counter,
+                 saved=FRAME_REGISTERS):
     # push return address
-    lines.append("@" + func_name + "$ret" + str(ret_counter))
-    lines.append("D=A")
-    lines.append("@SP")
-    lines.append("M=M+1")
-    lines.append("A=M-1")
-    lines.append("M=D")
-    # push LCL
-    lines.append("@LCL")
-    lines.append("D=M")
-    lines.append("@SP")
-    lines.append("M=M+1")
-    lines.append("A=M-1")
-    lines.append("M=D")
-    # push ARG
-    lines.append("@ARG")
-    lines.append("D=M")
-    lines.append("@SP")
-    lines.append("M=M+1")
-    lines.append("A=M-1")
-    lines.append("M=D")
-    # push THIS
-    lines.append("@THIS")
-    lines.append("D=M")
-    lines.append("@SP")
-    lines.append("M=M+1")
-    lines.append("A=M-1")
-    lines.append("M=D")
-    # push THAT
-    lines.append("@THAT")
-    lines.append("D=M")
-    lines.append("@SP")
-    lines.append("M=M+1")
-    lines.append("A=M-1")
-    lines.append("M=D")
-    # ARG = SP - n - 5
-    lines.append("@" + str(int(n_args) + 5))
-    lines.append("D=A")
-    lines.append("@SP")
-    lines.append("D=M-D")
-    lines.append("@ARG")
-    lines.append("M=D")
+    lines.at(func_name + "$ret" + str(ret_counter))
+    lines.assign("D", "A")
+    lines.at("SP")
+    lines.assign("M", "M+1")
+    lines.assign("A", "M-1")
+    lines.assign("M", "D")
+    # push the registers the callee may change
+    for register in saved:
+        lines.at(register)
+        lines.assign("D", "M")
+        lines.at("SP")
+        lines.assign("M", "M+1")
+        lines.assign("A", "M-1")
+        lines.assign("M", "D")
+    # ARG = SP - n - the frame size
+    lines.at(int(n_args) + len(saved) + 1)
+    lines.assign("D", "A")
+    lines.at("SP")
+    lines.assign("D", "M-D")
+    lines.at("ARG")
+    lines.assign("M", "D")
     # LCL = SP
-    lines.append("@SP")
-    lines.append("D=M")
-    lines.append("@LCL")
-    lines.append("M=D")
+    lines.at("SP")
+    lines.assign("D", "M")
+    lines.at("LCL")
+    lines.assign("M", "D")
     # goto function
-    lines.append("@" + func_name)
-    lines.append("0;JMP")
+    lines.at(func_name)
+    lines.jump("0", "JMP")
     # set return address label
-    lines.append(
-        "(" + func_name + "$ret" + str(ret_counter) + ")")
+    lines.label(func_name + "$ret" + str(ret_counter))
     ret_counter += 1
-    return lines
 
 
-def convert_function(func_name, n_vars):
-    lines = list()
-    lines.append("(" + func_name + ")")
-    for i in range(int(n_vars)):
-        lines.append("@SP")
-        lines.append("M=M+1")
-        lines.append("A=M-1")
-        lines.append("M=0")
-    return lines
+def shared_name(base, saved):
+    """
+    :param base: (str) SHARED_CALL or SHARED_RETURN.
+    :param saved: (tuple) the registers the frame holds.
+    :return: (str) the name of the routine for frames holding them.
+    """
+    if saved == FRAME_REGISTERS:
+        return base
+    return base + "$" + "$".join(saved)
 
 
-def convert_ifgoto(label_name, func_name):
-    lines = list()
-    lines.append("@SP")
-    lines.append("M=M-1")
-    lines.append("A=M")
-    lines.append("D=M")
-    lines.append("@" + func_name + "$" + label_name)
-    lines.append("D;JNE")
-    return lines
+def convert_shared_call(lines, func_name, n_args, ret_counter, saved):
+    """
+    a call made through the shared call routine: the function goes in R13,
+    n plus the frame size in R14 and the return address in D.
+    :param lines: (InstructionList) the commands to add to.
+    :param func_name: (str) the function called.
+    :param n_args: (int) the number of arguments pushed for it.
+    :param ret_counter: (int) the number of the call, for its return label.
+    :param saved: (tuple) the registers the frame of the callee holds.
+    """
+    routine = shared_name(SHARED_CALL, saved)
+    used_routines.add(routine)
+    shared_routines[routine] = lambda lines: convert_call_routine(
+        lines, routine, saved)
+    lines.at(int(n_args) + len(saved) + 1)
+    lines.assign("D", "A")
+    lines.at("R14")
+    lines.assign("M", "D")
+    lines.at(func_name)
+    lines.assign("D", "A")
+    lines.at("R13")
+    lines.assign("M", "D")
+    lines.at(func_name + "$ret" + str(ret_counter))
+    lines.assign("D", "A")
+    lines.at(routine)
+    lines.jump("0", "JMP")
+    lines.label(func_name + "$ret" + str(ret_counter))
+
+
+def convert_call_routine(lines, routine, saved):
+    """
+    adds the shared call routine, the end of convert_call with the function
+    and the frame size in R13 and R14.
+    :param lines: (InstructionList) the commands to add to.
+    :param routine: (str) the name of the routine.
+    :param saved: (tuple) the registers the frames it makes hold.
+    """
+    lines.label(routine)
+    # push the return address
+    lines.at("SP")
+    lines.assign("M", "M+1")
+    lines.assign("A", "M-1")
+    lines.assign("M", "D")
+    for register in saved:
+        lines.at(register)
+        lines.assign("D", "M")
+        lines.at("SP")
+        lines.assign("M", "M+1")
+        lines.assign("A", "M-1")
+        lines.assign("M", "D")
+    # ARG = SP - n - the frame size
+    lines.at("R14")
+    lines.assign("D", "M")
+    lines.at("SP")
+    lines.assign("D", "M-D")
+    lines.at("ARG")
+    lines.assign("M", "D")
+    # LCL = SP
+    lines.at("SP")
+    lines.assign("D", "M")
+    lines.at("LCL")
+    lines.assign("M", "D")
+    lines.at("R13")
+    lines.assign("A", "M")
+    lines.jump("0", "JMP")
 
 
-def convert_goto(label_name, func_name):
-    lines = list()
-    lines.append("@" + func_name + "$" + label_name)
-    lines.append("0;JMP")
-    return lines
+def convert_shared_return(lines, saved):
+    """
+    adds a jump to the shared return routine.
+    :param lines: (InstructionList) the commands to add to.
+    :param saved: (tuple) the registers the frame of the function holds.
+    """
+    routine = shared_name(SHARED_RETURN, saved)
+    used_routines.add(routine)
+    shared_routines[routine] = lambda lines: convert_return_routine(
+        lines, routine, saved)
+    lines.at(routine)
+    lines.jump("0", "JMP")
 
 
-def convert_label(label_name, func_name):
-    lines = list()
-    lines.append(
-        "(" + func_name + "$" + label_name + ")")
-    return lines
+def convert_return_routine(lines, routine, saved):
+    """
+    adds the shared return routine.
+    :param lines: (InstructionList) the commands to add to.
+    :param routine: (str) the name of the routine.
+    :param saved: (tuple) the registers the frames it returns from hold.
+    """
+    lines.label(routine)
+    convert_return(lines, saved)
+
 
+def convert_shared_compare(lines, comparison):
+    """
+    an eq/gt/lt done by a shared routine, which gets the return address in
+    RETURN_REGISTER.
+    :param lines: (InstructionList) the commands to add to.
+    :param comparison: (str) eq, gt or lt.
+    """
+    global label_counter
+    routine = SHARED_COMPARE + comparison
+    used_routines.add(routine)
+    shared_routines[routine] = lambda lines: convert_compare_routine(
+        lines, comparison)
+    return_label = "RETURN_SHARED" + str(label_counter)
+    label_counter += 1
+    lines.at(return_label)
+    lines.assign("D", "A")
+    lines.at(RETURN_REGISTER)
+    lines.assign("M", "D")
+    lines.at(routine)
+    lines.jump("0", "JMP")
+    lines.label(return_label)
+
+
+def convert_compare_routine(lines, comparison):
+    """
+    adds the shared routine, the same commands as the inline comparison
+    followed by a jump back.
+    :param lines: (InstructionList) the commands to add to.
+    :param comparison: (str) eq, gt or lt.
+    """
+    lines.label(SHARED_COMPARE + comparison)
+    if comparison == EQUALS:
+        convert_eq(lines)
+    elif comparison == GREATER_THEN:
+        convert_gt(lines)
+    else:
+        convert_lt(lines)
+    lines.at(RETURN_REGISTER)
+    lines.assign("A", "M")
+    lines.jump("0", "JMP")
 
-def convert_constant(num):
+
+def convert_compact_function(lines, func_name, n_vars):
+    """
+    the start of a cold function with many locals, pushing them in a loop
+    instead of one after the other.
+    :param lines: (InstructionList) the commands to add to.
+    :param func_name: (str) the function.
+    :param n_vars: (int) the number of locals.
+    """
+    lines.label(func_name)
+    lines.at(n_vars)
+    lines.assign("D", "A")
+    lines.label(func_name + "$locals")
+    lines.at("SP")
+    lines.assign("M", "M+1")
+    lines.assign("A", "M-1")
+    lines.assign("M", "0")
+    lines.assign("D", "D-1")
+    lines.at(func_name + "$locals")
+    lines.jump("D", "JGT")
+
+
+def convert_function(lines, func_name, n_vars):
+    lines.label(func_name)
+    for i in range(int(n_vars)):
+        lines.at("SP")
+        lines.assign("M", "M+1")
+        lines.assign("A", "M-1")
+        lines.assign("M", "0")
+
+
+def convert_ifgoto(lines, label_name, func_name):
+    lines.at("SP")
+    lines.assign("M", "M-1")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    lines.at(func_name + "$" + label_name)
+    lines.jump("D", "JNE")
+
+
+def convert_compare_goto(lines, comparison, negate, label_name, func_name,
+                         unchecked=False):
+    """
+    the function for converting an eq/gt/lt command followed by an if-goto,
+    jumping on the comparison itself instead of pushing a boolean and
+    popping it again: pops both operands and jumps to the label when the
+    condition holds. gt and lt check the signs first just like convert_gt
+    and convert_lt, so the subtraction can only overflow where theirs can.
+    :param lines: (InstructionList) the commands to add to.
+    :param comparison: (str) eq, gt or lt.
+    :param negate: (bool) True to jump when the comparison is false (when
+    it was followed by a not).
+    :param label_name: (str) the label of the if-goto.
+    :param func_name: (str) the function the label is in.
+    :param unchecked: (bool) True if x - y can not overflow, so the signs
+    need no checking.
+    """
+    global label_counter
+    target = func_name + "$" + label_name
+    end = "END_FUSED" + str(label_counter)
+    if comparison == EQUALS or unchecked:
+        lines.at("SP")
+        lines.assign("AM", "M-1")
+        lines.assign("D", "M")
+        lines.at("SP")
+        lines.assign("AM", "M-1")
+        if comparison == EQUALS:
+            jump = "JEQ"
+            lines.assign("D", "D-M")
+        else:
+            jump = "JGT" if comparison == GREATER_THEN else "JLT"
+            lines.assign("D", "M-D")
+        lines.at(target)
+        lines.jump("D", OPPOSITE_JUMPS[jump] if negate else jump)
+        label_counter += 1
+        return
+    on_true, on_false = (end, target) if negate else (target, end)
+    # both operands are popped first, x is at SP and y at SP + 1.
+    lines.at("SP")
+    lines.assign("M", "M-1")
+    lines.assign("AM", "M-1")
+    lines.assign("D", "M")
+    lines.at("FIRST_POSITIVE" + str(label_counter))
+    lines.jump("D", "JGT")
+    # x is not positive.
+    lines.at("SP")
+    lines.assign("A", "M+1")
+    lines.assign("D", "M")
+    if comparison == GREATER_THEN:
+        lines.at(on_false)
+        lines.jump("D", "JGE")
+    else:
+        lines.at(on_true)
+        lines.jump("D", "JGT")
+    convert_compare_difference(lines, comparison, on_true, on_false, None)
+    lines.label("FIRST_POSITIVE" + str(label_counter))
+    lines.at("SP")
+    lines.assign("A", "M+1")
+    lines.assign("D", "M")
+    if comparison == GREATER_THEN:
+        lines.at(on_true)
+    else:
+        lines.at(on_false)
+    lines.jump("D", "JLE")
+    convert_compare_difference(lines, comparison, on_true, on_false, end)
+    lines.label(end)
+    label_counter += 1
+
+
+def convert_compare_difference(lines, comparison, on_true, on_false,
+                               next_label):
+    """
+    adds the end of a fused gt/lt, where both operands have signs that make
+    x - y safe to use: jumps to on_true if the comparison holds on x - y and
+    to on_false if not.
+    :param lines: (InstructionList) the commands to add to.
+    :param comparison: (str) gt or lt.
+    :param on_true: (str) where to go when the comparison holds.
+    :param on_false: (str) where to go when it does not.
+    :param next_label: (str) the label right after these commands, which
+    needs no jump to reach, or None.
+    """
+    lines.at("SP")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    lines.assign("A", "A+1")
+    lines.assign("D", "D-M")
+    jump = "JGT" if comparison == GREATER_THEN else "JLT"
+    if next_label == on_true:
+        # jump away only when the comparison fails and fall to on_true.
+        lines.at(on_false)
+        lines.jump("D", OPPOSITE_JUMPS[jump])
+        return
+    lines.at(on_true)
+    lines.jump("D", jump)
+    if next_label != on_false:
+        lines.at(on_false)
+        lines.jump("0", "JMP")
+
+
+def convert_goto(lines, label_name, func_name):
+    lines.at(func_name + "$" + label_name)
+    lines.jump("0", "JMP")
+
+
+def convert_label(lines, label_name, func_name):
+    lines.label(func_name + "$" + label_name)
+
+
+def convert_constant(lines, num):
     """
     the function for converting a push constant num command.
+    :param lines: (InstructionList) the commands to add to.
     :param num: (str) the number of the constant we want to add to the stack,
     as a string.
-    :return: (list) a list of Assembly commands that produce the push
-    constant num command.
-    """
-    lines = list()
-    lines.append("@" + num)
-    lines.append("D=A")
-    lines.append("@SP")
-    lines.append("M=M+1")
-    lines.append("A=M-1")
-    lines.append("M=D")
-    return lines
+    """
+    lines.at(num)
+    lines.assign("D", "A")
+    lines.at("SP")
+    lines.assign("M", "M+1")
+    lines.assign("A", "M-1")
+    lines.assign("M", "D")
 
 
-def convert_push_local(i):
+def convert_push_local(lines, i):
     """
     the function for converting a push local i command.
+    :param lines: (InstructionList) the commands to add to.
     :param i: (str) the index location in the local segment of the item we
     want to add to the stack, as a string.
-    :return: (list) a list of Assembly commands that produce the push
-    local i command.
-    """
-    lines = list()
-    lines.append("@" + i)
-    lines.append("D=A")
-    lines.append("@LCL")
-    lines.append("A=D+M")
-    lines.append("D=M")
-    lines.append("@SP")
-    lines.append("M=M+1")
-    lines.append("A=M-1")
-    lines.append("M=D")
-    return lines
-
-
-def convert_pop_local(i):
+    """
+    lines.at(i)
+    lines.assign("D", "A")
+    lines.at("LCL")
+    lines.assign("A", "D+M")
+    lines.assign("D", "M")
+    lines.at("SP")
+    lines.assign("M", "M+1")
+    lines.assign("A", "M-1")
+    lines.assign("M", "D")
+
+
+def convert_pop_local(lines, i):
     """
     the function for converting a pop local i command.
+    :param lines: (InstructionList) the commands to add to.
     :param i: (str) the index location in the local segment where we will add
     the stack top to, as a string.
-    :return: (list) a list of Assembly commands that produce the pop
-    local i command.
-    """
-    lines = list()
-    lines.append("@" + i)
-    lines.append("D=A")
-    lines.append("@LCL")
-    lines.append("D=D+M")
-    lines.append("@local" + i)
-    lines.append("M=D")
-    lines.append("@SP")
-    lines.append("M=M-1")
-    lines.append("A=M")
-    lines.append("D=M")
-    lines.append("@local" + i)
-    lines.append("A=M")
-    lines.append("M=D")
-    return lines
-
-
-def convert_push_argument(i):
+    """
+    lines.at(i)
+    lines.assign("D", "A")
+    lines.at("LCL")
+    lines.assign("D", "D+M")
+    lines.at("local" + i)
+    lines.assign("M", "D")
+    lines.at("SP")
+    lines.assign("M", "M-1")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    lines.at("local" + i)
+    lines.assign("A", "M")
+    lines.assign("M", "D")
+
+
+def convert_push_argument(lines, i):
     """
     the function for converting a push argument i command.
+    :param lines: (InstructionList) the commands to add to.
     :param i: (str) the index location in the argument segment of the item we
     want to add to the stack, as a string.
-    :return: (list) a list of Assembly commands that produce the push
-    argument i command.
-    """
-    lines = list()
-    lines.append("@" + i)
-    lines.append("D=A")
-    lines.append("@ARG")
-    lines.append("A=D+M")
-    lines.append("D=M")
-    lines.append("@SP")
-    lines.append("M=M+1")
-    lines.append("A=M-1")
-    lines.append("M=D")
-    return lines
-
-
-def convert_pop_argument(i):
+    """
+    lines.at(i)
+    lines.assign("D", "A")
+    lines.at("ARG")
+    lines.assign("A", "D+M")
+    lines.assign("D", "M")
+    lines.at("SP")
+    lines.assign("M", "M+1")
+    lines.assign("A", "M-1")
+    lines.assign("M", "D")
+
+
+def convert_pop_argument(lines, i):
     """
     the function for converting a pop argument i command.
+    :param lines: (InstructionList) the commands to add to.
     :param i: (str) the index location in the argument segment where we will
     add the stack top to, as a string.
-    :return: (list) a list of Assembly commands that produce the pop
-    argument i command.
-    """
-    lines = list()
-    lines.append("@" + i)
-    lines.append("D=A")
-    lines.append("@ARG")
-    lines.append("D=D+M")
-    lines.append("@argument" + i)
-    lines.append("M=D")
-    lines.append("@SP")
-    lines.append("M=M-1")
-    lines.append("A=M")
-    lines.append("D=M")
-    lines.append("@argument" + i)
-    lines.append("A=M")
-    lines.append("M=D")
-    return lines
-
-
-def convert_push_this(i):
+    """
+    lines.at(i)
+    lines.assign("D", "A")
+    lines.at("ARG")
+    lines.assign("D", "D+M")
+    lines.at("argument" + i)
+    lines.assign("M", "D")
+    lines.at("SP")
+    lines.assign("M", "M-1")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    lines.at("argument" + i)
+    lines.assign("A", "M")
+    lines.assign("M", "D")
+
+
+def convert_push_this(lines, i):
     """
     the function for converting a push this i command.
+    :param lines: (InstructionList) the commands to add to.
     :param i: (str) the index location in the this segment of the item we
     want to add to the stack, as a string.
-    :return: (list) a list of Assembly commands that produce the push
-    this i command.
-    """
-    lines = list()
-    lines.append("@" + i)
-    lines.append("D=A")
-    lines.append("@THIS")
-    lines.append("A=D+M")
-    lines.append("D=M")
-    lines.append("@SP")
-    lines.append("M=M+1")
-    lines.append("A=M-1")
-    lines.append("M=D")
-    return lines
-
-
-def convert_pop_this(i):
+    """
+    lines.at(i)
+    lines.assign("D", "A")
+    lines.at("THIS")
+    lines.assign("A", "D+M")
+    lines.assign("D", "M")
+    lines.at("SP")
+    lines.assign("M", "M+1")
+    lines.assign("A", "M-1")
+    lines.assign("M", "D")
+
+
+def convert_pop_this(lines, i):
     """
     the function for converting a pop this i command.
+    :param lines: (InstructionList) the commands to add to.
     :param i: (str) the index location in the this segment where we will
     add the stack top to, as a string.
-    :return: (list) a list of Assembly commands that produce the pop
-    this i command.
-    """
-    lines = list()
-    lines.append("@" + i)
-    lines.append("D=A")
-    lines.append("@THIS")
-    lines.append("D=D+M")
-    lines.append("@this" + i)
-    lines.append("M=D")
-    lines.append("@SP")
-    lines.append("M=M-1")
-    lines.append("A=M")
-    lines.append("D=M")
-    lines.append("@this" + i)
-    lines.append("A=M")
-    lines.append("M=D")
-    return lines
-
-
-def convert_push_that(i):
+    """
+    lines.at(i)
+    lines.assign("D", "A")
+    lines.at("THIS")
+    lines.assign("D", "D+M")
+    lines.at("this" + i)
+    lines.assign("M", "D")
+    lines.at("SP")
+    lines.assign("M", "M-1")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    lines.at("this" + i)
+    lines.assign("A", "M")
+    lines.assign("M", "D")
+
+
+def convert_push_that(lines, i):
     """
     the function for converting a push that i command.
+    :param lines: (InstructionList) the commands to add to.
     :param i: (str) the index location in the that segment of the item we
     want to add to the stack, as a string.
-    :return: (list) a list of Assembly commands that produce the push
-    that i command.
-    """
-    lines = list()
-    lines.append("@" + i)
-    lines.append("D=A")
-    lines.append("@THAT")
-    lines.append("A=D+M")
-    lines.append("D=M")
-    lines.append("@SP")
-    lines.append("M=M+1")
-    lines.append("A=M-1")
-    lines.append("M=D")
-    return lines
-
-
-def convert_pop_that(i):
+    """
+    lines.at(i)
+    lines.assign("D", "A")
+    lines.at("THAT")
+    lines.assign("A", "D+M")
+    lines.assign("D", "M")
+    lines.at("SP")
+    lines.assign("M", "M+1")
+    lines.assign("A", "M-1")
+    lines.assign("M", "D")
+
+
+def convert_pop_that(lines, i):
     """
     the function for converting a pop that i command.
+    :param lines: (InstructionList) the commands to add to.
     :param i: (str) the index location in the that segment where we will
     add the stack top to, as a string.
-    :return: (list) a list of Assembly commands that produce the pop
-    that i command.
-    """
-    lines = list()
-    lines.append("@" + i)
-    lines.append("D=A")
-    lines.append("@THAT")
-    lines.append("D=D+M")
-    lines.append("@that" + i)
-    lines.append("M=D")
-    lines.append("@SP")
-    lines.append("M=M-1")
-    lines.append("A=M")
-    lines.append("D=M")
-    lines.append("@that" + i)
-    lines.append("A=M")
-    lines.append("M=D")
-    return lines
-
-
-def convert_push_temp(i):
+    """
+    lines.at(i)
+    lines.assign("D", "A")
+    lines.at("THAT")
+    lines.assign("D", "D+M")
+    lines.at("that" + i)
+    lines.assign("M", "D")
+    lines.at("SP")
+    lines.assign("M", "M-1")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    lines.at("that" + i)
+    lines.assign("A", "M")
+    lines.assign("M", "D")
+
+
+def convert_push_temp(lines, i):
     """
     the function for converting a push temp i command.
+    :param lines: (InstructionList) the commands to add to.
     :param i: (str) the index location in the temp segment of the item we
     want to add to the stack, as a string.
-    :return: (list) a list of Assembly commands that produce the push
-    temp i command.
-    """
-    lines = list()
-    lines.append("@" + str(int(i) + 5))
-    lines.append("D=M")
-    lines.append("@SP")
-    lines.append("M=M+1")
-    lines.append("A=M-1")
-    lines.append("M=D")
-    return lines
+    """
+    lines.at(int(i) + 5)
+    lines.assign("D", "M")
+    lines.at("SP")
+    lines.assign("M", "M+1")
+    lines.assign("A", "M-1")
+    lines.assign("M", "D")
 
 
-def convert_pop_temp(i):
+def convert_pop_temp(lines, i):
     """
     the function for converting a pop temp i command.
+    :param lines: (InstructionList) the commands to add to.
     :param i: (str) the index location in the temp segment where we will
     add the stack top to, as a string.
-    :return: (list) a list of Assembly commands that produce the pop
-    temp i command.
-    """
-    lines = list()
-    lines.append("@SP")
-    lines.append("M=M-1")
-    lines.append("A=M")
-    lines.append("D=M")
-    lines.append("@" + str(int(i) + 5))
-    lines.append("M=D")
-    return lines
+    """
+    lines.at("SP")
+    lines.assign("M", "M-1")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    lines.at(int(i) + 5)
+    lines.assign("M", "D")
 
 
-def convert_push_pointer(i):
+def convert_push_pointer(lines, i):
     """
     the function for converting a push pointer i command.
+    :param lines: (InstructionList) the commands to add to.
     :param i: (str) the index location in the pointer segment of the item we
     want to add to the stack (1/0), as a string.
-    :return: (list) a list of Assembly commands that produce the push
-    pointer i command.
     """
     global label_counter
-    lines = list()
-    lines.append("@" + i)
-    lines.append("D=A")
-    lines.append("@NOT_THIS" + str(label_counter))
-    lines.append("D;JNE")
-    lines.append("@THIS")
-    lines.append("D=M")
-    lines.append("@WRITE" + str(label_counter))
-    lines.append("0;JMP")
-    lines.append("(NOT_THIS" + str(label_counter) + ")")
-    lines.append("@THAT")
-    lines.append("D=M")
-    lines.append("(WRITE" + str(label_counter) + ")")
-    lines.append("@SP")
-    lines.append("M=M+1")
-    lines.append("A=M-1")
-    lines.append("M=D")
+    lines.at(i)
+    lines.assign("D", "A")
+    lines.at("NOT_THIS" + str(label_counter))
+    lines.jump("D", "JNE")
+    lines.at("THIS")
+    lines.assign("D", "M")
+    lines.at("WRITE" + str(label_counter))
+    lines.jump("0", "JMP")
+    lines.label("NOT_THIS" + str(label_counter))
+    lines.at("THAT")
+    lines.assign("D", "M")
+    lines.label("WRITE" + str(label_counter))
+    lines.at("SP")
+    lines.assign("M", "M+1")
+    lines.assign("A", "M-1")
+    lines.assign("M", "D")
     label_counter += 1
-    return lines
 
 
-def convert_pop_pointer(i):
+def convert_pop_pointer(lines, i):
     """
     the function for converting a pop pointer i command.
+    :param lines: (InstructionList) the commands to add to.
     :param i: (str) the index location in the pointer segment where we will
     add the stack top to, as a string.
-    :return: (list) a list of Assembly commands that produce the pop
-    pointer i command.
     """
     global label_counter
-    lines = list()
-    lines.append("@" + i)
-    lines.append("D=A")
-    lines.append("@NOT_THIS" + str(label_counter))
-    lines.append("D;JNE")
-    lines.append("@THIS")
-    lines.append("D=A")
-    lines.append("@WRITE" + str(label_counter))
-    lines.append("0;JMP")
-    lines.append("(NOT_THIS" + str(label_counter) + ")")
-    lines.append("@THAT")
-    lines.append("D=A")
-    lines.append("(WRITE" + str(label_counter) + ")")
-    lines.append("@pointer" + i)
-    lines.append("M=D")
-    lines.append("@SP")
-    lines.append("M=M-1")
-    lines.append("A=M")
-    lines.append("D=M")
-    lines.append("@pointer" + i)
-    lines.append("A=M")
-    lines.append("M=D")
+    lines.at(i)
+    lines.assign("D", "A")
+    lines.at("NOT_THIS" + str(label_counter))
+    lines.jump("D", "JNE")
+    lines.at("THIS")
+    lines.assign("D", "A")
+    lines.at("WRITE" + str(label_counter))
+    lines.jump("0", "JMP")
+    lines.label("NOT_THIS" + str(label_counter))
+    lines.at("THAT")
+    lines.assign("D", "A")
+    lines.label("WRITE" + str(label_counter))
+    lines.at("pointer" + i)
+    lines.assign("M", "D")
+    lines.at("SP")
+    lines.assign("M", "M-1")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    lines.at("pointer" + i)
+    lines.assign("A", "M")
+    lines.assign("M", "D")
     label_counter += 1
-    return lines
 
 
-def convert_push_static(i, file_name):
+def convert_push_static(lines, i, file_name):
     """
     the function for converting a push static i command.
+    :param lines: (InstructionList) the commands to add to.
     :param file_name: (str) the vm file name (without the .vm).
     :param i: (str) the index location in the static segment of the item we
     want to add to the stack, as a string.
-    :return: (list) a list of Assembly commands that produce the push
-    static i command.
-    """
-    lines = list()
-    lines.append("@" + file_name + "" + i)
-    lines.append("D=M")
-    lines.append("@SP")
-    lines.append("M=M+1")
-    lines.append("A=M-1")
-    lines.append("M=D")
-    return lines
+    """
+    lines.at(file_name + "" + i)
+    lines.assign("D", "M")
+    lines.at("SP")
+    lines.assign("M", "M+1")
+    lines.assign("A", "M-1")
+    lines.assign("M", "D")
 
 
-def convert_pop_static(i, file_name):
+def convert_pop_static(lines, i, file_name):
     """
     the function for converting a pop static i command.
+    :param lines: (InstructionList) the commands to add to.
     :param file_name: (str) the vm file name (without the .vm).
     :param i: (str) the index location in the static segment where we will
     add the stack top to, as a string.
-    :return: (list) a list of Assembly commands that produce the pop
-     static i command.
-    """
-    lines = list()
-    lines.append("@SP")
-    lines.append("M=M-1")
-    lines.append("A=M")
-    lines.append("D=M")
-    lines.append("@" + file_name + "" + i)
-    lines.append("M=D")
-    return lines
+    """
+    lines.at("SP")
+    lines.assign("M", "M-1")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    lines.at(file_name + "" + i)
+    lines.assign("M", "D")
 
 
-def convert_add():
+def convert_copy(lines, depth):
+    """
+    the function for converting a copy command, which value numbering puts
+    in place of commands that compute a value already on the stack, pushing
+    a copy of the value.
+    :param lines: (InstructionList) the commands to add to.
+    :param depth: (int) how many values under the top the value is.
+    """
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    for _ in range(depth):
+        lines.assign("A", "A-1")
+    lines.assign("D", "M")
+    lines.at("SP")
+    lines.assign("M", "M+1")
+    lines.assign("A", "M-1")
+    lines.assign("M", "D")
+
+
+def convert_add(lines):
     """
     the function for converting an add command.
-    :return: (list) a list of Assembly commands that produce the add command.
-    """
-    lines = list()
-    lines.append("@SP")
-    lines.append("M=M-1")
-    lines.append("A=M")
-    lines.append("D=M")
-    lines.append("A=A-1")
-    lines.append("M=D+M")
-    return lines
+    :param lines: (InstructionList) the commands to add to.
+    """
+    lines.at("SP")
+    lines.assign("M", "M-1")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    lines.assign("A", "A-1")
+    lines.assign("M", "D+M")
 
 
-def convert_sub():
+def convert_sub(lines):
     """
     the function for converting a sub command.
-    :return: (list) a list of Assembly commands that produce the sub command.
-    """
-    lines = list()
-    lines.append("@SP")
-    lines.append("M=M-1")
-    lines.append("A=M-1")
-    lines.append("D=M")
-    lines.append("A=A+1")
-    lines.append("D=D-M")
-    lines.append("A=A-1")
-    lines.append("M=D")
-    return lines
+    :param lines: (InstructionList) the commands to add to.
+    """
+    lines.at("SP")
+    lines.assign("M", "M-1")
+    lines.assign("A", "M-1")
+    lines.assign("D", "M")
+    lines.assign("A", "A+1")
+    lines.assign("D", "D-M")
+    lines.assign("A", "A-1")
+    lines.assign("M", "D")
 
 
-def convert_neg():
+def convert_neg(lines):
     """
     the function for converting a neg command.
-    :return: (list) a list of Assembly commands that produce the neg command.
+    :param lines: (InstructionList) the commands to add to.
     """
-    lines = list()
-    lines.append("@SP")
-    lines.append("A=M-1")
-    lines.append("M=-M")
-    return lines
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("M", "-M")
 
 
-def convert_eq():
+def convert_eq(lines):
     """
     the function for converting a eq command.
-    :return: (list) a list of Assembly commands that produce the eq command.
+    :param lines: (InstructionList) the commands to add to.
     """
-    lines = list()
     global label_counter
-    lines.append("@SP")
-    lines.append("A=M-1")
-    lines.append("D=M")
-    lines.append("A=A-1")
-    lines.append("D=D-M")
-    lines.append("@NOT_EQUALS" + str(label_counter))
-    lines.append("D;JNE")
-    lines.append("@SP")
-    lines.append("A=M-1")
-    lines.append("A=A-1")
-    lines.append("M=-1")
-    lines.append("@SP")
-    lines.append("M=M-1")
-    lines.append("@END_EQ" + str(label_counter))
-    lines.append("0;JMP")
-    lines.append("(NOT_EQUALS" + str(label_counter) + ")")
-    lines.append("@SP")
-    lines.append("A=M-1")
-    lines.append("A=A-1")
-    lines.append("M=0")
-    lines.append("@SP")
-    lines.append("M=M-1")
-    lines.append("(END_EQ" + str(label_counter) + ")")
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("D", "M")
+    lines.assign("A", "A-1")
+    lines.assign("D", "D-M")
+    lines.at("NOT_EQUALS" + str(label_counter))
+    lines.jump("D", "JNE")
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("A", "A-1")
+    lines.assign("M", "-1")
+    lines.at("SP")
+    lines.assign("M", "M-1")
+    lines.at("END_EQ" + str(label_counter))
+    lines.jump("0", "JMP")
+    lines.label("NOT_EQUALS" + str(label_counter))
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("A", "A-1")
+    lines.assign("M", "0")
+    lines.at("SP")
+    lines.assign("M", "M-1")
+    lines.label("END_EQ" + str(label_counter))
     label_counter += 1
-    return lines
 
 
-def convert_gt():
+def convert_gt(lines):
     """
     the function for converting a gt command.
-    :return: (list) a list of Assembly commands that produce the gt command.
+    :param lines: (InstructionList) the commands to add to.
     """
-    lines = list()
     global label_counter
-    lines.append("@SP")
-    lines.append("M=M-1")
-    lines.append("A=M-1")
-    lines.append("D=M")
-    lines.append("A=A+1")
-    lines.append("@FIRST_POSITIVE" + str(label_counter))
-    lines.append("D;JGT")
-    lines.append("@SP")
-    lines.append("A=M")
-    lines.append("D=M")
-    lines.append("@PUSH_FALSE" + str(label_counter))
-    lines.append("D;JGE")
-    lines.append("@SP")
-    lines.append("A=M-1")
-    lines.append("D=M")
-    lines.append("A=A+1")
-    lines.append("D=D-M")
-    lines.append("@PUSH_FALSE" + str(label_counter))
-    lines.append("D;JEQ")
-    lines.append("@PUSH_FALSE" + str(label_counter))
-    lines.append("D;JLT")
-    lines.append("@PUSH_TRUE" + str(label_counter))
-    lines.append("0;JMP")
-    lines.append("(FIRST_POSITIVE" + str(label_counter) + " )")
-    lines.append("@SP")
-    lines.append("A=M")
-    lines.append("D=M")
-    lines.append("@PUSH_TRUE" + str(label_counter))
-    lines.append("D;JLE")
-    lines.append("@SP")
-    lines.append("A=M-1")
-    lines.append("D=M")
-    lines.append("A=A+1")
-    lines.append("D=D-M")
-    lines.append("@PUSH_FALSE" + str(label_counter))
-    lines.append("D;JEQ")
-    lines.append("@PUSH_TRUE" + str(label_counter))
-    lines.append("D;JGE")
-    lines.append("(PUSH_FALSE" + str(label_counter) + ")")
-    lines.append("@SP")
-    lines.append("A=M-1")
-    lines.append("M=0")
-    lines.append("@END_LT" + str(label_counter))
-    lines.append("0;JMP")
-    lines.append("(PUSH_TRUE" + str(label_counter) + ")")
-    lines.append("@SP")
-    lines.append("A=M-1")
-    lines.append("M=-1")
-    lines.append("(END_LT" + str(label_counter) + ")")
+    lines.at("SP")
+    lines.assign("M", "M-1")
+    lines.assign("A", "M-1")
+    lines.assign("D", "M")
+    lines.assign("A", "A+1")
+    lines.at("FIRST_POSITIVE" + str(label_counter))
+    lines.jump("D", "JGT")
+    lines.at("SP")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    lines.at("PUSH_FALSE" + str(label_counter))
+    lines.jump("D", "JGE")
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("D", "M")
+    lines.assign("A", "A+1")
+    lines.assign("D", "D-M")
+    lines.at("PUSH_FALSE" + str(label_counter))
+    lines.jump("D", "JEQ")
+    lines.at("PUSH_FALSE" + str(label_counter))
+    lines.jump("D", "JLT")
+    lines.at("PUSH_TRUE" + str(label_counter))
+    lines.jump("0", "JMP")
+    lines.label("FIRST_POSITIVE" + str(label_counter))
+    lines.at("SP")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    lines.at("PUSH_TRUE" + str(label_counter))
+    lines.jump("D", "JLE")
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("D", "M")
+    lines.assign("A", "A+1")
+    lines.assign("D", "D-M")
+    lines.at("PUSH_FALSE" + str(label_counter))
+    lines.jump("D", "JEQ")
+    lines.at("PUSH_TRUE" + str(label_counter))
+    lines.jump("D", "JGE")
+    lines.label("PUSH_FALSE" + str(label_counter))
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("M", "0")
+    lines.at("END_LT" + str(label_counter))
+    lines.jump("0", "JMP")
+    lines.label("PUSH_TRUE" + str(label_counter))
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("M", "-1")
+    lines.label("END_LT" + str(label_counter))
     label_counter += 1
-    return lines
 
 
-def convert_lt():
+def convert_lt(lines):
     """
     the function for converting a lt command.
-    :return: (list) a list of Assembly commands that produce the lt command.
+    :param lines: (InstructionList) the commands to add to.
     """
-    lines = list()
     global label_counter
-    lines.append("@SP")
-    lines.append("M=M-1")
-    lines.append("A=M-1")
-    lines.append("D=M")
-    lines.append("A=A+1")
-    lines.append("@FIRST_POSITIVE" + str(label_counter))
-    lines.append("D;JGT")
-    lines.append("@SP")
-    lines.append("A=M")
-    lines.append("D=M")
-    lines.append("@PUSH_TRUE" + str(label_counter))
-    lines.append("D;JGE")
-    lines.append("@SP")
-    lines.append("A=M-1")
-    lines.append("D=M")
-    lines.append("A=A+1")
-    lines.append("D=D-M")
-    lines.append("@PUSH_TRUE" + str(label_counter))
-    lines.append("D;JLT")
-    lines.append("@PUSH_FALSE" + str(label_counter))
-    lines.append("0;JMP")
-    lines.append("(FIRST_POSITIVE" + str(label_counter) + " )")
-    lines.append("@SP")
-    lines.append("A=M")
-    lines.append("D=M")
-    lines.append("@PUSH_FALSE" + str(label_counter))
-    lines.append("D;JLE")
-    lines.append("@SP")
-    lines.append("A=M-1")
-    lines.append("D=M")
-    lines.append("A=A+1")
-    lines.append("D=D-M")
-    lines.append("@PUSH_TRUE" + str(label_counter))
-    lines.append("D;JLT")
-    lines.append("(PUSH_FALSE" + str(label_counter) + ")")
-    lines.append("@SP")
-    lines.append("A=M-1")
-    lines.append("M=0")
-    lines.append("@END_LT" + str(label_counter))
-    lines.append("0;JMP")
-    lines.append("(PUSH_TRUE" + str(label_counter) + ")")
-    lines.append("@SP")
-    lines.append("A=M-1")
-    lines.append("M=-1")
-    lines.append("(END_LT" + str(label_counter) + ")")
+    lines.at("SP")
+    lines.assign("M", "M-1")
+    lines.assign("A", "M-1")
+    lines.assign("D", "M")
+    lines.assign("A", "A+1")
+    lines.at("FIRST_POSITIVE" + str(label_counter))
+    lines.jump("D", "JGT")
+    lines.at("SP")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    # only a positive y is known to be bigger, when y is 0 the subtraction
+    # below decides (so 0 < 0 is false).
+    lines.at("PUSH_TRUE" + str(label_counter))
+    lines.jump("D", "JGT")
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("D", "M")
+    lines.assign("A", "A+1")
+    lines.assign("D", "D-M")
+    lines.at("PUSH_TRUE" + str(label_counter))
+    lines.jump("D", "JLT")
+    lines.at("PUSH_FALSE" + str(label_counter))
+    lines.jump("0", "JMP")
+    lines.label("FIRST_POSITIVE" + str(label_counter))
+    lines.at("SP")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    lines.at("PUSH_FALSE" + str(label_counter))
+    lines.jump("D", "JLE")
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("D", "M")
+    lines.assign("A", "A+1")
+    lines.assign("D", "D-M")
+    lines.at("PUSH_TRUE" + str(label_counter))
+    lines.jump("D", "JLT")
+    lines.label("PUSH_FALSE" + str(label_counter))
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("M", "0")
+    lines.at("END_LT" + str(label_counter))
+    lines.jump("0", "JMP")
+    lines.label("PUSH_TRUE" + str(label_counter))
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("M", "-1")
+    lines.label("END_LT" + str(label_counter))
     label_counter += 1
-    return lines
 
 
-def convert_and():
+def convert_unchecked_compare(lines, comparison):
+    """
+    the function for converting a gt/lt command whose operands can not
+    overflow when subtracted, testing x - y without checking the signs.
+    :param lines: (InstructionList) the commands to add to.
+    :param comparison: (str) gt or lt.
+    """
+    global label_counter
+    lines.at("SP")
+    lines.assign("AM", "M-1")
+    lines.assign("D", "M")
+    lines.assign("A", "A-1")
+    lines.assign("D", "M-D")
+    lines.assign("M", "-1")
+    lines.at("END_UNCHECKED" + str(label_counter))
+    lines.jump("D", "JGT" if comparison == GREATER_THEN else "JLT")
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("M", "0")
+    lines.label("END_UNCHECKED" + str(label_counter))
+    label_counter += 1
+
+
+def convert_and(lines):
     """
     the function for converting an and command.
-    :return: (list) a list of Assembly commands that produce the and command.
-    """
-    lines = list()
-    lines.append("@SP")
-    lines.append("M=M-1")
-    lines.append("A=M")
-    lines.append("D=M")
-    lines.append("A=A-1")
-    lines.append("M=D&M")
-    return lines
+    :param lines: (InstructionList) the commands to add to.
+    """
+    lines.at("SP")
+    lines.assign("M", "M-1")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    lines.assign("A", "A-1")
+    lines.assign("M", "D&M")
 
 
-def convert_or():
+def convert_or(lines):
     """
     the function for converting a or command.
-    :return: (list) a list of Assembly commands that produce the or command.
-    """
-    lines = list()
-    lines.append("@SP")
-    lines.append("M=M-1")
-    lines.append("A=M")
-    lines.append("D=M")
-    lines.append("A=A-1")
-    lines.append("M=D|M")
-    return lines
+    :param lines: (InstructionList) the commands to add to.
+    """
+    lines.at("SP")
+    lines.assign("M", "M-1")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    lines.assign("A", "A-1")
+    lines.assign("M", "D|M")
 
 
-def convert_not():
+def convert_not(lines):
     """
     the function for converting a not command.
-    :return: (list) a list of Assembly commands that produce the not command.
+    :param lines: (InstructionList) the commands to add to.
     """
-    lines = list()
-    lines.append("@SP")
-    lines.append("A=M-1")
-    lines.append("M=!M")
-    return lines
+    lines.at("SP")
+    lines.assign("A", "M-1")
+    lines.assign("M", "!M")
+
+
+def make_boot(lines):
+    lines.at(256)
+    lines.assign("D", "A")
+    lines.at("SP")
+    lines.assign("M", "D")
 
 
-def make_boot():
-    boot = list()
-    boot.append("@256")
-    boot.append("D=A")
-    boot.append("@SP")
-    boot.append("M=D")
-    return boot
+def measure_list(list_class, files, options):
+    """
+    translates the program again keeping the instructions in list_class and
+    writes it to memory, once timed and once with every allocation traced.
+    the symbol table is emptied first each time so the compact list pays for
+    making its symbols, like in a real run.
+    :param list_class: (type) InstructionList or TextList.
+    :param files: (list) the vm files, as translate takes them.
+    :param options: (tuple) the other arguments of translate.
+    :return: (tuple) the seconds the translation took, the seconds writing
+    the text took, the most memory allocated while translating and the
+    bytes the finished instructions use (with the symbol table for the
+    compact list), all in bytes.
+    """
+    symbol_table.clear()
+    start = time.perf_counter()
+    program = translate(files, *options, list_class=list_class)
+    translated = time.perf_counter()
+    program.write(io.StringIO())
+    written = time.perf_counter()
+    nbytes = program.nbytes()
+    if list_class is InstructionList:
+        nbytes += symbol_table.nbytes()
+    del program
+    symbol_table.clear()
+    tracemalloc.start()
+    translate(files, *options, list_class=list_class)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return translated - start, written - translated, peak, nbytes
+
+
+def print_stats(instructions, seconds, measures):
+    """
+    prints how big the translated program is and how long the translation
+    took, with the time and memory translating and writing it takes with
+    the compact instructions next to the list of strings used before them,
+    and the deepest each function gets its working stack, the loops rotated,
+    the comparisons value ranges simplified, the values value numbering
+    replaced, the frames promoted to fixed ram, the calls that save fewer
+    registers, the calls inlined and the functions a profile found cold.
+    :param instructions: (InstructionList) the whole translated program.
+    :param seconds: (float) the time the translation took.
+    :param measures: (dict) what measure_list found for each list class.
+    """
+    print("instructions: " + str(len(instructions)))
+    print("translation seconds: " + "%.4f" % seconds)
+    for list_class, measure in measures.items():
+        translating, writing, peak, nbytes = measure
+        print(LIST_NAMES[list_class] + ": translate %.4f s, write %.4f s, "
+              "peak %d bytes, instructions %d bytes"
+              % (translating, writing, peak, nbytes))
+    for name, depth in stack_depths.items():
+        print("max stack depth " + name + ": "
+              + ("unknown" if depth is None else str(depth)))
+    for name, count in rotated_loops.items():
+        print("loops rotated " + name + ": " + str(count))
+    for name, count in unchecked_compares.items():
+        print("comparisons simplified " + name + ": " + str(count))
+    for name, (folds, saved) in value_folds.items():
+        print("values copied " + name + ": " + str(folds) + " (" + str(saved)
+              + " vm commands saved)")
+    for name, frame in promoted_frames.items():
+        print("promoted " + name + ": words " + str(frame.base) + "-"
+              + str(frame.base + frame.size() - 1) + " ("
+              + str(frame.n_locals) + " locals, "
+              + str(len(frame.arguments)) + " arguments)")
+    if promoted_frames:
+        print("promoted ram words: " + str(promoted_words))
+    for name, saved in layouts.items():
+        if saved != FRAME_REGISTERS:
+            print("frame " + name + ": saves " + " ".join(saved))
+    for name, count in inlined_calls.items():
+        if count:
+            print("calls inlined " + name + ": " + str(count))
+    if inlined_words:
+        print("inlined ram words: " + str(promoted_words) + "-"
+              + str(promoted_words + inlined_words - 1))
+    if cold_functions:
+        print("cold functions: " + " ".join(sorted(cold_functions)))
+
+
+def parse_arguments(args):
+    """
+    :param args: (list) the command line arguments, without the program name.
+    :return: (argparse.Namespace) the path given and the options chosen.
+    """
+    parser = argparse.ArgumentParser(
+        description="translates vm code to hack Assembly.")
+    parser.add_argument("path", help="a .vm file or a directory of them")
+    parser.add_argument("--stats", action="store_true",
+                        help="print the size of the program and the time "
+                             "the translation took")
+    parser.add_argument("-O", dest="optimizations", action="append",
+                        default=list(),
+                        choices=OPTIMIZATIONS + (ALL_OPTIMIZATIONS,),
+                        help="turn on an optimization, can be given more "
+                             "than once")
+    parser.add_argument("--no-intrinsic", dest="disabled", action="append",
+                        default=list(), choices=sorted(INTRINSICS),
+                        help="call this function normally even with -O "
+                             "intrinsics, can be given more than once")
+    parser.add_argument("--cost", action="store_true",
+                        help="estimate the cycles of each vm command, block "
+                             "and function, into .cost.json and an "
+                             "annotated .cost.txt next to the .asm file")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="a json profile of a run (see Simulator.py "
+                             "--profile): the functions that did little "
+                             "work get small code and the rest come first, "
+                             "with the short functions they call inlined")
+    parser.add_argument("--hot-fraction", type=float, default=HOT_FRACTION,
+                        help="the share of the profiled work a function "
+                             "needs to get fast code (default %(default)s)")
+    return parser.parse_args(args)
 
 
 def main():
+    arguments = parse_arguments(sys.argv[1:])
+    enabled = set(arguments.optimizations)
+    if ALL_OPTIMIZATIONS in enabled:
+        enabled = set(OPTIMIZATIONS)
     list_of_files = list()
     # check if the path is a directory and fills list_of_files with all the
     # files names
     is_directory = False
-    st = sys.argv[VM_FILE]
+    st = arguments.path
+    start_time = time.perf_counter()
     if os.path.isdir(st):
         is_directory = True
         dir_name = os.path.basename(os.path.normpath(st))
@@ -959,36 +1643,32 @@ def main():
             if filename.endswith(".vm"):
                 list_of_files.append(
                     os.path.join(os.path.normpath(st), filename))
-    bootstrap = make_boot()
-    bootstrap.extend(convert_call("Sys.init", 0, 0))
-    converted_lines = list()
+    files = list()
     if is_directory:
         for file_name in list_of_files:
             base_name = Path(file_name).stem
-            lines = read_file_in_args(file_name)
-            new_lines = first_pass(lines)
-            converted_lines += convert_lines(new_lines, base_name + ".")
+            files.append((base_name + ".", read_file_in_args(file_name)))
         write_file = os.path.join(st, dir_name + ".asm")
-        with open(write_file, "w") as file:
-            for line in bootstrap:
-                file.write(line)
-                file.write("\r\n")
-            for line in converted_lines:
-                file.write(line)
-                file.write("\r\n")
     else:
         st_norm = Path(os.path.basename(os.path.normpath(st))).stem
-        lines = read_file_in_args(st)
-        new_lines = first_pass(lines)
-        converted_lines = convert_lines(new_lines, st_norm + ".")
+        files.append((st_norm + ".", read_file_in_args(st)))
         write_file = os.path.join(os.path.dirname(st), Path(st).stem + ".asm")
-        with open(write_file, "w") as file:
-            for line in bootstrap:
-                file.write(line)
-                file.write("\r\n")
-            for line in converted_lines:
-                file.write(line)
-                file.write("\r\n")
+    profile = None
+    if arguments.profile is not None:
+        profile = read_profile(arguments.profile)
+    program = translate(files, enabled, arguments.disabled, profile,
+                        arguments.hot_fraction, arguments.cost)
+    with open(write_file, "w") as file:
+        program.write(file)
+    seconds = time.perf_counter() - start_time
+    if arguments.cost:
+        write_costs(write_file[:-len(".asm")] + ".cost", function_costs)
+    if arguments.stats:
+        options = (enabled, arguments.disabled, profile,
+                   arguments.hot_fraction)
+        measures = {list_class: measure_list(list_class, files, options)
+                    for list_class in LIST_NAMES}
+        print_stats(program, seconds, measures)
 
 
 if __name__ == '__main__':
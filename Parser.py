@@ -0,0 +1,173 @@
+PUSH = "push"
+POP = "pop"
+ADD = "add"
+SUBTRUCT = "sub"
+NEGATE = "neg"
+EQUALS = "eq"
+GREATER_THEN = "gt"
+LOWER_THEN = "lt"
+AND = "and"
+OR = "or"
+NOT = "not"
+LABEL = "label"
+GOTO = "goto"
+IFGOTO = "if-goto"
+FUNCTION = "function"
+CALL = "call"
+RETURN = "return"
+# not a vm command but one the optimizations make: pushes a copy of the
+# value arg2 places under the top of the stack (0 copies the top).
+COPY = "copy"
+# not a vm argument but one the optimizations make: a gt/lt with it as arg1
+# compares values whose difference can never overflow.
+UNCHECKED = "unchecked"
+CONSTANT = "constant"
+LOCAL = "local"
+THIS = "this"
+THAT = "that"
+ARGUMENT = "argument"
+STATIC = "static"
+TEMP = "temp"
+POINTER = "pointer"
+# not a vm segment but one the optimizations make: index is a word of ram
+# of its own, the fixed home of a promoted local or argument.
+FIXED = "fixed"
+SEGMENTS = (CONSTANT, LOCAL, THIS, THAT, ARGUMENT, STATIC, TEMP, POINTER)
+ARITHMETIC = (ADD, SUBTRUCT, NEGATE, EQUALS, GREATER_THEN, LOWER_THEN, AND,
+              OR, NOT)
+BRANCHES = (GOTO, IFGOTO)
+# the commands that end a basic block, nothing after them in the same block
+# can run.
+TERMINATORS = (GOTO, IFGOTO, RETURN)
+
+
+class VMCommand:
+    """
+    a single parsed vm command. arg1 is the segment of a push/pop, the name
+    of a label/function or the arithmetic command itself, and arg2 is the
+    index of a push/pop, the number of variables/arguments of a
+    function/call or the depth of a copy (None when the command has no
+    second argument).
+    """
+    __slots__ = ("kind", "arg1", "arg2")
+
+    def __init__(self, kind, arg1=None, arg2=None):
+        self.kind = kind
+        self.arg1 = arg1
+        self.arg2 = arg2
+
+    def __eq__(self, other):
+        return (isinstance(other, VMCommand) and self.kind == other.kind
+                and self.arg1 == other.arg1 and self.arg2 == other.arg2)
+
+    def __hash__(self):
+        return hash((self.kind, self.arg1, self.arg2))
+
+    def __repr__(self):
+        return "VMCommand(" + self.text() + ")"
+
+    def text(self):
+        """
+        :return: (str) the command as a line of vm code.
+        """
+        if self.kind in ARITHMETIC or self.kind == RETURN:
+            return self.kind
+        if self.arg1 is None:
+            return self.kind + " " + str(self.arg2)
+        if self.arg2 is None:
+            return self.kind + " " + self.arg1
+        return self.kind + " " + self.arg1 + " " + str(self.arg2)
+
+
+class VMFunction:
+    """
+    the commands of one vm function. commands that come before the first
+    function of a file (in test files with no functions) are kept in a
+    function with no name.
+    """
+    __slots__ = ("name", "n_vars", "commands", "file_name")
+
+    def __init__(self, name, n_vars, commands, file_name):
+        self.name = name
+        self.n_vars = n_vars
+        self.commands = commands
+        self.file_name = file_name
+
+    def all_commands(self):
+        """
+        :return: (list) the commands of the function, starting with the
+        function command itself when the function has a name.
+        """
+        if self.name is None:
+            return list(self.commands)
+        return [VMCommand(FUNCTION, self.name, self.n_vars)] + self.commands
+
+
+def parse_line(line):
+    """
+    parses a line given by first_pass, where push/pop/label/branch lines
+    have no whitespace left and function/call lines still do.
+    :param line: (str) the vm line.
+    :return: (VMCommand) the parsed command, or None if the line is not a
+    known command.
+    """
+    if line.startswith(PUSH) or line.startswith(POP):
+        # we will look at the line without the "push"/"pop" start, the
+        # segment is the next word and the rest of it is the index.
+        kind = PUSH if line.startswith(PUSH) else POP
+        line2 = line[len(kind):]
+        for segment in SEGMENTS:
+            if line2.startswith(segment):
+                return VMCommand(kind, segment, int(line2[len(segment):]))
+        return None
+    if line.startswith(LABEL):
+        return VMCommand(LABEL, line[len(LABEL):])
+    if line.startswith(GOTO):
+        return VMCommand(GOTO, line[len(GOTO):])
+    if line.startswith(IFGOTO):
+        return VMCommand(IFGOTO, line[len(IFGOTO):])
+    if line.startswith(FUNCTION) or line.startswith(CALL):
+        # 1 is the function name and 2 is the number of variables/arguments.
+        words = line.split()
+        return VMCommand(words[0], words[1], int(words[2]))
+    if line.startswith(RETURN):
+        return VMCommand(RETURN)
+    for kind in ARITHMETIC:
+        if line.startswith(kind):
+            return VMCommand(kind)
+    return None
+
+
+def parse_lines(lines):
+    """
+    :param lines: (list) the lines given by first_pass.
+    :return: (list) the parsed commands, skipping unknown lines.
+    """
+    commands = list()
+    for line in lines:
+        command = parse_line(line)
+        if command is not None:
+            commands.append(command)
+    return commands
+
+
+def split_functions(commands, file_name):
+    """
+    splits the commands of a file to the functions they belong to.
+    :param commands: (list) the parsed commands of the file.
+    :param file_name: (str) the vm file name (for static).
+    :return: (list) the VMFunction of each function, in order.
+    """
+    functions = list()
+    current = VMFunction(None, 0, list(), file_name)
+    for command in commands:
+        if command.kind == FUNCTION:
+            if current.name is not None or current.commands:
+                functions.append(current)
+            current = VMFunction(command.arg1, command.arg2, list(),
+                                 file_name)
+        else:
+            current.commands.append(command)
+    if current.name is not None or current.commands:
+        functions.append(current)
+    return functions
@@ -0,0 +1,74 @@
+import json
+
+from Parser import GOTO, RETURN
+
+# the share of all the profiled work a function needs to be hot.
+HOT_FRACTION = 0.01
+# the part of the name of the label a call returns to that comes after the
+# name of the function called.
+RETURN_LABEL = "$ret"
+
+
+def read_profile(file_name):
+    """
+    :param file_name: (str) a json profile, like the simulator writes with
+    --profile.
+    :return: (dict) the profile.
+    """
+    with open(file_name, "r") as file:
+        return json.load(file)
+
+
+def function_weights(profile):
+    """
+    :param profile: (dict) a profile with the "cycles" of each function, or
+    only the "calls", or only the counts of the labels.
+    :return: (dict) how much work each function did, by the best measure
+    the profile has: its cycles, its calls, or the times the labels calls to
+    it return to were reached.
+    """
+    weights = dict()
+    functions = profile.get("functions")
+    if functions:
+        for name, counts in functions.items():
+            weights[name] = counts.get("cycles", counts.get("calls", 0))
+        return weights
+    for label, count in profile.get("labels", dict()).items():
+        if RETURN_LABEL in label:
+            name = label[:label.index(RETURN_LABEL)]
+            weights[name] = weights.get(name, 0) + count
+    return weights
+
+
+def hot_functions(profile, fraction=HOT_FRACTION):
+    """
+    :param profile: (dict) the profile.
+    :param fraction: (float) the share of the work a function needs to be
+    hot.
+    :return: (set) the names of the hot functions.
+    """
+    weights = function_weights(profile)
+    total = sum(weights.values())
+    return set(name for name, weight in weights.items()
+               if weight > 0 and weight >= fraction * total)
+
+
+def order_functions(functions, profile):
+    """
+    puts the functions that did the most work first, so the hot code is
+    together. the order is only changed when no function can run on into
+    the one after it.
+    :param functions: (list) the VMFunction of every function, in the order
+    of the files.
+    :param profile: (dict) the profile.
+    :return: (list) the functions in the order to write them.
+    """
+    for function in functions:
+        if (function.name is None or not function.commands
+                or function.commands[-1].kind not in (GOTO, RETURN)):
+            return functions
+    weights = function_weights(profile)
+    order = sorted(range(len(functions)),
+                   key=lambda index: (-weights.get(functions[index].name, 0),
+                                      index))
+    return [functions[index] for index in order]
@@ -0,0 +1,249 @@
+from Parser import VMCommand, PUSH, POP, CALL, LOCAL, ARGUMENT, THIS, THAT, \
+    STATIC, POINTER, FIXED
+
+# the prefix of the names of the fixed words promoted frames live in.
+FIXED_PREFIX = "fixed$"
+# the words of ram the assembler gives variables, 16 to 255.
+VARIABLES_RAM = 240
+# the words kept for the variables the translator itself makes
+# (return_address and the intrinsic routines).
+TRANSLATOR_VARIABLES = 16
+# the segments whose pops the baseline converters keep an address of in a
+# variable named after the segment and index.
+SCRATCH_SEGMENTS = (LOCAL, ARGUMENT, THIS, THAT, POINTER)
+# the name of a function that is called but not in the program, which may
+# call any function.
+ANY_FUNCTION = None
+# arguments with an index up to this are read with A=A+1 steps in the
+# prologue, past it the address is added in D.
+MAX_STEPS = 2
+
+
+class Frame:
+    """
+    the fixed words of ram a function that is never re-entered keeps its
+    locals (and arguments) in. base is the first word, the locals come
+    first and then the promoted arguments, in the order of their indices.
+    """
+    __slots__ = ("n_locals", "arguments", "base")
+
+    def __init__(self, n_locals, arguments):
+        self.n_locals = n_locals
+        self.arguments = arguments
+        self.base = 0
+
+    def size(self):
+        """
+        :return: (int) how many words the frame takes.
+        """
+        return self.n_locals + len(self.arguments)
+
+    def slot(self, segment, index):
+        """
+        :param segment: (str) local or argument.
+        :param index: (int) the index in the segment.
+        :return: (int) the fixed word of the slot, or None if it was not
+        promoted.
+        """
+        if segment == LOCAL and index < self.n_locals:
+            return self.base + index
+        if segment == ARGUMENT and index in self.arguments:
+            return self.base + self.n_locals + self.arguments.index(index)
+        return None
+
+
+def call_graph(functions, leaves):
+    """
+    :param functions: (list) the VMFunction of every function in the
+    program.
+    :param leaves: (set) names of calls that never call back into the
+    program (like the intrinsics).
+    :return: (dict) the names each function calls, with ANY_FUNCTION
+    calling every function when something calls a function that is not in
+    the program.
+    """
+    graph = {function.name: set() for function in functions
+             if function.name is not None}
+    for function in functions:
+        if function.name is None:
+            continue
+        for command in function.commands:
+            if command.kind != CALL or command.arg1 in leaves:
+                continue
+            if command.arg1 in graph:
+                graph[function.name].add(command.arg1)
+            else:
+                graph[function.name].add(ANY_FUNCTION)
+    if ANY_FUNCTION in graph:
+        graph[ANY_FUNCTION] = set(name for name in graph
+                                  if name is not ANY_FUNCTION)
+    return graph
+
+
+def reachable(graph, name):
+    """
+    :param graph: (dict) the call graph.
+    :param name: (str) a function.
+    :return: (set) the functions that can run while it is running, through
+    calls of any depth (itself included only if it is recursive).
+    """
+    seen = set()
+    stack = list(graph.get(name, ()))
+    while stack:
+        callee = stack.pop()
+        if callee in seen:
+            continue
+        seen.add(callee)
+        stack.extend(graph.get(callee, ()))
+    return seen
+
+
+def variable_budget(functions):
+    """
+    :param functions: (list) the VMFunction of every function in the
+    program.
+    :return: (int) how many variable words are left for promoted frames
+    after the statics and the variables the translator makes.
+    """
+    used = set()
+    for function in functions:
+        for command in function.commands:
+            if command.kind in (PUSH, POP) and command.arg1 == STATIC:
+                used.add((function.file_name, command.arg2))
+            elif command.kind == POP and command.arg1 in SCRATCH_SEGMENTS:
+                used.add((command.arg1, command.arg2))
+    return VARIABLES_RAM - TRANSLATOR_VARIABLES - len(used)
+
+
+def count_accesses(function):
+    """
+    :param function: (VMFunction) a function.
+    :return: (int) how many commands of it push or pop a local or an
+    argument.
+    """
+    return sum(1 for command in function.commands
+               if command.kind in (PUSH, POP)
+               and command.arg1 in (LOCAL, ARGUMENT))
+
+
+def make_frame(function, with_arguments):
+    """
+    :param function: (VMFunction) a function that is never re-entered.
+    :param with_arguments: (bool) True to promote its arguments too.
+    :return: (Frame) the frame it would get, with base 0.
+    """
+    arguments = list()
+    if with_arguments:
+        arguments = sorted(set(command.arg2 for command in function.commands
+                               if command.kind in (PUSH, POP)
+                               and command.arg1 == ARGUMENT))
+    return Frame(function.n_vars, arguments)
+
+
+def place_frames(frames, reaches):
+    """
+    gives each frame a base after the frames of every function that can be
+    running when it runs, so functions that are never running together
+    share words.
+    :param frames: (dict) the frame of each promoted function.
+    :param reaches: (dict) the functions each function can call.
+    :return: (int) how many words all the frames take.
+    """
+    placed = dict()
+
+    def place(name):
+        if name not in placed:
+            base = 0
+            for caller in frames:
+                if name in reaches[caller]:
+                    base = max(base, place(caller))
+            frames[name].base = base
+            placed[name] = base + frames[name].size()
+        return placed[name]
+
+    return max([place(name) for name in sorted(frames)] + [0])
+
+
+def promote_frames(functions, leaves, with_arguments):
+    """
+    finds the functions that can never be running twice at once (no chain
+    of calls leads from them back to them) and gives them fixed frames, the
+    ones with the most local and argument commands first, as long as the
+    frames fit in the variable words left.
+    :param functions: (list) the VMFunction of every function in the
+    program.
+    :param leaves: (set) names of calls that never call back into the
+    program.
+    :param with_arguments: (bool) True to promote arguments too.
+    :return: (tuple) the frame of each promoted function and how many words
+    they take.
+    """
+    graph = call_graph(functions, leaves)
+    reaches = {name: reachable(graph, name) for name in graph}
+    budget = variable_budget(functions)
+    candidates = [function for function in functions
+                  if function.name is not None
+                  and function.name not in reaches[function.name]
+                  and ANY_FUNCTION not in reaches[function.name]]
+    candidates.sort(key=lambda function: (-count_accesses(function),
+                                          function.name))
+    frames = dict()
+    used = 0
+    for function in candidates:
+        frame = make_frame(function, with_arguments)
+        if frame.size() == 0:
+            continue
+        frames[function.name] = frame
+        words = place_frames(frames, reaches)
+        if words > budget:
+            del frames[function.name]
+            place_frames(frames, reaches)
+        else:
+            used = words
+    return frames, used
+
+
+def promote_commands(commands, frame):
+    """
+    :param commands: (list) the commands of a promoted function.
+    :param frame: (Frame) its frame.
+    :return: (list) the commands with every promoted local and argument
+    read and written in its fixed word.
+    """
+    new_commands = list()
+    for command in commands:
+        if command.kind in (PUSH, POP):
+            slot = frame.slot(command.arg1, command.arg2)
+            if slot is not None:
+                command = VMCommand(command.kind, FIXED, slot)
+        new_commands.append(command)
+    return new_commands
+
+
+def convert_promoted_function(lines, func_name, frame):
+    """
+    the start of a promoted function: instead of pushing its locals it sets
+    their fixed words to 0, and copies the promoted arguments from the
+    stack to theirs.
+    :param lines: (InstructionList) the commands to add to.
+    :param func_name: (str) the function.
+    :param frame: (Frame) its frame.
+    """
+    lines.label(func_name)
+    for index in range(frame.n_locals):
+        lines.at(FIXED_PREFIX + str(frame.slot(LOCAL, index)))
+        lines.assign("M", "0")
+    for index in frame.arguments:
+        if index <= MAX_STEPS:
+            lines.at("ARG")
+            lines.assign("A", "M")
+            for _ in range(index):
+                lines.assign("A", "A+1")
+        else:
+            lines.at(index)
+            lines.assign("D", "A")
+            lines.at("ARG")
+            lines.assign("A", "D+M")
+        lines.assign("D", "M")
+        lines.at(FIXED_PREFIX + str(frame.slot(ARGUMENT, index)))
+        lines.assign("M", "D")
@@ -0,0 +1,424 @@
+from bisect import bisect_left, bisect_right
+
+from ControlFlow import ControlFlowGraph
+from Parser import VMCommand, PUSH, POP, ADD, SUBTRUCT, NEGATE, EQUALS, \
+    GREATER_THEN, LOWER_THEN, AND, OR, NOT, LABEL, GOTO, IFGOTO, FUNCTION, \
+    CALL, COPY, UNCHECKED, CONSTANT, LOCAL, ARGUMENT, STATIC, TEMP, FIXED
+
+WORD_MIN = -32768
+WORD_MAX = 32767
+# a range is a (low, high) pair of the values something may hold.
+FULL = (WORD_MIN, WORD_MAX)
+BOOLEAN = (-1, 0)
+# the segments whose slots only change when the function pops to them, or
+# when a call runs (for the ones in CALL_CLOBBERED). this and that only
+# ever point at the heap, so pops to them leave these alone.
+TRACKED_SEGMENTS = (LOCAL, ARGUMENT, STATIC, TEMP, FIXED)
+# the segments the function called may pop to.
+CALL_CLOBBERED = (STATIC, TEMP)
+COMPARISONS = (EQUALS, GREATER_THEN, LOWER_THEN)
+# how many times the ranges at the start of a loop may grow before the
+# bounds that keep growing are widened.
+WIDEN_AFTER = 3
+
+
+def make_range(low, high):
+    """
+    :param low: (int) the lowest value a computation can give.
+    :param high: (int) the highest.
+    :return: (tuple) the range, or FULL if the value can wrap around.
+    """
+    if low < WORD_MIN or high > WORD_MAX:
+        return FULL
+    return low, high
+
+
+def join(first, second):
+    """
+    :return: (tuple) the smallest range holding both ranges.
+    """
+    return min(first[0], second[0]), max(first[1], second[1])
+
+
+def intersect(first, second):
+    """
+    :return: (tuple) the values in both ranges, or None if there are none.
+    """
+    low, high = max(first[0], second[0]), min(first[1], second[1])
+    if low > high:
+        return None
+    return low, high
+
+
+def join_states(first, second):
+    """
+    :param first: (dict) the range of each slot known on one path.
+    :param second: (dict) the same on another path.
+    :return: (dict) the ranges known whichever path was taken.
+    """
+    return {slot: join(value, second[slot]) for slot, value in first.items()
+            if slot in second}
+
+
+def widen(old, new, thresholds):
+    """
+    :param old: (dict) the ranges known at a loop header so far.
+    :param new: (dict) the ranges that reach it now.
+    :param thresholds: (list) the bounds ranges may widen to, sorted.
+    :return: (dict) the new ranges, with any bound that moved pushed out to
+    the next threshold.
+    """
+    widened = dict()
+    for slot, value in new.items():
+        if slot in old:
+            low, high = value
+            if low < old[slot][0]:
+                low = thresholds[bisect_right(thresholds, low) - 1]
+            if high > old[slot][1]:
+                high = thresholds[bisect_left(thresholds, high)]
+            value = (low, high)
+        widened[slot] = value
+    return widened
+
+
+def widening_thresholds(commands):
+    """
+    :param commands: (list) the commands of a function.
+    :return: (list) the bounds worth stopping at when a range widens: the
+    ends of a word and the values around each constant and its negation,
+    which are what loop tests compare with.
+    """
+    thresholds = {WORD_MIN, WORD_MAX, 0}
+    for command in commands:
+        if command.kind == PUSH and command.arg1 == CONSTANT:
+            for value in (command.arg2, -command.arg2):
+                thresholds.update(bound for bound
+                                  in (value - 1, value, value + 1)
+                                  if WORD_MIN <= bound <= WORD_MAX)
+    return sorted(thresholds)
+
+
+def bit_mask(value):
+    """
+    :param value: (int) a value that is not negative.
+    :return: (int) the smallest 2^k - 1 that is at least the value.
+    """
+    return (1 << value.bit_length()) - 1
+
+
+def binary_range(kind, first, second):
+    """
+    :param kind: (str) a binary command.
+    :param first: (tuple) the range of x.
+    :param second: (tuple) the range of y.
+    :return: (tuple) the range of the result.
+    """
+    if kind == ADD:
+        return make_range(first[0] + second[0], first[1] + second[1])
+    if kind == SUBTRUCT:
+        return make_range(first[0] - second[1], first[1] - second[0])
+    if kind == AND:
+        # the bits of a value that is not negative bound the result.
+        highs = [value[1] for value in (first, second) if value[0] >= 0]
+        if highs:
+            return 0, min(highs)
+        return FULL
+    if kind == OR:
+        if first[0] >= 0 and second[0] >= 0:
+            return (max(first[0], second[0]),
+                    bit_mask(max(first[1], second[1])))
+        return FULL
+    return BOOLEAN
+
+
+def unary_range(kind, operand):
+    """
+    :param kind: (str) neg or not.
+    :param operand: (tuple) the range of the value.
+    :return: (tuple) the range of the result.
+    """
+    if kind == NEGATE:
+        return make_range(-operand[1], -operand[0])
+    return -operand[1] - 1, -operand[0] - 1
+
+
+def cannot_overflow(first, second):
+    """
+    :param first: (tuple) the range of x.
+    :param second: (tuple) the range of y.
+    :return: (bool) True if x - y always fits in a word, so its sign alone
+    tells how x and y compare.
+    """
+    return (first[0] - second[1] >= WORD_MIN
+            and first[1] - second[0] <= WORD_MAX)
+
+
+class StackEntry:
+    """
+    a value on the stack as the analysis sees it. source is the slot it
+    was pushed from while the slot still holds it, and test is the
+    (comparison, x, y, negated) the value is the result of, if any, so a
+    branch on it can narrow the slots of x and y.
+    """
+    __slots__ = ("range", "source", "test")
+
+    def __init__(self, value_range, source=None, test=None):
+        self.range = value_range
+        self.source = source
+        self.test = test
+
+
+def refine(slots, test, holds):
+    """
+    :param slots: (dict) the ranges known before a branch.
+    :param test: (tuple) the comparison the branch is on.
+    :param holds: (bool) whether the comparison holds on this side.
+    :return: (dict) the ranges known on this side of the branch, or None
+    if it can never be taken.
+    """
+    kind, first, second, negated = test
+    if negated:
+        holds = not holds
+    if kind == GREATER_THEN:
+        kind, first, second = LOWER_THEN, second, first
+    low, high = first.range, second.range
+    if kind == EQUALS:
+        if not holds:
+            return dict(slots)
+        low = high = intersect(low, high)
+    elif holds:
+        # x < y
+        low = intersect(low, (WORD_MIN, high[1] - 1))
+        high = intersect(high, (first.range[0] + 1, WORD_MAX))
+    else:
+        # x >= y
+        low = intersect(low, (high[0], WORD_MAX))
+        high = intersect(high, (WORD_MIN, first.range[1]))
+    if low is None or high is None:
+        return None
+    refined = dict(slots)
+    for entry, value in ((first, low), (second, high)):
+        if entry.source is not None:
+            value = intersect(refined.get(entry.source, FULL), value)
+            if value is None:
+                return None
+            refined[entry.source] = value
+    return refined
+
+
+class BlockRanges:
+    """
+    runs the commands of one block over the ranges known at its start.
+    slots maps each tracked (segment, index) to its range (a slot that is
+    not there may hold anything), stack holds a StackEntry for each value
+    the block pushed, and unchecked the positions of the comparisons whose
+    operands can not overflow.
+    """
+    __slots__ = ("slots", "stack", "unchecked")
+
+    def __init__(self, slots):
+        self.slots = dict(slots)
+        self.stack = list()
+        self.unchecked = list()
+
+    def pop_entry(self):
+        """
+        :return: (StackEntry) the top value, or an unknown one if the block
+        did not push it.
+        """
+        if self.stack:
+            return self.stack.pop()
+        return StackEntry(FULL)
+
+    def forget(self, changed):
+        """
+        drops what the stack knows about slots that change.
+        :param changed: (function) True for a slot that changes.
+        """
+        for entry in self.stack:
+            if entry.source is not None and changed(entry.source):
+                entry.source = None
+            if entry.test is not None and (
+                    changed(entry.test[1].source)
+                    or changed(entry.test[2].source)):
+                entry.test = None
+
+    def visit(self, position, command):
+        """
+        :param position: (int) the position of the command in the function,
+        not counting labels.
+        :param command: (VMCommand) the command.
+        """
+        kind = command.kind
+        if kind == FUNCTION:
+            for index in range(command.arg2):
+                self.slots[(LOCAL, index)] = (0, 0)
+        elif kind == PUSH:
+            slot = (command.arg1, command.arg2)
+            if command.arg1 == CONSTANT:
+                self.stack.append(StackEntry((command.arg2, command.arg2)))
+            elif command.arg1 in TRACKED_SEGMENTS:
+                self.stack.append(StackEntry(self.slots.get(slot, FULL),
+                                             slot))
+            else:
+                self.stack.append(StackEntry(FULL))
+        elif kind == POP:
+            entry = self.pop_entry()
+            slot = (command.arg1, command.arg2)
+            if command.arg1 in TRACKED_SEGMENTS:
+                self.forget(lambda source: source == slot)
+                self.slots[slot] = entry.range
+        elif kind == COPY:
+            depth = len(self.stack) - 1 - command.arg2
+            if depth >= 0:
+                entry = self.stack[depth]
+                self.stack.append(StackEntry(entry.range, entry.source,
+                                             entry.test))
+            else:
+                self.stack.append(StackEntry(FULL))
+        elif kind in (NEGATE, NOT):
+            entry = self.pop_entry()
+            test = None
+            if kind == NOT and entry.test is not None:
+                test = entry.test[:3] + (not entry.test[3],)
+            self.stack.append(StackEntry(unary_range(kind, entry.range),
+                                         test=test))
+        elif kind in (ADD, SUBTRUCT, AND, OR) + COMPARISONS:
+            second = self.pop_entry()
+            first = self.pop_entry()
+            test = None
+            if kind in COMPARISONS:
+                test = (kind, first, second, False)
+                if kind != EQUALS and cannot_overflow(first.range,
+                                                      second.range):
+                    self.unchecked.append(position)
+            self.stack.append(StackEntry(
+                binary_range(kind, first.range, second.range), test=test))
+        elif kind == CALL:
+            for _ in range(command.arg2):
+                self.pop_entry()
+            self.forget(lambda source: source is not None
+                        and source[0] in CALL_CLOBBERED)
+            self.slots = {slot: value for slot, value in self.slots.items()
+                          if slot[0] not in CALL_CLOBBERED}
+            self.stack.append(StackEntry(FULL))
+
+    def run(self, block, first):
+        """
+        :param block: (BasicBlock) the block.
+        :param first: (int) the position of its first command.
+        :return: (StackEntry) the value an if-goto ending the block tests,
+        None if it does not end with one.
+        """
+        for offset, command in enumerate(block.commands):
+            if command.kind == IFGOTO:
+                return self.pop_entry()
+            self.visit(first + offset, command)
+        return None
+
+
+def successor_states(cfg, positions, index, ranges, tested):
+    """
+    :param cfg: (ControlFlowGraph) the graph of the function.
+    :param positions: (dict) the index of each block.
+    :param index: (int) the index of a block that was run.
+    :param ranges: (BlockRanges) the ranges at its end.
+    :param tested: (StackEntry) the value its if-goto tests, or None.
+    :return: (list) a (block index, ranges) pair for each block it can go
+    to, with the ranges narrowed by the branch taken.
+    """
+    block = cfg.blocks[index]
+    terminator = block.terminator()
+    states = list()
+    following = index + 1 if index + 1 < len(cfg.blocks) else None
+    if terminator is None:
+        if following is not None:
+            states.append((following, ranges.slots))
+        return states
+    if terminator.kind in (GOTO, IFGOTO):
+        target = cfg.label_blocks.get(terminator.arg1)
+        if target is not None:
+            slots = ranges.slots
+            if terminator.kind == IFGOTO and tested.test is not None:
+                slots = refine(slots, tested.test, True)
+            if slots is not None:
+                states.append((positions[target], slots))
+    if terminator.kind == IFGOTO and following is not None:
+        slots = ranges.slots
+        if tested.test is not None:
+            slots = refine(slots, tested.test, False)
+        if slots is not None:
+            states.append((following, slots))
+    return states
+
+
+def analyze_ranges(cfg, thresholds):
+    """
+    works out the ranges of the slots at the start of every block, growing
+    them until nothing changes.
+    :param cfg: (ControlFlowGraph) the graph of the function.
+    :param thresholds: (list) the bounds ranges widen to, sorted.
+    :return: (tuple) the ranges at the start of each block (None for the
+    ones that are never reached) and the position of the first command of
+    each block.
+    """
+    starts = list()
+    position = 0
+    for block in cfg.blocks:
+        starts.append(position)
+        position += len(block.commands)
+    positions = {block: index for index, block in enumerate(cfg.blocks)}
+    headers = set(positions[successor] for index, block
+                  in enumerate(cfg.blocks)
+                  for successor in block.successors
+                  if positions[successor] <= index)
+    states = [None] * len(cfg.blocks)
+    changes = [0] * len(cfg.blocks)
+    pending = set()
+    if cfg.blocks:
+        states[0] = dict()
+        pending.add(0)
+    while pending:
+        index = min(pending)
+        pending.remove(index)
+        ranges = BlockRanges(states[index])
+        tested = ranges.run(cfg.blocks[index], starts[index])
+        for successor, slots in successor_states(cfg, positions, index,
+                                                 ranges, tested):
+            old = states[successor]
+            new = slots if old is None else join_states(old, slots)
+            if (old is not None and successor in headers
+                    and changes[successor] >= WIDEN_AFTER):
+                new = widen(old, new, thresholds)
+            if new != old:
+                states[successor] = new
+                changes[successor] += 1
+                pending.add(successor)
+    return states, starts
+
+
+def mark_unchecked_compares(commands):
+    """
+    finds the gt/lt commands whose operands are always close enough that
+    x - y can not overflow, and marks them UNCHECKED so they are converted
+    without checking the signs first.
+    :param commands: (list) the commands of one function.
+    :return: (tuple) the new commands and how many comparisons were marked.
+    """
+    cfg = ControlFlowGraph(commands)
+    states, starts = analyze_ranges(cfg, widening_thresholds(commands))
+    unchecked = set()
+    for index, block in enumerate(cfg.blocks):
+        if states[index] is not None:
+            ranges = BlockRanges(states[index])
+            ranges.run(block, starts[index])
+            unchecked.update(ranges.unchecked)
+    new_commands = list()
+    position = 0
+    for command in commands:
+        if command.kind != LABEL:
+            if position in unchecked:
+                command = VMCommand(command.kind, UNCHECKED)
+            position += 1
+        new_commands.append(command)
+    return new_commands, len(unchecked)
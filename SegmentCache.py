@@ -0,0 +1,248 @@
+from Parser import PUSH, POP, LABEL, FUNCTION, CALL, RETURN, THIS, THAT, \
+    POINTER
+from StackDepth import SEGMENT_BASES
+
+# the segment that pop pointer i moves.
+POINTER_SEGMENTS = (THIS, THAT)
+# the scratch registers slot addresses are kept in.
+CACHE_REGISTERS = ("R13", "R14", "R15")
+# the most A=A+1/A=A-1 steps used to reach a slot from a known address,
+# past that the address is worked out again.
+MAX_STEPS = 2
+# the commands after which no address kept in a register can be trusted:
+# other code may jump to a label, and calls clobber the scratch registers.
+CLEARING_COMMANDS = (LABEL, FUNCTION, CALL, RETURN)
+
+
+def is_cached_access(command):
+    """
+    :param command: (VMCommand) a vm command.
+    :return: (bool) True if the command is a push/pop of a segment that is
+    addressed through its base register.
+    """
+    return command.kind in (PUSH, POP) and command.arg1 in SEGMENT_BASES
+
+
+def steps_to(known, wanted):
+    """
+    :param known: (int) the index whose address is known.
+    :param wanted: (int) the index to reach.
+    :return: (int) how many instructions after "@register" reach the wanted
+    slot, using A=M+1/A=M-1 for the first step.
+    """
+    return max(1, abs(wanted - known))
+
+
+class SegmentCache:
+    """
+    the addresses of segment slots that are held in scratch registers while
+    the commands of one function are converted. slots maps each register to
+    the (segment, index) whose address it holds, and order lists the
+    registers from the least to the most recently used. kept is the
+    indices of the pushes worth keeping the address of, because a later
+    command of the same block uses a slot near it.
+    """
+    __slots__ = ("slots", "order", "kept", "current")
+
+    def __init__(self, commands):
+        self.slots = dict()
+        self.order = list(CACHE_REGISTERS)
+        self.kept = self.plan(commands)
+        self.current = 0
+
+    @staticmethod
+    def plan(commands):
+        """
+        finds the pushes whose slot address should be kept: the ones a later
+        access of the same segment in the same block is close to, and that
+        are too far from the base to reach it directly.
+        :param commands: (list) the commands of the function.
+        :return: (set) the indices of those pushes.
+        """
+        kept = set()
+        # the indices of the pushes seen since the block started, for each
+        # segment.
+        recent = dict()
+        for position, command in enumerate(commands):
+            if command.kind in CLEARING_COMMANDS:
+                recent = dict()
+                continue
+            if command.kind == POP and command.arg1 == POINTER:
+                recent.pop(POINTER_SEGMENTS[command.arg2], None)
+                continue
+            if not is_cached_access(command):
+                continue
+            segment, index = command.arg1, command.arg2
+            if index > MAX_STEPS:
+                for earlier in recent.get(segment, ()):
+                    if abs(commands[earlier].arg2 - index) <= MAX_STEPS:
+                        kept.add(earlier)
+            if command.kind == PUSH:
+                recent.setdefault(segment, list()).append(position)
+        return kept
+
+    def visit(self, position, command):
+        """
+        called before each command is converted, to forget the addresses the
+        command makes wrong.
+        :param position: (int) the index of the command in the function.
+        :param command: (VMCommand) the command.
+        """
+        self.current = position
+        if command.kind in CLEARING_COMMANDS:
+            self.clear()
+        elif command.kind == POP and command.arg1 == POINTER:
+            self.forget(POINTER_SEGMENTS[command.arg2])
+
+    def clear(self):
+        """
+        forgets every kept address, for code that clobbers the registers.
+        """
+        self.slots = dict()
+
+    def forget(self, segment):
+        """
+        :param segment: (str) a segment whose base register changes.
+        """
+        for register, slot in list(self.slots.items()):
+            if slot[0] == segment:
+                del self.slots[register]
+
+    def nearest(self, segment, index):
+        """
+        :param segment: (str) the segment.
+        :param index: (int) the index in it.
+        :return: (tuple) the register holding the nearest known address of
+        the segment (the base register itself holds index 0) and the index
+        it holds, or None if none is close enough.
+        """
+        best = None
+        candidates = [(SEGMENT_BASES[segment], 0)]
+        for register in reversed(self.order):
+            slot = self.slots.get(register)
+            if slot is not None and slot[0] == segment:
+                candidates.append((register, slot[1]))
+        for register, known in candidates:
+            if steps_to(known, index) > MAX_STEPS:
+                continue
+            if best is None or steps_to(known, index) < steps_to(best[1],
+                                                                index):
+                best = (register, known)
+        return best
+
+    def use(self, register):
+        """
+        :param register: (str) a scratch register that was just used.
+        """
+        if register in self.order:
+            self.order.remove(register)
+            self.order.append(register)
+
+    def keep(self, segment, index):
+        """
+        takes the least recently used register for a new address.
+        :param segment: (str) the segment.
+        :param index: (int) the index in it.
+        :return: (str) the register the address should be stored in.
+        """
+        register = self.order[0]
+        self.slots[register] = (segment, index)
+        self.use(register)
+        return register
+
+    def convert_address(self, lines, segment, index):
+        """
+        points A at a slot without touching D, if a known address is close
+        enough.
+        :param lines: (InstructionList) the commands to add to.
+        :param segment: (str) the segment.
+        :param index: (int) the index in it.
+        :return: (bool) True if the commands were added.
+        """
+        nearest = self.nearest(segment, index)
+        if nearest is None:
+            return False
+        register, known = nearest
+        self.use(register)
+        lines.at(register)
+        if index == known:
+            lines.assign("A", "M")
+            return True
+        lines.assign("A", "M+1" if index > known else "M-1")
+        for _ in range(abs(index - known) - 1):
+            lines.assign("A", "A+1" if index > known else "A-1")
+        return True
+
+    def convert_load(self, lines, segment, index):
+        """
+        puts the value of a segment slot in D.
+        :param lines: (InstructionList) the commands to add to.
+        :param segment: (str) the segment.
+        :param index: (int) the index in it.
+        """
+        if self.convert_address(lines, segment, index):
+            lines.assign("D", "M")
+            return
+        lines.at(index)
+        lines.assign("D", "A")
+        lines.at(SEGMENT_BASES[segment])
+        if self.current in self.kept:
+            lines.assign("D", "D+M")
+            lines.at(self.keep(segment, index))
+            lines.assign("AM", "D")
+        else:
+            lines.assign("A", "D+M")
+        lines.assign("D", "M")
+
+    def convert_store_start(self, lines, segment, index):
+        """
+        the part of a pop that comes before the value is read: when the slot
+        is not close to a known address, its address is kept in a register.
+        :param lines: (InstructionList) the commands to add to.
+        :param segment: (str) the segment.
+        :param index: (int) the index in it.
+        """
+        if self.nearest(segment, index) is not None:
+            return
+        lines.at(index)
+        lines.assign("D", "A")
+        lines.at(SEGMENT_BASES[segment])
+        lines.assign("D", "D+M")
+        lines.at(self.keep(segment, index))
+        lines.assign("M", "D")
+
+    def convert_store_end(self, lines, segment, index):
+        """
+        the rest of a pop, writing the value in D to the slot.
+        :param lines: (InstructionList) the commands to add to.
+        :param segment: (str) the segment.
+        :param index: (int) the index in it.
+        """
+        self.convert_address(lines, segment, index)
+        lines.assign("M", "D")
+
+    def convert_command(self, lines, command):
+        """
+        converts a push/pop of a segment addressed through its base register,
+        moving SP in ram like the other converters do.
+        :param lines: (InstructionList) the commands to add to.
+        :param command: (VMCommand) the vm command.
+        :return: (bool) True if the command was converted, False if it is
+        not such a push/pop.
+        """
+        if not is_cached_access(command):
+            return False
+        segment, index = command.arg1, command.arg2
+        if command.kind == PUSH:
+            self.convert_load(lines, segment, index)
+            lines.at("SP")
+            lines.assign("M", "M+1")
+            lines.assign("A", "M-1")
+            lines.assign("M", "D")
+            return True
+        self.convert_store_start(lines, segment, index)
+        lines.at("SP")
+        lines.assign("AM", "M-1")
+        lines.assign("D", "M")
+        self.convert_store_end(lines, segment, index)
+        return True
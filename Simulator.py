@@ -0,0 +1,296 @@
+import argparse
+import json
+import sys
+
+from Instructions import A_INSTRUCTION, C_INSTRUCTION, L_INSTRUCTION, \
+    COMPS, COMP_CODES, JUMP_CODES, InstructionList, symbol_table
+
+RAM_SIZE = 32768
+FIRST_VARIABLE = 16
+DEFAULT_MAX_CYCLES = 5000000
+PREDEFINED_SYMBOLS = {"SP": 0, "LCL": 1, "ARG": 2, "THIS": 3, "THAT": 4,
+                      "SCREEN": 16384, "KBD": 24576}
+for register in range(16):
+    PREDEFINED_SYMBOLS["R" + str(register)] = register
+# why a run stopped.
+HALTED = "halted"
+OUT_OF_CYCLES = "out of cycles"
+OUT_OF_ROM = "out of rom"
+# each comp code as a function of the A, D and M registers.
+COMP_FUNCTIONS = {
+    "0": lambda a, d, m: 0,
+    "1": lambda a, d, m: 1,
+    "-1": lambda a, d, m: -1,
+    "D": lambda a, d, m: d,
+    "A": lambda a, d, m: a,
+    "!D": lambda a, d, m: ~d,
+    "!A": lambda a, d, m: ~a,
+    "-D": lambda a, d, m: -d,
+    "-A": lambda a, d, m: -a,
+    "D+1": lambda a, d, m: d + 1,
+    "A+1": lambda a, d, m: a + 1,
+    "D-1": lambda a, d, m: d - 1,
+    "A-1": lambda a, d, m: a - 1,
+    "D+A": lambda a, d, m: d + a,
+    "D-A": lambda a, d, m: d - a,
+    "A-D": lambda a, d, m: a - d,
+    "D&A": lambda a, d, m: d & a,
+    "D|A": lambda a, d, m: d | a,
+    "M": lambda a, d, m: m,
+    "!M": lambda a, d, m: ~m,
+    "-M": lambda a, d, m: -m,
+    "M+1": lambda a, d, m: m + 1,
+    "M-1": lambda a, d, m: m - 1,
+    "D+M": lambda a, d, m: d + m,
+    "D-M": lambda a, d, m: d - m,
+    "M-D": lambda a, d, m: m - d,
+    "D&M": lambda a, d, m: d & m,
+    "D|M": lambda a, d, m: d | m,
+}
+COMP_TABLE = [COMP_FUNCTIONS[comp] for comp in COMPS]
+USES_M = [("M" in comp) for comp in COMPS]
+# for each jump code, whether to jump for a negative, zero and positive out.
+JUMP_TABLE = [(False, False, False), (False, False, True),
+              (False, True, False), (False, True, True),
+              (True, False, False), (True, False, True),
+              (True, True, False), (True, True, True)]
+# the ends of the names of the labels the translator puts at the start of
+# its shared routines, which a profile counts like functions.
+ROUTINE_SUFFIXES = ("$intrinsic", "$guard")
+
+
+def is_function_label(name):
+    """
+    :param name: (str) a label of a translated program.
+    :return: (bool) True if the label starts a vm function (File.name) or
+    one of the shared routines of the translator.
+    """
+    return (("." in name and "$" not in name)
+            or name.endswith(ROUTINE_SUFFIXES) or name.startswith("VM$"))
+
+
+def to_word(value):
+    """
+    :param value: (int) any integer.
+    :return: (int) the value cut to a signed 16 bit word.
+    """
+    return ((value + 32768) & 0xFFFF) - 32768
+
+
+class Machine:
+    """
+    a headless hack computer running an assembled program.
+    rom holds (is_a, value, dest, comp, jump) for each instruction, labels
+    maps each label to its rom address and variables maps each variable the
+    assembler found to its ram address. counts holds how many times each
+    instruction ran when the machine records a profile, else it is None.
+    """
+    __slots__ = ("rom", "labels", "variables", "halts", "ram", "pc", "a",
+                 "d", "cycles", "counts")
+
+    def __init__(self, instructions, profile=False):
+        self.rom = list()
+        self.labels = dict()
+        self.variables = dict()
+        self.assemble(instructions)
+        self.halts = {pc for pc in range(len(self.rom)) if self.is_halt(pc)}
+        self.ram = [0] * RAM_SIZE
+        self.pc = 0
+        self.a = 0
+        self.d = 0
+        self.cycles = 0
+        self.counts = [0] * len(self.rom) if profile else None
+
+    def assemble(self, instructions):
+        """
+        resolves the labels and variables of the instructions, the same way
+        the hack assembler does.
+        :param instructions: (InstructionList) the program.
+        """
+        address = 0
+        for index in range(len(instructions)):
+            if instructions.kind(index) == L_INSTRUCTION:
+                name = symbol_table.name(instructions.symbol(index))
+                self.labels[name] = address
+            else:
+                address += 1
+        next_variable = FIRST_VARIABLE
+        for index in range(len(instructions)):
+            kind = instructions.kind(index)
+            if kind == A_INSTRUCTION:
+                name = symbol_table.name(instructions.symbol(index))
+                if name.isdigit():
+                    value = int(name)
+                elif name in PREDEFINED_SYMBOLS:
+                    value = PREDEFINED_SYMBOLS[name]
+                elif name in self.labels:
+                    value = self.labels[name]
+                else:
+                    if name not in self.variables:
+                        self.variables[name] = next_variable
+                        next_variable += 1
+                    value = self.variables[name]
+                self.rom.append((True, to_word(value), 0, 0, 0))
+            elif kind == C_INSTRUCTION:
+                self.rom.append((False, 0) + instructions.fields(index))
+
+    def is_halt(self, pc):
+        """
+        :param pc: (int) a rom address.
+        :return: (bool) True if the instructions there are "@pc; 0;JMP", the
+        loop hack programs end with.
+        """
+        if pc + 1 >= len(self.rom):
+            return False
+        is_a, value, _, _, _ = self.rom[pc]
+        _, _, dest, comp, jump = self.rom[pc + 1]
+        return (is_a and value == pc and dest == 0
+                and jump == JUMP_CODES["JMP"] and comp == COMP_CODES["0"])
+
+    def run(self, max_cycles=DEFAULT_MAX_CYCLES):
+        """
+        runs the program until it reaches a halt loop, runs past the end of
+        the rom or runs for max_cycles instructions.
+        :param max_cycles: (int) the most instructions to run.
+        :return: (str) why the run stopped.
+        """
+        rom = self.rom
+        ram = self.ram
+        halts = self.halts
+        counts = self.counts
+        pc, a, d = self.pc, self.a, self.d
+        cycles = self.cycles
+        reason = OUT_OF_CYCLES
+        while cycles < max_cycles:
+            if pc >= len(rom) or pc < 0:
+                reason = OUT_OF_ROM
+                break
+            if pc in halts:
+                reason = HALTED
+                break
+            is_a, value, dest, comp, jump = rom[pc]
+            cycles += 1
+            if counts is not None:
+                counts[pc] += 1
+            if is_a:
+                a = value
+                pc += 1
+                continue
+            address = a & 0x7FFF
+            m = ram[address] if USES_M[comp] else 0
+            out = to_word(COMP_TABLE[comp](a, d, m))
+            if dest & 1:
+                ram[address] = out
+            if dest & 2:
+                d = out
+            if dest & 4:
+                a = out
+            if jump:
+                # the cpu jumps to the address A held before this instruction.
+                negative, zero, positive = JUMP_TABLE[jump]
+                if ((out < 0 and negative) or (out == 0 and zero)
+                        or (out > 0 and positive)):
+                    pc = address
+                    continue
+            pc += 1
+        self.pc, self.a, self.d = pc, a, d
+        self.cycles = cycles
+        return reason
+
+    def profile(self):
+        """
+        sums the counts of a profiling run by the labels of the program.
+        :return: (dict) the cycles run, the calls and cycles of each function
+        (the instructions from its label to the next function) and how many
+        times each other label was reached.
+        """
+        starts = sorted((address, name)
+                        for name, address in self.labels.items()
+                        if is_function_label(name))
+        functions = dict()
+        for index, (address, name) in enumerate(starts):
+            end = len(self.rom)
+            if index + 1 < len(starts):
+                end = starts[index + 1][0]
+            calls = self.counts[address] if address < len(self.rom) else 0
+            functions[name] = {"calls": calls,
+                               "cycles": sum(self.counts[address:end])}
+        labels = {name: self.counts[address]
+                  for name, address in self.labels.items()
+                  if not is_function_label(name) and address < len(self.rom)}
+        return {"cycles": self.cycles, "functions": functions,
+                "labels": labels}
+
+    def symbol(self, name):
+        """
+        :param name: (str) a variable or predefined symbol.
+        :return: (int) the value in ram of the symbol, None if the program
+        never used it.
+        """
+        address = self.variables.get(name, PREDEFINED_SYMBOLS.get(name))
+        if address is None:
+            return None
+        return self.ram[address]
+
+
+def read_assembly(file_name):
+    """
+    reads a hack Assembly file into an instruction list.
+    :param file_name: (str) the .asm file.
+    :return: (InstructionList) the instructions in it.
+    """
+    instructions = InstructionList()
+    with open(file_name, "r") as file:
+        for line in file:
+            line = "".join(line.split())
+            if "//" in line:
+                line = line[0:line.index("//")]
+            if len(line) == 0:
+                continue
+            if line.startswith("@"):
+                instructions.at(line[1:])
+            elif line.startswith("("):
+                instructions.label(line[1:-1])
+            else:
+                jump = ""
+                if ";" in line:
+                    line, jump = line.split(";")
+                dest = ""
+                if "=" in line:
+                    dest, line = line.split("=")
+                if jump:
+                    instructions.jump(line, jump)
+                    if dest:
+                        raise ValueError("dest and jump together are not "
+                                         "supported: " + dest)
+                else:
+                    instructions.assign(dest, line)
+    return instructions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="runs a hack Assembly program without a screen.")
+    parser.add_argument("path", help="the .asm file")
+    parser.add_argument("--cycles", type=int, default=DEFAULT_MAX_CYCLES,
+                        help="the most instructions to run")
+    parser.add_argument("--ram", type=int, default=16,
+                        help="how many words of ram to print from 0")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="write the calls and cycles of each function "
+                             "and the times each label was reached to FILE, "
+                             "as json the translator takes with --profile")
+    arguments = parser.parse_args(sys.argv[1:])
+    machine = Machine(read_assembly(arguments.path),
+                      arguments.profile is not None)
+    reason = machine.run(arguments.cycles)
+    print(reason + " after " + str(machine.cycles) + " cycles")
+    if arguments.profile is not None:
+        with open(arguments.profile, "w") as file:
+            json.dump(machine.profile(), file, indent=1, sort_keys=True)
+    for address in range(arguments.ram):
+        print("RAM[" + str(address) + "] = " + str(machine.ram[address]))
+
+
+if __name__ == '__main__':
+    main()
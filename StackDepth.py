@@ -0,0 +1,309 @@
+from ControlFlow import ControlFlowGraph
+from Parser import PUSH, POP, ADD, SUBTRUCT, NEGATE, EQUALS, GREATER_THEN, \
+    LOWER_THEN, AND, OR, NOT, IFGOTO, CALL, RETURN, COPY, CONSTANT, LOCAL, \
+    THIS, THAT, ARGUMENT, STATIC, TEMP, FIXED
+from Promotion import FIXED_PREFIX
+
+# how many values each command pops and pushes. a call pops its arguments
+# and pushes the return value, and the commands that are not here do not
+# touch the working stack.
+STACK_EFFECTS = {PUSH: (0, 1), POP: (1, 0), ADD: (2, 1), SUBTRUCT: (2, 1),
+                 NEGATE: (1, 1), EQUALS: (2, 1), GREATER_THEN: (2, 1),
+                 LOWER_THEN: (2, 1), AND: (2, 1), OR: (2, 1), NOT: (1, 1),
+                 IFGOTO: (1, 0), RETURN: (1, 0), COPY: (0, 1)}
+# the registers that hold the base address of each segment.
+SEGMENT_BASES = {LOCAL: "LCL", ARGUMENT: "ARG", THIS: "THIS", THAT: "THAT"}
+POINTER_REGISTERS = ("THIS", "THAT")
+# the combinations that work on the top two values, as the comp that puts
+# the result in M when D is the top and M the value under it.
+BINARY_COMPS = {ADD: "D+M", SUBTRUCT: "M-D", AND: "D&M", OR: "D|M"}
+UNARY_COMPS = {NEGATE: "-M", NOT: "!M"}
+# a register the address of a pop is kept in while the value is read.
+ADDRESS_REGISTER = "R13"
+# moves of SP that are cheaper as M=M+1 steps than through D.
+MAX_STEPS = 3
+# how far SP in ram may be from the real one before it is written back, so
+# the slots used stay a few steps from it.
+MAX_OFFSET = 1
+
+
+def stack_effect(command):
+    """
+    :param command: (VMCommand) a vm command.
+    :return: (tuple) how many values the command pops and then pushes.
+    """
+    if command.kind == CALL:
+        return command.arg2, 1
+    return STACK_EFFECTS.get(command.kind, (0, 0))
+
+
+def block_peak(block, depth):
+    """
+    :param block: (BasicBlock) a basic block.
+    :param depth: (int) the depth of the working stack when it starts.
+    :return: (tuple) the deepest the stack gets in the block and its depth
+    at the end.
+    """
+    peak = depth
+    for command in block.commands:
+        pops, pushes = stack_effect(command)
+        depth += pushes - pops
+        peak = max(peak, depth)
+    return peak, depth
+
+
+def block_depths(cfg):
+    """
+    works out the depth of the working stack (the values above the locals)
+    at the start of each block, going from the entry of the function along
+    the edges of the graph.
+    :param cfg: (ControlFlowGraph) the graph of the function.
+    :return: (dict) the depth at the start of each reachable block, or None
+    if two paths reach a block with different depths.
+    """
+    depths = dict()
+    entry = cfg.entry()
+    if entry is None:
+        return depths
+    depths[entry] = 0
+    stack = [entry]
+    while stack:
+        block = stack.pop()
+        _, depth = block_peak(block, depths[block])
+        for successor in block.successors:
+            if successor not in depths:
+                depths[successor] = depth
+                stack.append(successor)
+            elif depths[successor] != depth:
+                return None
+    return depths
+
+
+def max_stack_depth(commands):
+    """
+    :param commands: (list) the commands of one function.
+    :return: (int) the most values the function keeps on its working stack
+    at once, not counting its locals or the frames of functions it calls,
+    or None if it can not be known statically.
+    """
+    depths = block_depths(ControlFlowGraph(commands))
+    if depths is None:
+        return None
+    peak = 0
+    for block, depth in depths.items():
+        peak = max(peak, block_peak(block, depth)[0])
+    return peak
+
+
+def convert_slot_address(lines, slot, move=0):
+    """
+    points A at a slot of the stack relative to the SP in ram. a slot more
+    than MAX_STEPS away is reached through D, so D is only kept for slots
+    that are closer.
+    :param lines: (InstructionList) the commands to add to.
+    :param slot: (int) the offset of the slot from SP, -1 is the top of the
+    stack when SP is up to date.
+    :param move: (int) 1 or -1 to also move SP in ram one step that way on
+    the way to the slot, which costs nothing more, or 0 to leave it.
+    """
+    if move:
+        lines.at("SP")
+        lines.assign("AM", "M+1" if move > 0 else "M-1")
+        slot -= move
+        for _ in range(abs(slot)):
+            lines.assign("A", "A+1" if slot > 0 else "A-1")
+        return
+    if abs(slot) > MAX_STEPS:
+        lines.at(abs(slot))
+        lines.assign("D", "A")
+        lines.at("SP")
+        lines.assign("A", "D+M" if slot > 0 else "M-D")
+        return
+    lines.at("SP")
+    if slot == 0:
+        lines.assign("A", "M")
+        return
+    lines.assign("A", "M+1" if slot > 0 else "M-1")
+    for _ in range(abs(slot) - 1):
+        lines.assign("A", "A+1" if slot > 0 else "A-1")
+
+
+def convert_stack_adjust(lines, offset):
+    """
+    writes back the moves of SP that were left out, so SP in ram is right
+    again (at the end of a block).
+    :param lines: (InstructionList) the commands to add to.
+    :param offset: (int) how far the real SP is above the one in ram.
+    """
+    if offset == 0:
+        return
+    if abs(offset) <= MAX_STEPS:
+        lines.at("SP")
+        for _ in range(abs(offset)):
+            lines.assign("M", "M+1" if offset > 0 else "M-1")
+        return
+    lines.at(abs(offset))
+    lines.assign("D", "A")
+    lines.at("SP")
+    lines.assign("M", "D+M" if offset > 0 else "M-D")
+
+
+def convert_load(lines, segment, index, file_name):
+    """
+    puts the value of a segment slot in D.
+    :param lines: (InstructionList) the commands to add to.
+    :param segment: (str) the segment, not constant.
+    :param index: (int) the index in the segment.
+    :param file_name: (str) the vm file name (for static).
+    """
+    if segment in SEGMENT_BASES:
+        lines.at(index)
+        lines.assign("D", "A")
+        lines.at(SEGMENT_BASES[segment])
+        lines.assign("A", "D+M")
+    elif segment == TEMP:
+        lines.at(index + 5)
+    elif segment == STATIC:
+        lines.at(file_name + str(index))
+    elif segment == FIXED:
+        lines.at(FIXED_PREFIX + str(index))
+    else:
+        lines.at(POINTER_REGISTERS[index])
+    lines.assign("D", "M")
+
+
+def convert_offset_push(lines, command, offset, file_name, cache=None):
+    """
+    a push that writes the slot SP + offset. SP in ram is left alone unless
+    it is already behind, then it moves up with the push so the offset does
+    not keep growing.
+    :param lines: (InstructionList) the commands to add to.
+    :param command: (VMCommand) the push.
+    :param offset: (int) how far the real SP is above the one in ram.
+    :param file_name: (str) the vm file name (for static).
+    :param cache: (SegmentCache) the segment addresses known, or None.
+    :return: (int) the offset after the push.
+    """
+    segment, index = command.arg1, command.arg2
+    move = 1 if offset > 0 else 0
+    if segment == CONSTANT and index in (0, 1):
+        convert_slot_address(lines, offset, move)
+        lines.assign("M", str(index))
+        return offset + 1 - move
+    if segment == CONSTANT:
+        lines.at(index)
+        lines.assign("D", "A")
+    elif cache is not None and segment in SEGMENT_BASES:
+        cache.convert_load(lines, segment, index)
+    else:
+        convert_load(lines, segment, index, file_name)
+    convert_slot_address(lines, offset, move)
+    lines.assign("M", "D")
+    return offset + 1 - move
+
+
+def convert_offset_pop(lines, command, offset, file_name, cache=None):
+    """
+    a pop that reads the slot SP + offset - 1. SP in ram is left alone
+    unless it is already ahead, then it moves down with the pop.
+    :param lines: (InstructionList) the commands to add to.
+    :param command: (VMCommand) the pop.
+    :param offset: (int) how far the real SP is above the one in ram.
+    :param file_name: (str) the vm file name (for static).
+    :param cache: (SegmentCache) the segment addresses known, or None.
+    :return: (int) the offset after the pop.
+    """
+    segment, index = command.arg1, command.arg2
+    move = -1 if offset < 0 else 0
+    if cache is not None and segment in SEGMENT_BASES:
+        cache.convert_store_start(lines, segment, index)
+        convert_slot_address(lines, offset - 1, move)
+        lines.assign("D", "M")
+        cache.convert_store_end(lines, segment, index)
+        return offset - 1 - move
+    if segment in SEGMENT_BASES:
+        lines.at(index)
+        lines.assign("D", "A")
+        lines.at(SEGMENT_BASES[segment])
+        lines.assign("D", "D+M")
+        lines.at(ADDRESS_REGISTER)
+        lines.assign("M", "D")
+    convert_slot_address(lines, offset - 1, move)
+    lines.assign("D", "M")
+    if segment in SEGMENT_BASES:
+        lines.at(ADDRESS_REGISTER)
+        lines.assign("A", "M")
+    elif segment == TEMP:
+        lines.at(index + 5)
+    elif segment == STATIC:
+        lines.at(file_name + str(index))
+    elif segment == FIXED:
+        lines.at(FIXED_PREFIX + str(index))
+    else:
+        lines.at(POINTER_REGISTERS[index])
+    lines.assign("M", "D")
+    return offset - 1 - move
+
+
+def convert_offset_command(lines, command, offset, file_name, cache=None):
+    """
+    converts a command that only moves values on the stack without writing
+    SP back to ram, addressing the slots it uses relative to the SP in ram.
+    SP is written back first when it is more than MAX_OFFSET away.
+    :param lines: (InstructionList) the commands to add to.
+    :param command: (VMCommand) the vm command.
+    :param offset: (int) how far the real SP is above the one in ram.
+    :param file_name: (str) the vm file name (for static).
+    :param cache: (SegmentCache) the segment addresses known, or None.
+    :return: (int) the offset after the command, or None if the command
+    needs SP in ram to be right (and nothing was added).
+    """
+    kind = command.kind
+    if ((kind not in (PUSH, POP, COPY) and kind not in BINARY_COMPS
+         and kind not in UNARY_COMPS)
+            or (kind == POP and command.arg1 == CONSTANT)):
+        return None
+    if abs(offset) > MAX_OFFSET:
+        convert_stack_adjust(lines, offset)
+        offset = 0
+    if kind == PUSH:
+        return convert_offset_push(lines, command, offset, file_name, cache)
+    if kind == POP:
+        return convert_offset_pop(lines, command, offset, file_name, cache)
+    if kind in BINARY_COMPS:
+        convert_slot_address(lines, offset - 1)
+        lines.assign("D", "M")
+        lines.assign("A", "A-1")
+        lines.assign("M", BINARY_COMPS[kind])
+        return offset - 1
+    if kind in UNARY_COMPS:
+        convert_slot_address(lines, offset - 1)
+        lines.assign("M", UNARY_COMPS[kind])
+        return offset
+    if kind == COPY:
+        convert_slot_address(lines, offset - 1 - command.arg2)
+        lines.assign("D", "M")
+        if command.arg2 < MAX_STEPS:
+            for _ in range(command.arg2 + 1):
+                lines.assign("A", "A+1")
+        else:
+            convert_slot_address(lines, offset)
+        lines.assign("M", "D")
+        return offset + 1
+    return None
+
+
+def convert_offset_ifgoto(lines, offset, target):
+    """
+    an if-goto at the end of a block, which writes back SP together with
+    its own pop.
+    :param lines: (InstructionList) the commands to add to.
+    :param offset: (int) how far the real SP is above the one in ram.
+    :param target: (str) the full label to jump to.
+    """
+    convert_stack_adjust(lines, offset - 1)
+    lines.at("SP")
+    lines.assign("A", "M")
+    lines.assign("D", "M")
+    lines.at(target)
+    lines.jump("D", "JNE")
@@ -0,0 +1,202 @@
+from Parser import VMCommand, PUSH, POP, ADD, SUBTRUCT, NEGATE, EQUALS, \
+    GREATER_THEN, LOWER_THEN, AND, OR, NOT, COPY, CONSTANT, LOCAL, THIS, \
+    THAT, ARGUMENT, POINTER
+
+BINARY = (ADD, SUBTRUCT, EQUALS, GREATER_THEN, LOWER_THEN, AND, OR)
+# the binary commands whose operands can be swapped.
+COMMUTATIVE = (ADD, EQUALS, AND, OR)
+UNARY = (NEGATE, NOT)
+# the segments reached through a base register, which can point anywhere in
+# ram. the other segments (static, temp, pointer) have fixed addresses.
+INDIRECT_SEGMENTS = (LOCAL, ARGUMENT, THIS, THAT)
+# a single push is only worth a copy when its value is this close to the
+# top, deeper copies cost as much as the push itself.
+MAX_SINGLE_DEPTH = 1
+# the single pushes that cost more than a copy.
+COSTLY_PUSHES = INDIRECT_SEGMENTS + (POINTER,)
+
+
+class StackValue:
+    """
+    a value on the stack of a block as value numbering sees it. number is
+    its value number and start is the index in the new commands where the
+    commands that computed it start, None if they are not all in the block
+    or may not be run twice (so they can not be replaced).
+    """
+    __slots__ = ("number", "start")
+
+    def __init__(self, number, start):
+        self.number = number
+        self.start = start
+
+
+def is_worth_copying(span, depth):
+    """
+    :param span: (list) the commands that compute a value.
+    :param depth: (int) how deep under the top the same value already is.
+    :return: (bool) True if copying the value is cheaper than the commands.
+    """
+    if len(span) > 1:
+        return True
+    return span[0].arg1 in COSTLY_PUSHES and depth <= MAX_SINGLE_DEPTH
+
+
+class ValueNumbering:
+    """
+    value numbering over the blocks of one function. slots maps each
+    (segment, index) read or written in the block to the number of the
+    value it holds, expressions maps each (command, operand numbers)
+    computed so far to its number, and stack holds a StackValue for each
+    value the block pushed. folds counts the values replaced by copies and
+    saved the commands removed.
+    """
+    __slots__ = ("slots", "expressions", "stack", "next_number", "folds",
+                 "saved")
+
+    def __init__(self):
+        self.slots = dict()
+        self.expressions = dict()
+        self.stack = list()
+        self.next_number = 0
+        self.folds = 0
+        self.saved = 0
+
+    def new_number(self):
+        """
+        :return: (int) a value number no other value has.
+        """
+        self.next_number += 1
+        return self.next_number
+
+    def reset(self):
+        """
+        forgets everything known, at the start of a block.
+        """
+        self.slots = dict()
+        self.expressions = dict()
+        self.stack = list()
+
+    def pop_value(self):
+        """
+        :return: (StackValue) the top value, or an unknown one if the block
+        did not push it.
+        """
+        if self.stack:
+            return self.stack.pop()
+        return StackValue(self.new_number(), None)
+
+    def number_of(self, key):
+        """
+        :param key: (tuple) a slot or an expression.
+        :return: (int) the value number it already has, or a new one.
+        """
+        if key not in self.expressions:
+            self.expressions[key] = self.new_number()
+        return self.expressions[key]
+
+    def store(self, segment, index, number):
+        """
+        records a pop, forgetting the slots it may have changed.
+        :param segment: (str) the segment popped to.
+        :param index: (int) the index in it.
+        :param number: (int) the value number written.
+        """
+        # a base register can point at any address, so a write through one
+        # may change any slot but the other slots of the same segment, and a
+        # write to a fixed address (pointer included, as it moves this or
+        # that) may change any slot read through one.
+        kept = dict()
+        for slot, value in self.slots.items():
+            if segment in INDIRECT_SEGMENTS:
+                if slot[0] == segment and slot[1] != index:
+                    kept[slot] = value
+            elif slot[0] not in INDIRECT_SEGMENTS and slot != (segment,
+                                                               index):
+                kept[slot] = value
+        kept[(segment, index)] = number
+        self.slots = kept
+
+    def push_value(self, commands, number, start):
+        """
+        pushes the value the new commands from start on computed, and
+        replaces those commands by a copy when the same value is already on
+        the stack.
+        :param commands: (list) the new commands so far.
+        :param number: (int) the value number of the value.
+        :param start: (int) where the commands that computed it start, or
+        None.
+        """
+        if start is not None:
+            for position in range(len(self.stack) - 1, -1, -1):
+                if self.stack[position].number != number:
+                    continue
+                depth = len(self.stack) - 1 - position
+                span = commands[start:]
+                if is_worth_copying(span, depth):
+                    del commands[start:]
+                    commands.append(VMCommand(COPY, None, depth))
+                    self.folds += 1
+                    self.saved += len(span) - 1
+                break
+        self.stack.append(StackValue(number, start))
+
+    def visit(self, commands, command):
+        """
+        adds a command to the new commands, or a copy in place of the
+        commands that computed its value again.
+        :param commands: (list) the new commands so far.
+        :param command: (VMCommand) the next original command.
+        """
+        kind = command.kind
+        start = len(commands)
+        commands.append(command)
+        if kind == PUSH:
+            if command.arg1 == CONSTANT:
+                number = self.number_of((CONSTANT, command.arg2))
+            else:
+                # a slot popped to in the block holds the value popped.
+                slot = (command.arg1, command.arg2)
+                if slot not in self.slots:
+                    self.slots[slot] = self.new_number()
+                number = self.slots[slot]
+            self.push_value(commands, number, start)
+        elif kind in BINARY:
+            second = self.pop_value()
+            first = self.pop_value()
+            operands = (first.number, second.number)
+            if kind in COMMUTATIVE:
+                operands = tuple(sorted(operands))
+            if first.start is None or second.start is None:
+                start = None
+            else:
+                start = first.start
+            self.push_value(commands, self.number_of((kind,) + operands),
+                            start)
+        elif kind in UNARY:
+            operand = self.pop_value()
+            self.push_value(commands, self.number_of((kind, operand.number)),
+                            operand.start)
+        elif kind == POP:
+            self.store(command.arg1, command.arg2, self.pop_value().number)
+            # the commands of the values under it are no longer in one piece.
+            for value in self.stack:
+                value.start = None
+        else:
+            # labels, jumps, calls and returns end the block, and what the
+            # stack and memory hold after them is not known.
+            self.reset()
+
+
+def number_values(commands):
+    """
+    replaces values a block computes again while they are still on the
+    stack by copies of them.
+    :param commands: (list) the commands of one function.
+    :return: (tuple) the new commands, how many values were replaced and how
+    many commands were removed.
+    """
+    numbering = ValueNumbering()
+    new_commands = list()
+    for command in commands:
+        numbering.visit(new_commands, command)
+    return new_commands, numbering.folds, numbering.saved